@@ -0,0 +1,7 @@
+"""Google Cloud integration module."""
+
+from .google_cloud_agent import GoogleCloudAgent
+from .firestore_agent import FirestoreAgent
+from .pubsub_agent import PubSubAgent
+
+__all__ = ['GoogleCloudAgent', 'FirestoreAgent', 'PubSubAgent']
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Firestore Storage Benchmark - In-memory dict store versus the SQLite backend
+Times bulk loads, point reads, merges, indexed and scanning queries, and reopening
+
+Run from ai_stack/: python -m google_cloud.bench_firestore_storage [--documents N]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, Any
+
+from .firestore_query import Filter, Query
+from .firestore_sqlite import SQLiteStore
+from .firestore_store import DocumentStore, StorageBackend
+
+STATUSES = ('healthy', 'degraded', 'offline', 'starting')
+
+
+def _per_call_us(function: Callable, calls: int) -> float:
+    started = time.perf_counter()
+    function()
+    return round((time.perf_counter() - started) / calls * 1e6, 2)
+
+
+def run_store(store: StorageBackend, count: int, operations: int) -> Dict[str, Any]:
+    rng = random.Random(1)
+    documents = [(f"system-{n:07d}", {'name': f"system-{n}", 'status': rng.choice(STATUSES),
+                                      'agents': rng.randrange(1000), 'region': f"r{rng.randrange(20)}",
+                                      'tags': rng.sample(['gpu', 'edge', 'core', 'batch'], 2)})
+                  for n in range(count)]
+    store.create_index('systems', [('status', 'asc'), ('agents', 'desc')])
+    ids = [document_id for document_id, _ in documents]
+
+    def load() -> None:
+        for start in range(0, count, 500):
+            store.commit({}, [('set', 'systems', document_id, document)
+                              for document_id, document in documents[start:start + 500]])
+
+    def single_writes() -> None:
+        for n in range(operations):
+            store.set('extra', f"e{n}", documents[n % count][1])
+
+    def reads() -> None:
+        for _ in range(operations):
+            store.get('systems', rng.choice(ids))
+
+    def merges() -> None:
+        for _ in range(operations):
+            store.update('systems', rng.choice(ids), {'agents': rng.randrange(1000)})
+
+    indexed = Query([Filter('status', '==', 'degraded')], [('agents', 'desc')], limit=10)
+    scanning = Query([Filter('region', '==', 'r7'), Filter('agents', '>', 990)])
+    query_runs = max(1, operations // 10)
+
+    def indexed_queries() -> None:
+        for _ in range(query_runs):
+            store.query('systems', indexed)
+
+    def scanning_queries() -> None:
+        for _ in range(max(1, query_runs // 10)):
+            store.query('systems', scanning)
+
+    return {
+        'bulk_load_us_per_document': _per_call_us(load, count),
+        'single_write_us': _per_call_us(single_writes, operations),
+        'point_read_us': _per_call_us(reads, operations),
+        'merge_us': _per_call_us(merges, operations),
+        'indexed_query_top10_us': _per_call_us(indexed_queries, query_runs),
+        'scanning_query_us': _per_call_us(scanning_queries, max(1, query_runs // 10)),
+        'indexed_query_plan': store.explain('systems', indexed)
+    }
+
+
+def run(count: int, operations: int) -> Dict[str, Any]:
+    directory = tempfile.mkdtemp(prefix='firestore-bench-')
+    path = os.path.join(directory, 'firestore.db')
+    try:
+        result = {'documents': count, 'memory': run_store(DocumentStore(), count, operations)}
+        store = SQLiteStore(path)
+        result['sqlite'] = run_store(store, count, operations)
+        store.close()
+
+        started = time.perf_counter()
+        store = SQLiteStore(path)
+        store.get('systems', 'system-0000000')
+        result['sqlite']['reopen_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        result['sqlite']['file_mb'] = round(sum(os.path.getsize(os.path.join(directory, name))
+                                                for name in os.listdir(directory)) / 2 ** 20, 1)
+        store.close()
+        return result
+    finally:
+        shutil.rmtree(directory)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Firestore storage backend benchmark')
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--operations', type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.documents, args.operations), indent=2))
+
+
+if __name__ == '__main__':
+    main()
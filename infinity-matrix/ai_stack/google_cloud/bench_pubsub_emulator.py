@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Pub/Sub Emulator Benchmark - Load generator for the local Pub/Sub emulator
+Measures publish/pull throughput and publish and end-to-end latency over HTTP
+
+Run from ai_stack/: python -m google_cloud.bench_pubsub_emulator [--url URL]
+"""
+import argparse
+import base64
+import http.client
+import json
+import threading
+import time
+from typing import Dict, List, Any
+from urllib.parse import urlparse
+
+from .pubsub_emulator import PubSubEmulator
+
+
+class _Client:
+    """Keep-alive JSON client for one emulator connection."""
+
+    def __init__(self, url: str, project: str):
+        parsed = urlparse(url)
+        self.connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+        self.prefix = f"/v1/projects/{project}"
+
+    def call(self, method: str, path: str, body: Dict[str, Any] = None) -> Dict[str, Any]:
+        data = json.dumps(body or {}).encode('utf-8')
+        self.connection.request(method, self.prefix + path, data,
+                                {'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        payload = json.loads(response.read() or b'{}')
+        if response.status != 200:
+            raise RuntimeError(payload.get('error', {}).get('message', response.status))
+        return payload
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(url: str, project: str, publishers: int, pullers: int, messages: int,
+        batch_size: int, payload_bytes: int) -> Dict[str, Any]:
+    """Publish `messages` messages and pull them all back, returning measurements."""
+    admin = _Client(url, project)
+    admin.call('PUT', '/topics/bench')
+    admin.call('PUT', '/subscriptions/bench-sub', {'topic': f'projects/{project}/topics/bench'})
+
+    padding = 'x' * payload_bytes
+    per_publisher = messages // publishers
+    total = per_publisher * publishers
+    publish_latencies: List[float] = []
+    end_to_end: List[float] = []
+    received = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def publisher() -> None:
+        client = _Client(url, project)
+        latencies = []
+        for start in range(0, per_publisher, batch_size):
+            count = min(batch_size, per_publisher - start)
+            sent_at = time.time()
+            batch = [{'data': base64.b64encode(json.dumps(
+                {'sent_at': sent_at, 'padding': padding}).encode()).decode()} for _ in range(count)]
+            began = time.perf_counter()
+            client.call('POST', '/topics/bench:publish', {'messages': batch})
+            latencies.append(time.perf_counter() - began)
+        with lock:
+            publish_latencies.extend(latencies)
+
+    def puller() -> None:
+        client = _Client(url, project)
+        while not done.is_set():
+            response = client.call('POST', '/subscriptions/bench-sub:pull', {'maxMessages': 500})
+            batch = response.get('receivedMessages', [])
+            if not batch:
+                continue
+            now = time.time()
+            latencies = [now - json.loads(base64.b64decode(m['message']['data']))['sent_at']
+                         for m in batch]
+            client.call('POST', '/subscriptions/bench-sub:acknowledge',
+                        {'ackIds': [m['ackId'] for m in batch]})
+            with lock:
+                end_to_end.extend(latencies)
+                received[0] += len(batch)
+                if received[0] >= total:
+                    done.set()
+
+    pull_threads = [threading.Thread(target=puller, daemon=True) for _ in range(pullers)]
+    for thread in pull_threads:
+        thread.start()
+    started = time.perf_counter()
+    publish_threads = [threading.Thread(target=publisher) for _ in range(publishers)]
+    for thread in publish_threads:
+        thread.start()
+    for thread in publish_threads:
+        thread.join()
+    published_in = time.perf_counter() - started
+    done.wait()
+    received_in = time.perf_counter() - started
+    for thread in pull_threads:
+        thread.join()
+
+    admin.call('DELETE', '/subscriptions/bench-sub')
+    admin.call('DELETE', '/topics/bench')
+    return {
+        'messages': total,
+        'publish_msgs_per_sec': round(total / published_in),
+        'pull_msgs_per_sec': round(total / received_in),
+        'publish_request_p50_ms': round(_percentile(publish_latencies, 0.50) * 1000, 2),
+        'publish_request_p99_ms': round(_percentile(publish_latencies, 0.99) * 1000, 2),
+        'end_to_end_p50_ms': round(_percentile(end_to_end, 0.50) * 1000, 2),
+        'end_to_end_p99_ms': round(_percentile(end_to_end, 0.99) * 1000, 2)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Pub/Sub emulator load generator')
+    parser.add_argument('--url', help='Emulator URL (an in-process emulator is started if omitted)')
+    parser.add_argument('--project', default='bench')
+    parser.add_argument('--publishers', type=int, default=4)
+    parser.add_argument('--pullers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--payload-bytes', type=int, default=128)
+    args = parser.parse_args()
+
+    emulator = None
+    url = args.url
+    if url is None:
+        emulator = PubSubEmulator(port=0).start()
+        url = emulator.url
+    try:
+        result = run(url, args.project, args.publishers, args.pullers, args.messages,
+                     args.batch_size, args.payload_bytes)
+    finally:
+        if emulator is not None:
+            emulator.stop()
+            emulator.agent.shutdown()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Pub/Sub Message Benchmark - Per-message memory and CPU cost of message records
+Compares the original dict envelopes with PubSubMessage
+
+Run from ai_stack/: python -m google_cloud.bench_pubsub_message [--messages N]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Any
+
+from .pubsub_agent import PubSubAgent
+from .pubsub_message import PubSubMessage
+
+
+def legacy_envelopes(payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build messages the way publish did before PubSubMessage."""
+    publish_time = datetime.utcnow().isoformat()
+    id_prefix = str(uuid.uuid4())[:12]
+    envelopes = []
+    for index, message in enumerate(payloads):
+        message_data = json.dumps(message)
+        if len(message_data) > 10 * 1024 * 1024:
+            continue
+        envelopes.append({
+            'message_id': f"{id_prefix}{index:04x}",
+            'data': message_data,
+            'attributes': {},
+            'ordering_key': '',
+            'publish_time': publish_time,
+            'topic': 'bench'
+        })
+    return envelopes
+
+
+def slotted_messages(payloads: List[Dict[str, Any]]) -> List[PubSubMessage]:
+    """Build messages the way publish does now."""
+    publish_time_ns = time.time_ns()
+    messages = []
+    for message_id, payload in enumerate(payloads):
+        message = PubSubMessage(message_id, publish_time_ns, payload, None, '', 'bench')
+        if len(message.data) > 10 * 1024 * 1024:
+            continue
+        messages.append(message)
+    return messages
+
+
+def _timed(function: Callable, *args) -> float:
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def _retained_bytes(build: Callable, payloads: List[Dict[str, Any]]) -> int:
+    """Bytes still allocated by build() once its input payloads are released."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = build(payloads)
+    payloads.clear()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del messages
+    return retained
+
+
+def run(count: int) -> Dict[str, Any]:
+    def payloads() -> List[Dict[str, Any]]:
+        return [{'event_type': 'data.sync', 'repo': f'repo-{i % 50}', 'n': i} for i in range(count)]
+
+    legacy = legacy_envelopes(payloads())
+    slotted = slotted_messages(payloads())
+    source = payloads()
+
+    result = {
+        'messages': count,
+        'legacy_build_ns': round(_timed(legacy_envelopes, source) * 1e9 / count),
+        'slotted_build_ns': round(_timed(slotted_messages, source) * 1e9 / count),
+        'legacy_bytes': round(_retained_bytes(legacy_envelopes, payloads()) / count),
+        'slotted_bytes': round(_retained_bytes(slotted_messages, payloads()) / count),
+        'legacy_record_roundtrip_ns': round(_timed(
+            lambda: [json.loads(json.dumps(e).encode('utf-8')) for e in legacy]) * 1e9 / count),
+        'slotted_record_roundtrip_ns': round(_timed(
+            lambda: [PubSubMessage.from_record(m.to_record()) for m in slotted]) * 1e9 / count)
+    }
+
+    agent = PubSubAgent()
+    agent.create_topic('bench')
+    agent.create_subscription('bench-sub', 'bench')
+    batch_size = agent.config['max_batch_size']
+    batches = [source[i:i + batch_size] for i in range(0, count, batch_size)]
+    elapsed = _timed(lambda: [agent.publish_batch('bench', batch) for batch in batches])
+    result['agent_publish_batch_ns'] = round(elapsed * 1e9 / count)
+    agent.shutdown()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Pub/Sub message record microbenchmark')
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.messages), indent=2))
+
+
+if __name__ == '__main__':
+    main()
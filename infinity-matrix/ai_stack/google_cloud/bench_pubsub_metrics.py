@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Pub/Sub Metrics Benchmark - Per-message cost of latency and rate recording
+Times the recording done on the pull, ack and push delivery paths
+
+Run from ai_stack/: python -m google_cloud.bench_pubsub_metrics [--messages N]
+"""
+import argparse
+import json
+import random
+import time
+from typing import Callable, Dict, Any
+
+from .pubsub_agent import PubSubAgent
+from .pubsub_metrics import LatencyHistogram, RateWindow
+
+
+def _per_call_ns(function: Callable, calls: int) -> float:
+    started = time.perf_counter_ns()
+    function()
+    return (time.perf_counter_ns() - started) / calls
+
+
+def run(count: int, batch_size: int) -> Dict[str, Any]:
+    values = [random.randrange(10_000, 5_000_000_000) for _ in range(count)]
+    histogram = LatencyHistogram()
+    rates = RateWindow()
+
+    def record_each() -> None:
+        record = histogram.record
+        for value in values:
+            record(value)
+
+    def record_batches() -> None:
+        for start in range(0, count, batch_size):
+            histogram.record_many(values[start:start + batch_size])
+
+    def add_batches() -> None:
+        for _ in range(0, count, batch_size):
+            rates.add(batch_size)
+
+    result = {
+        'messages': count,
+        'histogram_record_ns': round(_per_call_ns(record_each, count), 1),
+        'histogram_record_many_ns_per_message': round(_per_call_ns(record_batches, count), 1),
+        'rate_add_ns_per_message': round(_per_call_ns(add_batches, count), 1)
+    }
+
+    # Everything the push path adds per message: timestamps in the dispatcher
+    # plus _record_push_timings (two histograms, two rate windows, the lock)
+    agent = PubSubAgent()
+    agent.create_topic('bench')
+    agent.create_subscription('bench-sub', 'bench')
+    publish_time_ns = time.time_ns()
+    messages = [type('Message', (), {'publish_time_ns': publish_time_ns})() for _ in range(batch_size)]
+
+    def push_batches() -> None:
+        for _ in range(0, count, batch_size):
+            started = [time.time_ns() for _ in messages]
+            agent._record_push_timings('bench-sub', messages, started, time.time_ns())
+
+    result['push_recording_ns_per_message'] = round(_per_call_ns(push_batches, count), 1)
+    agent.shutdown()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Pub/Sub telemetry recording microbenchmark')
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+    print(json.dumps(run(args.messages, args.batch_size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
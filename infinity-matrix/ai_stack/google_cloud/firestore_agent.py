@@ -2,11 +2,30 @@
 Firestore Agent - Enterprise-grade Firestore integration
 Handles real-time database operations, transactions, and complex queries
 """
+import io
+import itertools
 import json
-from typing import Dict, List, Any, Optional, Callable
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Any, BinaryIO, Iterable, Iterator, Optional, Callable, Set, Tuple, Union
 from datetime import datetime, timedelta
 from enum import Enum
 
+from .firestore_backup import (check_options, decode_records, encode_pages, load_checkpoint,
+                              open_reader, save_checkpoint)
+from .firestore_cache import MISS, DocumentCache
+from .firestore_changes import ChangeFeed, Listener
+from .firestore_query import Cursor, Query
+from .firestore_sqlite import SQLiteStore
+from .firestore_store import WRITE_OPERATIONS, DocumentStore, StorageBackend, TransactionConflict
+from .firestore_transaction import Transaction, stamp
+from .firestore_transforms import SERVER_TIMESTAMP, project, touched_fields
+from .pubsub_dispatch import SubscriberDispatcher
+
 
 class FirestoreAgent:
     """
@@ -14,18 +33,58 @@ class FirestoreAgent:
     Supports transactions, complex queries, batch operations, and real-time listeners.
     """
     
-    def __init__(self):
-        """Initialize Firestore agent with connection pooling and caching."""
-        self.db = None
-        self.cache = {}
+    def __init__(self, config: Optional[Dict[str, Any]] = None, store: Optional[StorageBackend] = None):
+        """
+        Initialize Firestore agent with connection pooling and caching.
+        
+        Args:
+            config: Optional overrides for the default configuration
+            store: Storage backend to use instead of the one storage_mode selects
+        """
         self.listeners = []
         self.batch_queue = []
-        self.transaction_active = False
+        self.transaction_stats = {
+            'active': 0,
+            'committed': 0,
+            'conflicts': 0,
+            'failed': 0
+        }
+        self._transaction_lock = threading.Lock()
         self.config = {
             'cache_ttl': 300,  # 5 minutes
+            'cache_negative_ttl': 30,  # How long a missing document is remembered
+            'cache_max_entries': 10000,
+            'cache_max_bytes': 64 * 1024 * 1024,  # Approximate document bytes
+            'storage_mode': 'memory',  # 'memory' or 'sqlite'
+            'storage_path': '.firestore/firestore.db',
             'batch_size': 500,
-            'max_connections': 50
+            'batch_max_in_flight': 4,  # Concurrent batch_write commits
+            'stream_page_size': 500,  # Documents fetched per stream() page
+            'stream_prefetch': 2,  # Pages stream() fetches ahead of the consumer (0 disables)
+            'backup_page_size': 1000,  # Documents read from the store per export page
+            'backup_checkpoint_interval': 10000,  # Documents between export/import checkpoints
+            'max_connections': 50,
+            'change_log_size': 10000,  # Changes kept per collection for resuming listeners
+            'listener_workers': 4,
+            'listener_inbox_size': 10000,  # Undelivered events per listener before dropping
+            'transaction_max_attempts': 5,
+            'transaction_backoff': 0.01,  # First retry delay in seconds; doubles per attempt
+            'transaction_max_backoff': 1.0
         }
+        self.config.update(config or {})
+        self.changes = ChangeFeed(
+            SubscriberDispatcher(max_workers=self.config['listener_workers'],
+                                 inbox_size=self.config['listener_inbox_size']),
+            log_size=self.config['change_log_size']
+        )
+        self.db = store or self._open_store()  # Collections and their indexes
+        self.db.on_change = self.changes.record
+        self.cache = DocumentCache(
+            max_entries=self.config['cache_max_entries'],
+            max_bytes=self.config['cache_max_bytes'],
+            ttl=self.config['cache_ttl'],
+            negative_ttl=self.config['cache_negative_ttl']
+        )
         
     def load_creds(self) -> Dict[str, Any]:
         """Load and validate Firestore credentials."""
@@ -51,86 +110,193 @@ class FirestoreAgent:
         cache_key = f"{collection}/{doc_id}"
         
         # Add metadata
-        data['_created_at'] = datetime.utcnow().isoformat()
-        data['_updated_at'] = datetime.utcnow().isoformat()
+        data['_created_at'] = data['_updated_at'] = datetime.utcnow().isoformat()
         
-        # Update cache
-        self.cache[cache_key] = data
+        # Store, then cache the stored copy
+        self.cache.put(cache_key, self.db.set(collection, doc_id, data))
         
         return doc_id
 
-    def get_document(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+    def get_document(self, collection: str, document_id: str,
+                     field_mask: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
         """
-        Retrieve a single document by ID.
+        Retrieve a single document by ID, reading through the cache.
         
         Args:
             collection: Collection path
             document_id: Document ID
+            field_mask: Optional field paths to return ('name', 'stats.count')
+                        instead of the whole document
             
         Returns:
             Document data or None if not found
         """
         cache_key = f"{collection}/{document_id}"
         
-        # Check cache first
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        # Check cache first; a cached miss answers None without a fetch
+        document = self.cache.get(cache_key)
+        if document is MISS:
+            document = self.db.get(collection, document_id)
+            if document is None:
+                self.cache.put_missing(cache_key)
+            else:
+                self.cache.put(cache_key, document)
+        return self._masked(document, field_mask)
+
+    def get_documents_by_ids(self, collection: str, document_ids: Iterable[str],
+                             field_mask: Optional[List[str]] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Retrieve several documents of a collection at once.
+        
+        Cached documents (and cached misses) are answered in one pass over
+        the cache; the rest are fetched from the backend in a single call.
+        
+        Args:
+            collection: Collection path
+            document_ids: Document IDs; duplicates are allowed
+            field_mask: Optional field paths to return per document
             
-        # Simulate database fetch
-        return None
+        Returns:
+            Document data or None per ID, in the order given
+        """
+        return [self._masked(document, field_mask)
+                for document in self._get_many([(collection, document_id) for document_id in document_ids])]
+
+    def get_all(self, paths: Iterable[str],
+                field_mask: Optional[List[str]] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Retrieve documents from any collections by path ('systems/alpha',
+        'users/u1/posts/p1'), with one cache pass and one backend call.
+        
+        Args:
+            paths: Document paths
+            field_mask: Optional field paths to return per document
+            
+        Returns:
+            Document data or None per path, in the order given
+            
+        Raises:
+            ValueError: If a path names a collection rather than a document
+        """
+        keys = []
+        for path in paths:
+            path = path.strip('/')
+            if path.count('/') % 2 == 0:
+                raise ValueError(f"'{path}' is not a document path")
+            collection, document_id = path.rsplit('/', 1)
+            keys.append((collection, document_id))
+        return [self._masked(document, field_mask) for document in self._get_many(keys)]
 
     def get_documents(self, collection: str, filters: Optional[List[tuple]] = None, 
-                     limit: int = 100) -> List[Dict[str, Any]]:
+                     limit: int = 100, field_mask: Optional[List[str]] = None,
+                     start_after: Optional[Cursor] = None,
+                     end_before: Optional[Cursor] = None) -> List[Dict[str, Any]]:
         """
         Retrieve documents with optional filtering.
         
         Args:
             collection: Collection path
-            filters: List of (field, operator, value) tuples
-                    Operators: '==', '<', '<=', '>', '>=', '!=', 'in', 'array-contains'
+            filters: List of (field, operator, value) tuples; fields may be
+                     dotted paths ('stats.count')
+                    Operators: '==', '<', '<=', '>', '>=', '!=', 'in', 'not-in',
+                               'array-contains', 'array-contains-any'
             limit: Maximum documents to return
+            field_mask: Optional field paths to return per document
+            start_after: Document ID to page after (results come in
+                         document ID order, or by the field of an
+                         inequality filter first)
+            end_before: Document ID to stop before
             
         Returns:
             List of documents
+            
+        Raises:
+            ValueError: If an operator is unsupported or a cursor document does not exist
         """
-        results = []
-        
-        # Simulate filter application
-        if filters:
-            for field, operator, value in filters:
-                # Filter logic would go here
-                pass
-                
-        return results[:limit]
+        query = Query.from_filters(filters, limit, start_after, end_before, self._lookup(collection))
+        return [self._masked(document, field_mask) for _, document in self.db.query(collection, query)]
 
     def query_documents(self, collection: str, query_config: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Advanced query with multiple conditions and ordering.
         
+        Runs on the collection's best matching index (see create_index) and
+        falls back to scanning the collection when none applies. Documents
+        missing an order_by field are left out, as in Firestore.
+        
         Args:
             collection: Collection path
             query_config: {
                 'where': [{'field': 'name', 'operator': '==', 'value': 'John'}],
                 'order_by': [{'field': 'created_at', 'direction': 'desc'}],
-                'limit': 50
+                'limit': 50,
+                'select': ['name', 'stats.count'],  # Optional field mask
+                'start_after': 'doc-id',  # Optional cursors: a document ID, or the
+                'end_before': [5, 'doc-id']  # order_by values (then an ID) to page from
             }
             
         Returns:
             Query results
+            
+        Raises:
+            ValueError: If an operator or direction is unsupported, or a cursor is invalid
         """
-        conditions = query_config.get('where', [])
-        ordering = query_config.get('order_by', [])
-        limit = query_config.get('limit', 100)
+        query = Query.from_config(query_config, self._lookup(collection))
+        field_mask = query_config.get('select')
+        return [self._masked(document, field_mask) for _, document in self.db.query(collection, query)]
+
+    def stream(self, collection: str, query_config: Optional[Dict[str, Any]] = None,
+               page_size: Optional[int] = None, prefetch: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over a query's results, fetching them a page at a time.
         
-        # Apply WHERE clauses, ORDER BY, and LIMIT
-        results = []
+        Each page is a query resuming after the last document of the one
+        before (see the cursors of query_documents), so memory stays at a
+        few pages however large the result, and the first documents arrive
+        as soon as the first page is read. With prefetch, a background
+        thread reads that many pages ahead while the caller works.
+        
+        Queries an index orders, or without order_by, seek straight to
+        each page; others sort their matches for every page, so
+        create_index for large collections. Documents written during the stream may or may not be
+        seen, as with any cursor paging.
         
-        return results[:limit]
+        Args:
+            collection: Collection path
+            query_config: As for query_documents; 'limit' caps the whole
+                          stream and defaults to no limit
+            page_size: Documents per page (default stream_page_size)
+            prefetch: Pages read ahead (default stream_prefetch; 0 reads on demand)
+            
+        Returns:
+            Generator of documents
+            
+        Raises:
+            ValueError: If the query is invalid, or page_size or prefetch is out of range
+        """
+        query_config = dict(query_config or {})
+        query_config.setdefault('limit', None)
+        page_size = self.config['stream_page_size'] if page_size is None else page_size
+        prefetch = self.config['stream_prefetch'] if prefetch is None else prefetch
+        if page_size < 1 or prefetch < 0:
+            raise ValueError("page_size must be positive and prefetch must not be negative")
+        first = Query.from_config(dict(query_config, limit=page_size), self._lookup(collection))
+        pages = self._query_pages(collection, query_config, first, page_size)
+        if prefetch:
+            pages = self._prefetch(pages, prefetch)
+        field_mask = query_config.get('select')
+        return (self._masked(document, field_mask) for page in pages for document in page)
 
     def update_document(self, collection: str, document_id: str, data: dict, merge: bool = True) -> bool:
         """
         Update a document (merge or replace).
         
+        A merge writes only the fields named in data, in place: keys may be
+        dotted field paths ('stats.count') and values may be server
+        transforms (Increment, ArrayUnion, ArrayRemove, SERVER_TIMESTAMP,
+        DELETE_FIELD from firestore_transforms). A missing document is
+        created from the merged fields.
+        
         Args:
             collection: Collection path
             document_id: Document ID
@@ -140,84 +306,244 @@ class FirestoreAgent:
         Returns:
             Success status
         """
-        cache_key = f"{collection}/{document_id}"
-        
-        if merge and cache_key in self.cache:
-            self.cache[cache_key].update(data)
-        else:
-            self.cache[cache_key] = data
-            
-        self.cache[cache_key]['_updated_at'] = datetime.utcnow().isoformat()
+        operation = 'update' if merge else 'set'
+        data = dict(data, _updated_at=SERVER_TIMESTAMP)
+        document = self.db.commit({}, [(operation, collection, document_id, data)])[0]
+        self.cache.put(f"{collection}/{document_id}", document, touched_fields(data) if merge else None)
         
         return True
 
     def delete_document(self, collection: str, document_id: str) -> bool:
         """Delete a document."""
-        cache_key = f"{collection}/{document_id}"
-        if cache_key in self.cache:
-            del self.cache[cache_key]
+        self.db.delete(collection, document_id)
+        self.cache.put_missing(f"{collection}/{document_id}")
         return True
 
-    def batch_write(self, operations: List[Dict[str, Any]]) -> bool:
+    def batch_write(self, operations: Iterable[Dict[str, Any]], max_in_flight: Optional[int] = None,
+                    on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
-        Batch write operations (max 500 per batch).
+        Bulk write any number of operations.
+        
+        Operations are read lazily and split into commits of batch_size
+        (500), each applied atomically with a single commit timestamp. Up to
+        max_in_flight commits run concurrently; once that many are pending,
+        reading more operations waits for one to finish, so memory stays
+        bounded. A commit that fails is retried one operation at a time so a
+        bad operation only fails itself. Commits may finish out of order:
+        operations on the same document in different chunks are not ordered
+        unless max_in_flight is 1.
         
         Args:
-            operations: List of {'type': 'set'|'update'|'delete', 'path': '', 'data': {}}
+            operations: Iterable of {'type': 'set'|'update'|'delete', 'path': '',
+                        'document_id': '', 'data': {}}; path is a collection,
+                        or a document path ('users/u1') when document_id is
+                        omitted. A set without an ID gets a generated one.
+            max_in_flight: Concurrent commits (default from config)
+            on_result: Called with each operation's result instead of
+                       collecting them
             
         Returns:
-            Success status
-        """
-        if len(operations) > 500:
-            raise ValueError("Batch limited to 500 operations")
+            {'success', 'operations', 'commits', 'failed', 'results'}, where
+            results (in operation order) hold {'index', 'path', 'document_id',
+            'success', 'update_time', 'error'}
             
-        for op in operations:
-            op_type = op['type']
-            path = op['path']
-            data = op.get('data', {})
-            
-            if op_type == 'set':
-                self.add_document(path, data)
-            elif op_type == 'update':
-                self.update_document(path, '', data)
-            elif op_type == 'delete':
-                self.delete_document(path, '')
-                
-        return True
+        Raises:
+            ValueError: If max_in_flight is below 1
+        """
+        max_in_flight = max_in_flight or self.config['batch_max_in_flight']
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        
+        results = []
+        report = on_result or results.append
+        summary = {'operations': 0, 'commits': 0, 'failed': 0}
+        
+        def collect(commits: int, chunk_results: List[Dict[str, Any]]) -> None:
+            summary['commits'] += commits
+            for result in chunk_results:
+                summary['failed'] += not result['success']
+                report(result)
+        
+        operations = iter(operations)
+        with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='batch-write') as executor:
+            pending = set()
+            while True:
+                chunk = list(itertools.islice(operations, self.config['batch_size']))
+                if not chunk:
+                    break
+                writes, rejected = [], []
+                for index, operation in enumerate(chunk, summary['operations']):
+                    try:
+                        writes.append((index, self._prepare_write(operation)))
+                    except (KeyError, TypeError, ValueError) as e:
+                        rejected.append(self._write_result(index, None, None, error=e))
+                summary['operations'] += len(chunk)
+                collect(0, rejected)
+                if writes:
+                    pending.add(executor.submit(self._commit_writes, writes))
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(*future.result())
+            for future in pending:
+                collect(*future.result())
+        
+        results.sort(key=lambda result: result['index'])
+        return dict(summary, success=summary['failed'] == 0, results=results)
+
+    def _prepare_write(self, operation: Dict[str, Any]) -> Tuple[str, str, str, Optional[Dict[str, Any]]]:
+        """(type, collection, document ID, data) for a batch_write operation."""
+        op_type = operation['type']
+        if op_type not in WRITE_OPERATIONS:
+            raise ValueError(f"Unsupported write operation '{op_type}'")
+        path = operation['path'].strip('/')
+        document_id = operation.get('document_id')
+        if document_id is None and path.count('/') % 2 == 1:
+            path, document_id = path.rsplit('/', 1)
+        if not path:
+            raise ValueError("Operation needs a collection path")
+        if not document_id:
+            if op_type != 'set':
+                raise ValueError(f"A {op_type} operation needs a document ID")
+            document_id = self._generate_doc_id()
+        data = None if op_type == 'delete' else dict(operation.get('data') or {})
+        return op_type, path, document_id, data
 
-    def transaction(self, callback: Callable) -> Any:
+    def _commit_writes(self, writes: List[Tuple[int, Tuple]]) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Commit prepared writes atomically, or one by one if that fails.
+        
+        Returns:
+            (commits made, per-operation results)
+        """
+        timestamp = datetime.utcnow().isoformat()
+        stamped = [(index, (op_type, collection, document_id, stamp(op_type, data, timestamp)))
+                   for index, (op_type, collection, document_id, data) in writes]
+        try:
+            documents = self.db.commit({}, [write for _, write in stamped])
+            outcomes = [(index, write, document, None)
+                        for (index, write), document in zip(stamped, documents)]
+            commits = 1
+        except Exception:
+            outcomes = []
+            for index, write in stamped:
+                try:
+                    outcomes.append((index, write, self.db.commit({}, [write])[0], None))
+                except Exception as e:
+                    outcomes.append((index, write, None, e))
+            commits = len(stamped)
+        
+        results = []
+        for index, (op_type, collection, document_id, data), document, error in outcomes:
+            if error is None:
+                self._cache_written(collection, document_id, document,
+                                    touched_fields(data) if op_type == 'update' else None)
+            results.append(self._write_result(index, collection, document_id,
+                                              None if error else timestamp, error))
+        return commits, results
+
+    def _write_result(self, index: int, path: Optional[str], document_id: Optional[str],
+                      update_time: Optional[str] = None, error: Optional[Exception] = None) -> Dict[str, Any]:
+        return {
+            'index': index,
+            'path': path,
+            'document_id': document_id,
+            'success': error is None,
+            'update_time': update_time,
+            'error': None if error is None else str(error)
+        }
+
+    def transaction(self, callback: Callable, max_attempts: Optional[int] = None) -> Any:
         """
         Execute a transaction with atomic operations.
         
+        The callback receives a Transaction: reads through transaction.get()
+        record the version of each document, and set/update/delete are
+        buffered. On return the writes are committed atomically if none of
+        the documents read has changed; otherwise the callback is run again
+        after a randomized exponential backoff. No lock is held while the
+        callback runs. A commit locks only the stripes of the documents it
+        touches while validating its read set, so it conflicts only with
+        writers to those documents; applying the writes takes the
+        store-wide lock, so that short step is serialized across commits.
+        
         Args:
-            callback: Function that performs read/write operations
+            callback: Function that performs read/write operations on the
+                      Transaction; may be called more than once
+            max_attempts: Attempts before giving up (default from config)
             
         Returns:
             Transaction result
+            
+        Raises:
+            TransactionConflict: If every attempt conflicted
         """
-        self.transaction_active = True
-        try:
-            result = callback(self)
-            self.transaction_active = False
+        attempts = max_attempts or self.config['transaction_max_attempts']
+        backoff = self.config['transaction_backoff']
+        
+        for attempt in range(1, attempts + 1):
+            self._count_transaction('active', 1)
+            try:
+                transaction = Transaction(self.db)
+                result = callback(transaction)
+                written = transaction.commit(datetime.utcnow().isoformat())
+            except TransactionConflict:
+                self._count_transaction('conflicts', 1)
+                if attempt == attempts:
+                    self._count_transaction('failed', 1)
+                    raise
+                # Full jitter keeps retrying transactions from colliding again
+                time.sleep(random.uniform(0, min(backoff * 2 ** (attempt - 1),
+                                                 self.config['transaction_max_backoff'])))
+                continue
+            except Exception:
+                self._count_transaction('failed', 1)
+                raise
+            finally:
+                self._count_transaction('active', -1)
+            
+            for collection, document_id, document in written:
+                self._cache_written(collection, document_id, document)
+            self._count_transaction('committed', 1)
             return result
-        except Exception as e:
-            self.transaction_active = False
-            raise
 
     def listen_to_collection(self, collection: str, callback: Callable, 
-                            filters: Optional[List[tuple]] = None) -> str:
+                            filters: Optional[List[tuple]] = None,
+                            resume_token: Optional[int] = None) -> str:
         """
         Create a real-time listener for a collection.
         
+        The callback receives one event per change to the documents matching
+        the filters: {'type': 'added' | 'modified' | 'removed', 'collection',
+        'document_id', 'document', 'resume_token'}. A document that stops
+        matching is 'removed' and one that starts matching is 'added'. Events
+        arrive in order on a worker thread. New listeners first get every
+        matching document as 'added'; passing the resume_token of the last
+        event seen instead delivers only the changes made since.
+        
         Args:
             collection: Collection path
             callback: Function called on document changes
             filters: Optional query filters
+            resume_token: Resume after this event instead of from a snapshot
             
         Returns:
             Listener ID
+            
+        Raises:
+            ValueError: If a filter is invalid or the resume token has aged
+                        out of the change log
         """
         listener_id = f"listener_{len(self.listeners)}"
+        query = Query.from_filters(filters, None) if filters else None
+        
+        with self.db.lock:
+            self.changes.subscribe(
+                Listener(listener_id, collection, query, callback),
+                self.db.query(collection, query or Query()),
+                lambda document_id: self.db.get(collection, document_id),
+                resume_token
+            )
         
         listener = {
             'id': listener_id,
@@ -234,37 +560,331 @@ class FirestoreAgent:
         """Stop a real-time listener."""
         for listener in self.listeners:
             if listener['id'] == listener_id:
+                with self.db.lock:
+                    self.changes.unsubscribe(listener_id)
                 listener['active'] = False
                 return True
         return False
 
+    def wait_for_listeners(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued listener event has been delivered."""
+        return self.changes.dispatcher.wait_idle(timeout)
+
     def create_index(self, collection: str, fields: List[tuple]) -> str:
         """
-        Create a composite index for better query performance.
+        Create a single-field or composite index for better query performance.
+        Existing documents are indexed immediately and every write keeps the
+        index current. Creating an existing index returns its name.
         
         Args:
             collection: Collection path
-            fields: List of (field, direction) tuples
+            fields: List of (field, direction) tuples; direction is 'asc',
+                    'desc' or 'array-contains'
             
         Returns:
             Index name
+            
+        Raises:
+            ValueError: If a direction is unsupported
         """
-        return f"index_{collection}_{len(fields)}"
+        return self.db.create_index(collection, fields)
 
     def export_collection(self, collection: str, format: str = 'json') -> str:
-        """Export collection data for backup."""
+        """
+        Export collection data for backup as one string ('json' or 'ndjson').
+        Use iter_export or export_to_file for collections too large to hold in memory.
+        """
         if format == 'json':
-            return json.dumps(self.cache, indent=2)
+            return json.dumps(dict(self.db.items(collection)), indent=2, default=str)
+        if format == 'ndjson':
+            return b''.join(self.iter_export(collection, 'ndjson')).decode()
         return ""
 
     def import_collection(self, collection: str, data: str, format: str = 'json') -> bool:
-        """Import collection data from backup."""
+        """Import collection data from a backup string ('json' or 'ndjson')."""
         if format == 'json':
             imported = json.loads(data)
             for key, value in imported.items():
-                self.cache[f"{collection}/{key}"] = value
+                self.cache.put(f"{collection}/{key}", self.db.set(collection, key, value))
+        elif format == 'ndjson':
+            self.import_from_file(collection, io.BytesIO(data.encode()), 'ndjson')
         return True
 
+    def iter_export(self, collection: str, format: str = 'ndjson',
+                    compression: Optional[str] = None) -> Iterator[bytes]:
+        """
+        Stream a collection as export chunks, reading backup_page_size
+        documents at a time in document ID order.
+        
+        The export is not a point-in-time snapshot: documents written while
+        it runs may or may not be included.
+        
+        Args:
+            collection: Collection path
+            format: 'ndjson' (one {"id", "data"} object per line) or 'binary'
+                    (records framed by length and crc32)
+            compression: None, 'gzip' or 'zstd' (needs zstandard); every chunk
+                         is a complete gzip member / zstd frame
+            
+        Returns:
+            Generator of byte chunks whose concatenation is the export
+            
+        Raises:
+            ValueError: If the format or compression is unsupported
+        """
+        check_options(format, compression)
+        return (chunk for chunk, _, _ in encode_pages(self._pages(collection), format, compression))
+
+    def export_to_file(self, collection: str, path: str, format: str = 'ndjson',
+                       compression: Optional[str] = None,
+                       checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Export a collection to a file in constant memory.
+        
+        With checkpoint_path, progress (last document ID and the file size
+        at a chunk boundary) is saved every backup_checkpoint_interval
+        documents after syncing the file. Running the same export again
+        truncates the file to the last checkpoint and continues after that
+        document. The checkpoint is removed once the export completes.
+        
+        Args:
+            collection: Collection path
+            path: Output file
+            format: 'ndjson' or 'binary'
+            compression: None, 'gzip' or 'zstd'
+            checkpoint_path: File holding resume state
+            
+        Returns:
+            {'collection', 'path', 'documents', 'bytes', 'resumed'}
+            
+        Raises:
+            ValueError: If the format or compression is unsupported
+        """
+        check_options(format, compression)
+        identity = {'operation': 'export', 'collection': collection, 'format': format,
+                    'compression': compression, 'path': os.path.abspath(path)}
+        checkpoint = load_checkpoint(checkpoint_path, identity) if os.path.exists(path) else None
+        documents = checkpoint['documents'] if checkpoint else 0
+        interval = self.config['backup_checkpoint_interval']
+        
+        with open(path, 'r+b' if checkpoint else 'wb') as f:
+            if checkpoint:
+                f.truncate(checkpoint['offset'])
+                f.seek(checkpoint['offset'])
+            unsaved = 0
+            pages = self._pages(collection, checkpoint['last_id'] if checkpoint else None)
+            for chunk, last_id, count in encode_pages(pages, format, compression):
+                f.write(chunk)
+                documents += count
+                unsaved += count
+                if checkpoint_path and unsaved >= interval:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    save_checkpoint(checkpoint_path, dict(identity, last_id=last_id,
+                                                          documents=documents, offset=f.tell()))
+                    unsaved = 0
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return {
+            'collection': collection,
+            'path': path,
+            'documents': documents,
+            'bytes': size,
+            'resumed': checkpoint is not None
+        }
+
+    def import_from_file(self, collection: str, source: Union[str, BinaryIO], format: str = 'ndjson',
+                         compression: Optional[str] = None,
+                         checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Import an export file into a collection, streaming records and
+        committing them batch_size at a time.
+        
+        Imported documents replace existing ones with the same ID and keep
+        their exported metadata. With checkpoint_path, the number of records
+        committed is saved every backup_checkpoint_interval documents; a
+        rerun skips that many records. The checkpoint is removed when the
+        import completes.
+        
+        Args:
+            collection: Collection path
+            source: Export file path or binary file object
+            format: 'ndjson' or 'binary'
+            compression: None, 'gzip' or 'zstd'
+            checkpoint_path: File holding resume state
+            
+        Returns:
+            {'collection', 'documents' (imported by this run), 'records', 'resumed'}
+            
+        Raises:
+            ValueError: If the format or compression is unsupported, or a
+                        record is corrupt
+        """
+        check_options(format, compression)
+        identity = {'operation': 'import', 'collection': collection, 'format': format,
+                    'compression': compression,
+                    'path': os.path.abspath(source) if isinstance(source, str) else None}
+        checkpoint = load_checkpoint(checkpoint_path, identity)
+        skip = checkpoint['records'] if checkpoint else 0
+        batch_size = self.config['batch_size']
+        interval = self.config['backup_checkpoint_interval']
+        
+        stream = open(source, 'rb') if isinstance(source, str) else source
+        try:
+            records = saved = skip
+            writes = []
+            for document_id, document in itertools.islice(
+                    decode_records(open_reader(stream, compression), format), skip, None):
+                writes.append(('set', collection, document_id, document))
+                if len(writes) >= batch_size:
+                    records += self._import_writes(writes)
+                    writes = []
+                    if checkpoint_path and records - saved >= interval:
+                        save_checkpoint(checkpoint_path, dict(identity, records=records))
+                        saved = records
+            records += self._import_writes(writes)
+        finally:
+            if isinstance(source, str):
+                stream.close()
+        
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return {
+            'collection': collection,
+            'documents': records - skip,
+            'records': records,
+            'resumed': checkpoint is not None
+        }
+
+    def _pages(self, collection: str,
+               start_after: Optional[str] = None) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        """Pages of (document ID, document) pairs in ID order, starting after start_after."""
+        page_size = self.config['backup_page_size']
+        while True:
+            page = self.db.scan(collection, start_after, page_size)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            start_after = page[-1][0]
+
+    def _import_writes(self, writes: List[Tuple[str, str, str, Dict[str, Any]]]) -> int:
+        """Commit imported documents unchanged; cached copies are dropped rather than replaced."""
+        if writes:
+            self.db.commit({}, writes)
+            for _, collection, document_id, _ in writes:
+                self.cache.invalidate(f"{collection}/{document_id}")
+        return len(writes)
+
+    def _get_many(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """Read (collection, document ID) keys through the cache, fetching every miss at once."""
+        results = self.cache.get_many([f"{collection}/{document_id}" for collection, document_id in keys])
+        # Each missing key once, in first-seen order
+        misses = list(dict.fromkeys(key for key, result in zip(keys, results) if result is MISS))
+        if not misses:
+            return results
+        
+        fetched = dict(zip(misses, self.db.get_many(misses)))
+        for (collection, document_id), document in fetched.items():
+            self._cache_written(collection, document_id, document)
+        return [fetched[key] if result is MISS else result for key, result in zip(keys, results)]
+
+    def _query_pages(self, collection: str, query_config: Dict[str, Any], query: Query,
+                     page_size: int) -> Iterator[List[Dict[str, Any]]]:
+        """Pages of a stream()'s results, each query resuming after the previous page."""
+        remaining = query_config['limit']
+        while remaining is None or remaining > 0:
+            if remaining is not None and remaining < page_size:
+                query = Query(query.filters, query.order_by, remaining, query.start_after, query.end_before)
+            page = self.db.query(collection, query)
+            if not page:
+                return
+            yield [document for _, document in page]
+            if len(page) < query.limit:
+                return
+            if remaining is not None:
+                remaining -= len(page)
+            query = Query(query.filters, query.order_by, query.limit,
+                          query.continuation(*page[-1]), query.end_before)
+
+    @staticmethod
+    def _prefetch(pages: Iterator[List[Dict[str, Any]]], depth: int) -> Iterator[List[Dict[str, Any]]]:
+        """Read pages on a background thread, up to depth pages ahead of the consumer."""
+        ready = queue.Queue(maxsize=depth)
+        stop = threading.Event()
+
+        def offer(item: Tuple) -> bool:
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce() -> None:
+            try:
+                for page in pages:
+                    if not offer((page, None)):
+                        return
+                offer((None, None))
+            except Exception as e:
+                offer((None, e))
+
+        threading.Thread(target=produce, name='firestore-stream-prefetch', daemon=True).start()
+        try:
+            while True:
+                page, error = ready.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    return
+                yield page
+        finally:
+            # The consumer stopped early or finished: let the reader thread exit
+            stop.set()
+
+    def _lookup(self, collection: str) -> Callable[[str], Optional[Dict[str, Any]]]:
+        """Document lookup for resolving cursors given as document IDs."""
+        return lambda document_id: self.db.get(collection, document_id)
+
+    @staticmethod
+    def _masked(document: Optional[Dict[str, Any]], field_mask: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        """A document projected onto a field mask (unchanged without one)."""
+        if document is None or field_mask is None:
+            return document
+        return project(document, field_mask)
+
+    def shutdown(self) -> None:
+        """Deliver queued listener events and close the storage backend."""
+        self.changes.dispatcher.shutdown()
+        self.db.close()
+
+    def _open_store(self) -> StorageBackend:
+        """Create the document store for the configured storage mode."""
+        if self.config['storage_mode'] == 'memory':
+            return DocumentStore()
+        if self.config['storage_mode'] != 'sqlite':
+            raise ValueError(f"Unknown storage mode '{self.config['storage_mode']}'")
+        return SQLiteStore(self.config['storage_path'])
+
+    def _cache_written(self, collection: str, document_id: str, document: Optional[Dict[str, Any]],
+                       fields: Optional[Set[str]] = None) -> None:
+        """Cache a committed write's result (None for a delete); fields are those an update wrote."""
+        cache_key = f"{collection}/{document_id}"
+        if document is None:
+            self.cache.put_missing(cache_key)
+        else:
+            self.cache.put(cache_key, document, fields)
+
+    def _count_transaction(self, counter: str, delta: int) -> None:
+        with self._transaction_lock:
+            self.transaction_stats[counter] += delta
+
     def _generate_doc_id(self) -> str:
         """Generate a unique document ID."""
         import uuid
@@ -274,7 +894,12 @@ class FirestoreAgent:
         """Get Firestore usage statistics."""
         return {
             'cached_documents': len(self.cache),
+            'cache': self.cache.get_stats(),
+            'stored_documents': self.db.count(),
+            'indexes': len(self.db.list_indexes()),
             'active_listeners': sum(1 for l in self.listeners if l['active']),
-            'transaction_active': self.transaction_active,
+            'changes': dict(self.changes.stats),
+            'transaction_active': self.transaction_stats['active'] > 0,
+            'transactions': dict(self.transaction_stats),
             'batch_queue_size': len(self.batch_queue)
         }
@@ -0,0 +1,134 @@
+"""
+Firestore Backup - Streaming collection export and import for the Firestore agent
+Encodes documents as NDJSON or length-prefixed binary records, optionally gzip or zstd compressed
+"""
+import gzip
+import json
+import os
+import struct
+import zlib
+from typing import Dict, List, Any, BinaryIO, Iterable, Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for compression='zstd'
+    zstandard = None
+
+FORMATS = ('ndjson', 'binary')
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+# Binary record header: payload length, payload crc32; the payload is the JSON [id, data] pair
+_FRAME = struct.Struct('<II')
+
+
+def check_options(format: str, compression: Optional[str]) -> None:
+    """
+    Raises:
+        ValueError: If the format or compression is unknown, or zstd is unavailable
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported export format '{format}'")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression '{compression}'")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs the 'zstandard' package")
+
+
+def encode_record(document_id: str, document: Dict[str, Any], format: str) -> bytes:
+    """One exported document."""
+    if format == 'ndjson':
+        return json.dumps({'id': document_id, 'data': document}, separators=(',', ':'),
+                          default=str).encode() + b'\n'
+    payload = json.dumps([document_id, document], separators=(',', ':'), default=str).encode()
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_pages(pages: Iterable[List[Tuple[str, Dict[str, Any]]]], format: str,
+                 compression: Optional[str] = None) -> Iterator[Tuple[bytes, str, int]]:
+    """
+    Encode pages of (document ID, document) pairs.
+
+    Each page becomes a self-contained chunk (a complete gzip member or
+    zstd frame when compressed), so chunks can be concatenated, and a file
+    cut after any chunk is still a valid export.
+
+    Yields:
+        (chunk bytes, last document ID of the page, documents in the page)
+    """
+    compressor = zstandard.ZstdCompressor() if compression == 'zstd' else None
+    for page in pages:
+        if not page:
+            continue
+        data = b''.join(encode_record(document_id, document, format) for document_id, document in page)
+        if compression == 'gzip':
+            data = gzip.compress(data, compresslevel=6, mtime=0)
+        elif compressor is not None:
+            data = compressor.compress(data)
+        yield data, page[-1][0], len(page)
+
+
+def open_reader(stream: BinaryIO, compression: Optional[str] = None) -> BinaryIO:
+    """Decompressing view of a binary stream (concatenated members or frames are read through)."""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    return stream
+
+
+def decode_records(stream: BinaryIO, format: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Read (document ID, document) pairs from a decompressed stream, one at a time.
+
+    Raises:
+        ValueError: If a record is truncated or corrupt
+    """
+    if format == 'ndjson':
+        for line in stream:
+            if line.strip():
+                record = json.loads(line)
+                yield record['id'], record['data']
+        return
+    while True:
+        header = _read_exactly(stream, _FRAME.size)
+        if not header:
+            return
+        length, crc = _FRAME.unpack(header)
+        payload = _read_exactly(stream, length)
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise ValueError("Truncated or corrupt binary export record")
+        document_id, document = json.loads(payload)
+        yield document_id, document
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    if data and len(data) < size:
+        raise ValueError("Truncated binary export record")
+    return data
+
+
+def load_checkpoint(path: Optional[str], expected: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Checkpoint saved at path if it belongs to the same operation (same keys as expected), else None."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if any(checkpoint.get(key) != value for key, value in expected.items()):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """Write a checkpoint atomically."""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
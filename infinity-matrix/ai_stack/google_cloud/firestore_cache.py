@@ -0,0 +1,207 @@
+"""
+Firestore Cache - Bounded read-through document cache for the Firestore agent
+Expires entries after a TTL and evicts least recently used ones past an entry or byte budget
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Iterable, Optional
+
+# Returned by DocumentCache.get when the cache cannot answer
+MISS = object()
+
+
+def approximate_size(value: Any, depth: int = 0) -> int:
+    """Rough in-memory size of a JSON-like value in bytes (CPython object overheads)."""
+    if depth > 32:
+        return 0
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, (bytes, bytearray)):
+        return 33 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(approximate_size(key, depth + 1) + approximate_size(item, depth + 1) + 32
+                        for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(approximate_size(item, depth + 1) + 8 for item in value)
+    return 32
+
+
+def _field_size(field: str, value: Any) -> int:
+    """A top-level field's share of approximate_size(document)."""
+    return approximate_size(field, 1) + approximate_size(value, 1) + 32
+
+
+class DocumentCache:
+    """
+    LRU cache of documents keyed by 'collection/id'.
+
+    Entries expire ttl seconds after they were loaded or written; reads
+    refresh recency but not the expiry. A miss can be cached too (a
+    negative entry, with its own shorter TTL) so repeated lookups of
+    absent documents skip the backend. The cache is bounded by entry
+    count and by the approximate size of the cached documents.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: Optional[int] = 64 * 1024 * 1024,
+                 ttl: float = 300, negative_ttl: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_entries: Most entries (documents and misses) held
+            max_bytes: Most approximate document bytes held (None for no limit)
+            ttl: Seconds a document stays valid
+            negative_ttl: Seconds a cached miss stays valid (0 disables)
+            clock: Monotonic time source
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.bytes = 0
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+        # Key -> (expires, document or None for a miss, size, size of each top-level field)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, count=False) is not MISS
+
+    def get(self, key: str, count: bool = True) -> Any:
+        """
+        Cached document, None for a cached miss, or MISS.
+
+        Args:
+            key: 'collection/id'
+            count: Record the lookup in the hit/miss statistics
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._drop(key)
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.stats['misses'] += 1
+                return MISS
+            self._entries.move_to_end(key)
+            if count:
+                self.stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+            return entry[1]
+
+    def get_many(self, keys: List[str]) -> List[Any]:
+        """get() for several keys under a single lock acquisition."""
+        with self._lock:
+            now = self.clock()
+            entries = self._entries
+            results = []
+            for key in keys:
+                entry = entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    self._drop(key)
+                    self.stats['expirations'] += 1
+                    entry = None
+                if entry is None:
+                    self.stats['misses'] += 1
+                    results.append(MISS)
+                    continue
+                entries.move_to_end(key)
+                self.stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+                results.append(entry[1])
+            return results
+
+    def put(self, key: str, document: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> None:
+        """
+        Cache a document loaded from or written to the backend.
+
+        Sizes are kept per top-level field. When fields names the top-level
+        fields a write changed and document is the object already cached (a
+        document the store updated in place), only those fields are measured
+        again, so the cost of a write follows what it changed rather than
+        the size of the document.
+        """
+        if fields is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] is document:
+                    _, _, size, sizes = entry
+                    for field in fields:
+                        size -= sizes.pop(field, 0)
+                        if field in document:
+                            sizes[field] = _field_size(field, document[field])
+                            size += sizes[field]
+                    self._store(key, document, size, sizes, self.ttl)
+                    return
+        sizes = {field: _field_size(field, value) for field, value in document.items()}
+        with self._lock:
+            self._store(key, document, 64 + sum(sizes.values()), sizes, self.ttl)
+
+    def put_missing(self, key: str) -> None:
+        """Remember that a document does not exist."""
+        if self.negative_ttl > 0:
+            with self._lock:
+                self._store(key, None, 0, None, self.negative_ttl)
+        else:
+            self.invalidate(key)
+
+    def invalidate(self, key: str) -> bool:
+        """Forget a key."""
+        with self._lock:
+            return self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counters plus current entry count and bytes."""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['negative_hits'] + self.stats['misses']
+            hits = self.stats['hits'] + self.stats['negative_hits']
+            return dict(self.stats, entries=len(self._entries), bytes=self.bytes,
+                        hit_rate=hits / lookups if lookups else 0.0)
+
+    def _store(self, key: str, document: Any, size: int, sizes: Optional[Dict[str, int]], ttl: float) -> None:
+        """Insert or replace an entry; the caller holds the lock."""
+        self._drop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (self.clock() + ttl, document, size, sizes)
+        self.bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop expired entries at the LRU end, then least recently used ones while over budget."""
+        entries = self._entries
+        now = self.clock()
+        while entries:
+            key, (expires, _, _, _) = next(iter(entries.items()))
+            if expires <= now:
+                self.stats['expirations'] += 1
+            elif len(entries) > self.max_entries or (self.max_bytes is not None
+                                                     and self.bytes > self.max_bytes):
+                self.stats['evictions'] += 1
+            else:
+                break
+            self._drop(key)
+
+    def _drop(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[2]
+        return True
@@ -0,0 +1,180 @@
+"""
+Firestore Changes - Per-collection change log and incremental listener delivery
+Turns every document write into added/modified/removed events for the listeners it affects
+"""
+from collections import deque
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+from .firestore_query import Query
+from .firestore_transforms import copy_value
+from .pubsub_dispatch import SubscriberDispatcher
+
+
+class Listener:
+    """A registered collection listener and the IDs of the documents in its view."""
+
+    __slots__ = ('id', 'collection', 'query', 'callback', 'matched', 'sequence')
+
+    def __init__(self, listener_id: str, collection: str, query: Optional[Query],
+                 callback: Callable[[Dict[str, Any]], None]):
+        self.id = listener_id
+        self.collection = collection
+        self.query = query
+        self.callback = callback
+        self.matched = set()
+        self.sequence = 0  # Last change delivered
+
+    def classify(self, document_id: str, document: Optional[Dict[str, Any]]) -> Optional[str]:
+        """
+        Update the view for one changed document and name the change it
+        makes to it, or None if the document is outside the view before and after.
+        """
+        before = document_id in self.matched
+        if document is not None and (self.query is None or self.query.matches(document)):
+            self.matched.add(document_id)
+            return 'modified' if before else 'added'
+        if before:
+            self.matched.discard(document_id)
+            return 'removed'
+        return None
+
+
+class ChangeFeed:
+    """
+    Change log and listener registry for a document store.
+
+    Every write gets the next sequence number of its collection and is
+    appended to that collection's bounded log. Each listener keeps the set
+    of document IDs its filters currently match, so a write is classified
+    by evaluating the filters against the changed document only. Events
+    are delivered off the writing thread, in order per listener.
+
+    A sequence number doubles as a resume token: a listener registered
+    with one is sent only the changes made after it, as long as they are
+    still in the log.
+    """
+
+    def __init__(self, dispatcher: SubscriberDispatcher, log_size: int = 10000):
+        """
+        Initialize an empty feed.
+
+        Args:
+            dispatcher: Delivers events to listener callbacks
+            log_size: Changes kept per collection for resuming listeners
+        """
+        self.dispatcher = dispatcher
+        self.log_size = log_size
+        self.logs: Dict[str, deque] = {}  # Collection -> (sequence, document ID, change type)
+        self.sequences: Dict[str, int] = {}
+        self.listeners: Dict[str, Dict[str, Listener]] = {}  # Collection -> listener ID -> Listener
+        self.stats = {
+            'changes': 0,
+            'events': 0,
+            'events_dropped': 0
+        }
+
+    def record(self, collection: str, document_id: str, document: Optional[Dict[str, Any]],
+               existed: bool) -> int:
+        """
+        Log a write and notify the collection's listeners. Called with the
+        store's lock held, so sequence numbers follow write order.
+
+        Args:
+            collection: Collection path
+            document_id: Written document
+            document: Document after the write, or None if it was deleted
+            existed: Whether the document existed before the write
+
+        Returns:
+            The change's sequence number
+        """
+        sequence = self.sequences.get(collection, 0) + 1
+        self.sequences[collection] = sequence
+        change_type = 'removed' if document is None else ('modified' if existed else 'added')
+        log = self.logs.get(collection)
+        if log is None:
+            log = self.logs[collection] = deque(maxlen=self.log_size)
+        log.append((sequence, document_id, change_type))
+        self.stats['changes'] += 1
+
+        snapshot = None
+        for listener in self.listeners.get(collection, {}).values():
+            event_type = listener.classify(document_id, document)
+            if event_type is not None:
+                if snapshot is None and document is not None:
+                    # Stored documents are updated in place; events get a copy taken now
+                    snapshot = copy_value(document)
+                self._send(listener, event_type, document_id, snapshot, sequence)
+        return sequence
+
+    def subscribe(self, listener: Listener, documents: List[Tuple[str, Dict[str, Any]]],
+                  lookup: Callable[[str], Optional[Dict[str, Any]]],
+                  resume_token: Optional[int] = None) -> None:
+        """
+        Register a listener. Called with the store's lock held.
+
+        Without a resume token the listener first receives every document
+        in `documents` as 'added'. With one, it receives the changes made
+        after that sequence number, one event per document with its current
+        state. A document that existed at the token, changed, and no longer
+        matches is sent as 'removed' even if the listener never had it.
+
+        Args:
+            listener: Listener to add
+            documents: (ID, document) pairs currently matching its filters
+            lookup: Current document by ID (None if deleted)
+            resume_token: Sequence number of the last change the listener saw
+
+        Raises:
+            ValueError: If changes after resume_token are no longer in the log
+        """
+        collection = listener.collection
+        sequence = self.sequences.get(collection, 0)
+        listener.matched = {document_id for document_id, _ in documents}
+        listener.sequence = sequence
+
+        if resume_token is None:
+            for document_id, document in documents:
+                self._send(listener, 'added', document_id, copy_value(document), sequence)
+        else:
+            log = self.logs.get(collection, ())
+            oldest = log[0][0] if log else sequence + 1
+            if not oldest - 1 <= resume_token <= sequence:
+                raise ValueError(f"Resume token {resume_token} is outside the change log of '{collection}'")
+            # Latest change per document, and whether the document is new since the token
+            changed: Dict[str, Tuple[int, bool]] = {}
+            for change_sequence, document_id, change_type in log:
+                if change_sequence > resume_token:
+                    created = changed[document_id][1] if document_id in changed else change_type == 'added'
+                    changed[document_id] = (change_sequence, created)
+            for document_id, (change_sequence, created) in sorted(changed.items(), key=lambda i: i[1][0]):
+                if document_id in listener.matched:
+                    self._send(listener, 'added' if created else 'modified', document_id,
+                               copy_value(lookup(document_id)), change_sequence)
+                elif not created:
+                    # Documents created after the token never reached the listener
+                    self._send(listener, 'removed', document_id, None, change_sequence)
+
+        self.listeners.setdefault(collection, {})[listener.id] = listener
+
+    def unsubscribe(self, listener_id: str) -> bool:
+        for listeners in self.listeners.values():
+            if listeners.pop(listener_id, None) is not None:
+                return True
+        return False
+
+    def _send(self, listener: Listener, event_type: str, document_id: str,
+              document: Optional[Dict[str, Any]], sequence: int) -> None:
+        event = {
+            'type': event_type,
+            'collection': listener.collection,
+            'document_id': document_id,
+            'document': document,
+            'resume_token': sequence
+        }
+        listener.sequence = max(listener.sequence, sequence)
+        if self.dispatcher.submit(listener.id, [listener.callback], event):
+            self.stats['events'] += 1
+        else:
+            # The listener's inbox is full; it can resume from its last token
+            self.stats['events_dropped'] += 1
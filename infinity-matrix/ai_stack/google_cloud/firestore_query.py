@@ -0,0 +1,308 @@
+"""
+Firestore Query - Value ordering, field paths and filter evaluation for the Firestore agent
+Compiles where/order_by/limit clauses into a Query the document store can plan against its indexes
+"""
+import math
+from datetime import datetime
+from typing import Dict, List, Any, Callable, Iterable, Optional, Sequence, Tuple, Union
+
+# Returned by get_field for absent fields; never equal to a stored value
+MISSING = object()
+
+RANGE_OPERATORS = ('<', '<=', '>', '>=')
+EQUALITY_OPERATORS = ('==', 'in', 'array-contains', 'array-contains-any')
+OPERATORS = RANGE_OPERATORS + EQUALITY_OPERATORS + ('!=', 'not-in')
+DIRECTIONS = ('asc', 'desc')
+ARRAY_CONTAINS = 'array-contains'  # Index "direction" of a field indexed by array element
+
+# Firestore orders values of different types by type first
+_NULL, _BOOLEAN, _NUMBER, _TIMESTAMP, _STRING, _BYTES, _ARRAY, _MAP = range(8)
+
+
+def get_field(document: Dict[str, Any], path: str) -> Any:
+    """Value at a dotted field path ('stats.count'), or MISSING."""
+    if '.' not in path:
+        return document.get(path, MISSING)
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def order_key(value: Any) -> Tuple:
+    """
+    Sort key giving Firestore's cross-type value ordering: null < booleans
+    < numbers < timestamps < strings < bytes < arrays < maps. Equal keys
+    mean equal values, including 1 == 1.0.
+    """
+    if value is None:
+        return (_NULL,)
+    if isinstance(value, bool):
+        return (_BOOLEAN, value)
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and math.isnan(value):
+            return (_NUMBER, -math.inf, 0)  # NaN sorts with the smallest numbers
+        return (_NUMBER, value)
+    if isinstance(value, datetime):
+        return (_TIMESTAMP, value.timestamp())
+    if isinstance(value, str):
+        return (_STRING, value)
+    if isinstance(value, (bytes, bytearray)):
+        return (_BYTES, bytes(value))
+    if isinstance(value, (list, tuple)):
+        return (_ARRAY, tuple(order_key(item) for item in value))
+    if isinstance(value, dict):
+        return (_MAP, tuple((key, order_key(value[key])) for key in sorted(value)))
+    return (_STRING, str(value))
+
+
+def type_bounds(key: Tuple) -> Tuple[Tuple, Tuple]:
+    """Keys below and above every value of the same type as key."""
+    return (key[0],), (key[0] + 1,)
+
+
+class Descending:
+    """Order key of a descending field: compares in reverse."""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key: Tuple):
+        self.key = key
+
+    def __lt__(self, other):
+        if isinstance(other, Descending):
+            return other.key < self.key
+        return NotImplemented
+
+    def __gt__(self, other):
+        if isinstance(other, Descending):
+            return self.key < other.key
+        return NotImplemented
+
+    def __eq__(self, other):
+        return isinstance(other, Descending) and other.key == self.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+def directed(key: Tuple, direction: str) -> Any:
+    """An order key wrapped so that it sorts ascending in the given direction."""
+    return Descending(key) if direction == 'desc' else key
+
+
+# A query cursor: the values of the leading order_by fields, optionally
+# followed by a document ID, or just a document ID (resolved to its values)
+Cursor = Union[str, Sequence[Any]]
+
+
+class Filter:
+    """One where clause with its value pre-converted to order keys."""
+
+    __slots__ = ('field', 'operator', 'value', 'key', 'keys')
+
+    def __init__(self, field: str, operator: str, value: Any):
+        """
+        Raises:
+            ValueError: If the operator is unknown or needs a list value
+        """
+        if operator not in OPERATORS:
+            raise ValueError(f"Unsupported operator '{operator}'")
+        self.field = field
+        self.operator = operator
+        self.value = value
+        self.key = None
+        self.keys = None
+        if operator in ('in', 'not-in', 'array-contains-any'):
+            if not isinstance(value, (list, tuple, set)):
+                raise ValueError(f"Operator '{operator}' needs a list value")
+            self.keys = {order_key(item) for item in value}
+        else:
+            self.key = order_key(value)
+
+    def matches(self, document: Dict[str, Any]) -> bool:
+        """True if the document satisfies this clause; absent fields never do."""
+        value = get_field(document, self.field)
+        if value is MISSING:
+            return False
+        operator = self.operator
+        if operator == 'array-contains':
+            return isinstance(value, list) and any(order_key(item) == self.key for item in value)
+        if operator == 'array-contains-any':
+            return isinstance(value, list) and any(order_key(item) in self.keys for item in value)
+        key = order_key(value)
+        if operator == '==':
+            return key == self.key
+        if operator == '!=':
+            return key != self.key and value is not None
+        if operator == 'in':
+            return key in self.keys
+        if operator == 'not-in':
+            return key not in self.keys and value is not None
+        # Range filters only match values of the same type
+        if key[0] != self.key[0]:
+            return False
+        if operator == '<':
+            return key < self.key
+        if operator == '<=':
+            return key <= self.key
+        if operator == '>':
+            return key > self.key
+        return key >= self.key
+
+    def __repr__(self) -> str:
+        return f"Filter({self.field!r}, {self.operator!r}, {self.value!r})"
+
+
+class Query:
+    """
+    A compiled collection query.
+
+    Results come in the query's full order: the order_by fields, then
+    document ID. As in Firestore, documents without an order_by field are
+    excluded, and a query without order_by but with an inequality filter
+    ('<', '!=', 'not-in', ...) is ordered by that field.
+
+    Cursors (start_after, end_before) are positions in that order. A
+    cursor with fewer values compares on the fields it has, so
+    start_after=[5] on order_by agents skips every document with
+    agents <= 5.
+    """
+
+    __slots__ = ('filters', 'order_by', 'limit', 'start_after', 'end_before', 'start_key', 'end_key')
+
+    def __init__(self, filters: Iterable[Filter] = (), order_by: Iterable[Tuple[str, str]] = (),
+                 limit: Optional[int] = None, start_after: Optional[Cursor] = None,
+                 end_before: Optional[Cursor] = None,
+                 lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        """
+        Args:
+            filters: Where clauses
+            order_by: (field path, 'asc' | 'desc') pairs
+            limit: Most results, or None
+            start_after: Cursor results come after
+            end_before: Cursor results come before
+            lookup: lookup(document_id) -> document, resolving cursors
+                    given as a document ID
+
+        Raises:
+            ValueError: If a direction is not 'asc' or 'desc', limit is
+                        negative, or a cursor is invalid
+        """
+        self.filters = list(filters)
+        self.order_by = []
+        for field, direction in order_by:
+            direction = (direction or 'asc').lower()
+            if direction not in DIRECTIONS:
+                raise ValueError(f"Unsupported order direction '{direction}'")
+            self.order_by.append((field, direction))
+        if not self.order_by:
+            inequality = next((f.field for f in self.filters
+                               if f.operator in RANGE_OPERATORS + ('!=', 'not-in')), None)
+            if inequality is not None:
+                self.order_by.append((inequality, 'asc'))
+        if limit is not None and limit < 0:
+            raise ValueError("Limit must not be negative")
+        self.limit = limit
+        self.start_after = self._cursor_values(start_after, lookup)
+        self.end_before = self._cursor_values(end_before, lookup)
+        self.start_key = None if self.start_after is None else self.cursor_key(self.start_after)
+        self.end_key = None if self.end_before is None else self.cursor_key(self.end_before)
+
+    @classmethod
+    def from_config(cls, query_config: Dict[str, Any],
+                    lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None) -> 'Query':
+        """Build from the query_documents dict form ('where', 'order_by', 'limit', 'start_after', 'end_before')."""
+        filters = [Filter(clause['field'], clause['operator'], clause['value'])
+                   for clause in query_config.get('where', [])]
+        order_by = [(clause['field'], clause.get('direction', 'asc'))
+                    for clause in query_config.get('order_by', [])]
+        return cls(filters, order_by, query_config.get('limit', 100), query_config.get('start_after'),
+                   query_config.get('end_before'), lookup)
+
+    @classmethod
+    def from_filters(cls, filters: Optional[List[tuple]], limit: Optional[int],
+                     start_after: Optional[Cursor] = None, end_before: Optional[Cursor] = None,
+                     lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None) -> 'Query':
+        """Build from (field, operator, value) tuples."""
+        return cls([Filter(field, operator, value) for field, operator, value in filters or []],
+                   limit=limit, start_after=start_after, end_before=end_before, lookup=lookup)
+
+    def _cursor_values(self, cursor: Optional[Cursor],
+                       lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]]) -> Optional[List[Any]]:
+        """
+        Values of a cursor; a document ID becomes the document's order_by
+        values followed by its ID.
+
+        Raises:
+            ValueError: If the cursor document does not exist or lacks an order_by field
+        """
+        if cursor is None or not isinstance(cursor, str):
+            return None if cursor is None else list(cursor)
+        document = lookup(cursor) if lookup is not None else None
+        if document is None:
+            raise ValueError(f"Cursor document '{cursor}' does not exist")
+        if any(get_field(document, field) is MISSING for field, _ in self.order_by):
+            raise ValueError(f"Cursor document '{cursor}' lacks an order_by field")
+        return self.continuation(cursor, document)
+
+    @property
+    def has_cursors(self) -> bool:
+        return self.start_after is not None or self.end_before is not None
+
+    def position(self, document_id: str, document: Dict[str, Any]) -> Tuple:
+        """Sort key of a document in the query's full order (order_by fields, then document ID)."""
+        return tuple(directed(order_key(get_field(document, field)), direction)
+                     for field, direction in self.order_by) + (document_id,)
+
+    def cursor_key(self, values: List[Any]) -> Tuple:
+        """
+        Cursor values as a (possibly partial) position.
+
+        Raises:
+            ValueError: If there are no values, more than the order_by
+                        fields plus a document ID, or that ID is not a string
+        """
+        if not values or len(values) > len(self.order_by) + 1:
+            raise ValueError("A cursor has one value per leading order_by field, optionally followed "
+                             "by a document ID")
+        key = tuple(directed(order_key(value), direction)
+                    for value, (_, direction) in zip(values, self.order_by))
+        if len(values) > len(self.order_by):
+            if not isinstance(values[-1], str):
+                raise ValueError("The cursor value after the order_by values must be a document ID")
+            key += (values[-1],)
+        return key
+
+    def after_start(self, position: Tuple) -> bool:
+        """True if a position comes after start_after (or there is none)."""
+        return self.start_key is None or position[:len(self.start_key)] > self.start_key
+
+    def before_end(self, position: Tuple) -> bool:
+        """True if a position comes before end_before (or there is none)."""
+        return self.end_key is None or position[:len(self.end_key)] < self.end_key
+
+    def continuation(self, document_id: str, document: Dict[str, Any]) -> List[Any]:
+        """Cursor values that resume the query after a document."""
+        return [get_field(document, field) for field, _ in self.order_by] + [document_id]
+
+    def matches(self, document: Dict[str, Any]) -> bool:
+        """True if the document passes every filter and has every order_by field."""
+        for query_filter in self.filters:
+            if not query_filter.matches(document):
+                return False
+        for field, _ in self.order_by:
+            if get_field(document, field) is MISSING:
+                return False
+        return True
+
+    def sort(self, documents: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Order (document ID, document) pairs by order_by, then by ID."""
+        documents.sort(key=lambda item: item[0])
+        for field, direction in reversed(self.order_by):
+            documents.sort(key=lambda item: order_key(get_field(item[1], field)),
+                           reverse=direction == 'desc')
+        return documents
+
@@ -0,0 +1,428 @@
+"""
+Firestore SQLite - Persistent embedded storage backend for the Firestore agent
+Keeps documents as JSON in a WAL-mode SQLite database indexed through generated columns
+"""
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+from .firestore_query import RANGE_OPERATORS, Filter, Query
+from .firestore_transforms import apply_update, commit_clock, resolve
+from .firestore_store import WRITE_OPERATIONS, StorageBackend, TransactionConflict, index_definition
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS indexes (
+    name TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    fields TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS field_columns (
+    path TEXT PRIMARY KEY,
+    number INTEGER NOT NULL UNIQUE
+);
+"""
+
+# Firestore's type order (see firestore_query.order_key) from SQLite's json_type()
+_TYPE_RANK = ("CASE json_type(data, {path}) WHEN 'null' THEN 0 WHEN 'true' THEN 1 WHEN 'false' THEN 1 "
+              "WHEN 'integer' THEN 2 WHEN 'real' THEN 2 WHEN 'text' THEN 4 WHEN 'array' THEN 6 "
+              "WHEN 'object' THEN 7 END")
+
+_SQL_OPERATORS = {'==': '=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+_MAX_INTEGER = 2 ** 63 - 1
+
+
+def _sql_path(path: str) -> str:
+    """SQL string literal of the JSON path for a dotted field path."""
+    if '"' in path:
+        raise ValueError(f"Field path {path!r} cannot contain '\"'")
+    json_path = '$' + ''.join(f'."{part}"' for part in path.split('.'))
+    return "'" + json_path.replace("'", "''") + "'"
+
+
+def _scalar(value: Any) -> Optional[Tuple[int, Any]]:
+    """(type rank, SQL parameter) for a value SQLite compares like Firestore, else None."""
+    if value is None:
+        return 0, None
+    if isinstance(value, bool):
+        return 1, int(value)
+    if isinstance(value, int) and abs(value) <= _MAX_INTEGER:
+        return 2, value
+    if isinstance(value, float) and value == value:
+        return 2, value
+    if isinstance(value, str):
+        return 4, value
+    return None
+
+
+class SQLiteStore(StorageBackend):
+    """
+    Document store persisted in a SQLite database file.
+
+    Documents are stored as JSON text, one row per document, keyed by
+    (collection, id). The journal runs in WAL mode with synchronous=NORMAL,
+    so a write costs an append to the log rather than an fsync, and a crash
+    loses at most the last few commits, never consistency.
+
+    create_index adds virtual generated columns for each indexed field
+    path, holding its value (json_extract) and its Firestore type rank,
+    and a SQL index over (collection, rank, value, ...) for them. Queries
+    referencing those columns are planned by SQLite onto the index.
+    Filters SQL can evaluate exactly (==, in, and ranges on null, boolean,
+    number and string values) run in SQL together with order_by and limit;
+    the rest are narrowed in SQL where possible and checked in Python.
+
+    Arrays and maps compare by type like in Firestore, but within their
+    type in order_by they sort by JSON text rather than element by element.
+    Values round-trip through JSON: timestamps and bytes come back as
+    strings, and NaN cannot be stored.
+    """
+
+    def __init__(self, path: str,
+                 on_change: Optional[Callable[[str, str, Optional[Dict[str, Any]], bool], Any]] = None):
+        """
+        Open (creating if needed) a database.
+
+        Args:
+            path: Database file, or ':memory:'
+            on_change: Called after every committed write (see StorageBackend)
+        """
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.on_change = on_change
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._columns: Dict[str, int] = dict(self._connection.execute(
+            'SELECT path, number FROM field_columns'))
+        last_version = self._connection.execute('SELECT COALESCE(MAX(version), 0) FROM documents').fetchone()[0]
+        self._versions = itertools.count(last_version + 1)
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._lock
+
+    def get(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+        return self.read(collection, document_id)[0]
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        if not keys:
+            return []
+        # One statement for any number of keys: join the key list (as JSON) on the primary key
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT d.collection, d.id, d.data FROM json_each(?) AS k JOIN documents AS d "
+                "ON d.collection = json_extract(k.value, '$[0]') AND d.id = json_extract(k.value, '$[1]')",
+                (json.dumps(keys),)).fetchall()
+        found = {(collection, document_id): data for collection, document_id, data in rows}
+        return [json.loads(found[key]) if key in found else None for key in map(tuple, keys)]
+
+    def read(self, collection: str, document_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT data, version FROM documents WHERE collection = ? AND id = ?',
+                (collection, document_id)).fetchone()
+        if row is None:
+            return None, 0
+        return json.loads(row[0]), row[1]
+
+    def version(self, collection: str, document_id: str) -> int:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT version FROM documents WHERE collection = ? AND id = ?',
+                (collection, document_id)).fetchone()
+        return row[0] if row is not None else 0
+
+    def set(self, collection: str, document_id: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        return self.commit({}, [('set', collection, document_id, document)])[0]
+
+    def update(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            version = self.version(collection, document_id)
+            if version == 0:
+                return None
+            return self.commit({(collection, document_id): version},
+                               [('update', collection, document_id, data)])[0]
+
+    def delete(self, collection: str, document_id: str) -> bool:
+        with self._lock:
+            version = self.version(collection, document_id)
+            if version == 0:
+                return False
+            self.commit({}, [('delete', collection, document_id, None)])
+            return True
+
+    def commit(self, reads: Dict[Tuple[str, str], int],
+               writes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]]) -> List[Optional[Dict[str, Any]]]:
+        for operation, _, _, _ in writes:
+            if operation not in WRITE_OPERATIONS:
+                raise ValueError(f"Unsupported write operation '{operation}'")
+        with self._lock:
+            changes = []
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                for (collection, document_id), version in reads.items():
+                    if self.version(collection, document_id) != version:
+                        raise TransactionConflict(f"Document '{collection}/{document_id}' changed "
+                                                  f"after it was read")
+                timestamp = commit_clock()
+                results = [self._write(operation, collection, document_id, data, timestamp, changes)
+                           for operation, collection, document_id, data in writes]
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            if self.on_change is not None:
+                for change in changes:
+                    self.on_change(*change)
+            return results
+
+    def items(self, collection: str) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, data FROM documents WHERE collection = ? ORDER BY id', (collection,)).fetchall()
+        return [(document_id, json.loads(data)) for document_id, data in rows]
+
+    def scan(self, collection: str, start_after: Optional[str] = None,
+             limit: int = 1000) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, data FROM documents WHERE collection = ? AND (? IS NULL OR id > ?) '
+                'ORDER BY id LIMIT ?', (collection, start_after, start_after, limit)).fetchall()
+        return [(document_id, json.loads(data)) for document_id, data in rows]
+
+    def create_index(self, collection: str, fields: List[Any]) -> str:
+        name, normalized = index_definition(collection, fields)
+        with self._lock:
+            if self._connection.execute('SELECT 1 FROM indexes WHERE name = ?', (name,)).fetchone():
+                return name
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                columns = ['collection']
+                for path, direction in normalized:
+                    if direction == 'array-contains':
+                        continue  # SQLite cannot index array elements; json_each filters them
+                    number = self._field_columns(path)
+                    order = ' DESC' if direction == 'desc' else ''
+                    columns += [f"t{number}{order}", f"v{number}{order}"]
+                columns.append('id')
+                if len(columns) > 2:
+                    self._connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS {self._quote(name)} ON documents({', '.join(columns)})")
+                self._connection.execute('INSERT INTO indexes VALUES (?, ?, ?)',
+                                         (name, collection, json.dumps(normalized)))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return name
+
+    def query(self, collection: str, query: Query) -> List[Tuple[str, Dict[str, Any]]]:
+        sql, parameters, exact = self._compile(collection, query)
+        with self._lock:
+            rows = self._connection.execute(sql, parameters)
+            if exact:
+                return [(document_id, json.loads(data)) for document_id, data in rows]
+            results = []
+            for document_id, data in rows:
+                document = json.loads(data)
+                if query.has_cursors:
+                    position = query.position(document_id, document)
+                    if not query.before_end(position):
+                        break
+                    if not query.after_start(position):
+                        continue
+                if query.matches(document):
+                    results.append((document_id, document))
+                    if query.limit is not None and len(results) >= query.limit:
+                        break
+            return results
+
+    def explain(self, collection: str, query: Query) -> Optional[str]:
+        sql, parameters, _ = self._compile(collection, query)
+        with self._lock:
+            plan = self._connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        for row in plan:
+            match = re.search(r'USING (?:COVERING )?INDEX (\S+)', row[-1])
+            if match:
+                return match.group(1)
+        return None
+
+    def list_indexes(self, collection: Optional[str] = None) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT name FROM indexes WHERE ? IS NULL OR collection = ? ORDER BY rowid',
+                (collection, collection)).fetchall()
+        return [name for name, in rows]
+
+    def count(self, collection: Optional[str] = None) -> int:
+        with self._lock:
+            if collection is None:
+                return self._connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+            return self._connection.execute('SELECT COUNT(*) FROM documents WHERE collection = ?',
+                                            (collection,)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _write(self, operation: str, collection: str, document_id: str, data: Optional[Dict[str, Any]],
+               timestamp: Callable[[], str], changes: List[Tuple]) -> Optional[Dict[str, Any]]:
+        """Apply one write inside the open SQL transaction, queueing its change notification."""
+        row = self._connection.execute('SELECT data FROM documents WHERE collection = ? AND id = ?',
+                                       (collection, document_id)).fetchone()
+        if operation == 'delete':
+            if row is None:
+                return None
+            self._connection.execute('DELETE FROM documents WHERE collection = ? AND id = ?',
+                                     (collection, document_id))
+            changes.append((collection, document_id, None, True))
+            return None
+
+        if operation == 'update':
+            document = apply_update(json.loads(row[0]) if row is not None else {}, data, timestamp)
+        else:
+            document = resolve(data, timestamp)
+        self._connection.execute(
+            'INSERT INTO documents (collection, id, version, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (collection, id) DO UPDATE SET version = excluded.version, data = excluded.data',
+            (collection, document_id, next(self._versions),
+             json.dumps(document, separators=(',', ':'), allow_nan=False, default=str)))
+        changes.append((collection, document_id, document, row is not None))
+        return document
+
+    def _field_columns(self, path: str) -> int:
+        """Number n of the generated columns v<n> (value) and t<n> (type rank) for a field path."""
+        number = self._columns.get(path)
+        if number is None:
+            number = len(self._columns) + 1
+            literal = _sql_path(path)
+            self._connection.execute(f"ALTER TABLE documents ADD COLUMN v{number} "
+                                     f"GENERATED ALWAYS AS (json_extract(data, {literal})) VIRTUAL")
+            self._connection.execute(f"ALTER TABLE documents ADD COLUMN t{number} "
+                                     f"GENERATED ALWAYS AS ({_TYPE_RANK.format(path=literal)}) VIRTUAL")
+            self._connection.execute('INSERT INTO field_columns VALUES (?, ?)', (path, number))
+            self._columns[path] = number
+        return number
+
+    def _expressions(self, path: str) -> Tuple[str, str]:
+        """SQL for a field's value and type rank, using its generated columns when it has them."""
+        number = self._columns.get(path)
+        if number is not None:
+            return f"v{number}", f"t{number}"
+        literal = _sql_path(path)
+        return f"json_extract(data, {literal})", _TYPE_RANK.format(path=literal)
+
+    def _filter_sql(self, query_filter: Filter) -> Optional[Tuple[str, List[Any], bool]]:
+        """(SQL condition, parameters, whether it is exact) for a filter, or None if SQL cannot help."""
+        value_sql, rank_sql = self._expressions(query_filter.field)
+        operator = query_filter.operator
+        if operator == '==' or operator in RANGE_OPERATORS:
+            scalar = _scalar(query_filter.value)
+            if scalar is None:
+                return None
+            rank, value = scalar
+            if rank == 0:
+                # Only null equals null, and ordering never strictly separates nulls
+                return (f"{rank_sql} = 0", [], True) if operator in ('==', '<=', '>=') else ('0', [], True)
+            return f"({rank_sql} = ? AND {value_sql} {_SQL_OPERATORS[operator]} ?)", [rank, value], True
+        if operator == 'in':
+            scalars = [_scalar(item) for item in query_filter.value]
+            if any(scalar is None for scalar in scalars):
+                return None
+            if not scalars:
+                return '0', [], True
+            clauses, parameters = [], []
+            for rank, value in scalars:
+                if rank == 0:
+                    clauses.append(f"{rank_sql} = 0")
+                else:
+                    clauses.append(f"({rank_sql} = ? AND {value_sql} = ?)")
+                    parameters += [rank, value]
+            return f"({' OR '.join(clauses)})", parameters, True
+        if operator in ('array-contains', 'array-contains-any'):
+            values = [query_filter.value] if operator == 'array-contains' else list(query_filter.value)
+            scalars = [_scalar(item) for item in values]
+            if not scalars or any(scalar is None or scalar[0] == 0 for scalar in scalars):
+                return None
+            literal = _sql_path(query_filter.field)
+            # Booleans and 0/1 look alike in json_each; Python settles them
+            placeholders = ', '.join('?' for _ in scalars)
+            return (f"EXISTS (SELECT 1 FROM json_each(data, {literal}) WHERE value IN ({placeholders}))",
+                    [value for _, value in scalars], False)
+        return None
+
+    def _compile(self, collection: str, query: Query) -> Tuple[str, List[Any], bool]:
+        """SQL for a query, its parameters, and whether SQL alone yields the exact result."""
+        conditions, parameters, exact = ['collection = ?'], [collection], True
+        for query_filter in query.filters:
+            clause = self._filter_sql(query_filter)
+            if clause is None:
+                exact = False
+                continue
+            conditions.append(clause[0])
+            parameters += clause[1]
+            exact = exact and clause[2]
+        ordering = []
+        for field, direction in query.order_by:
+            value_sql, rank_sql = self._expressions(field)
+            conditions.append(f"{rank_sql} IS NOT NULL")  # Documents without the field are excluded
+            order = ' DESC' if direction == 'desc' else ''
+            ordering += [rank_sql + order, value_sql + order]
+        ordering.append('id')
+        for values, after in ((query.start_after, True), (query.end_before, False)):
+            if values is None:
+                continue
+            clause = self._cursor_sql(query, values, after)
+            if clause is None:
+                exact = False
+                continue
+            conditions.append(clause[0])
+            parameters += clause[1]
+        sql = f"SELECT id, data FROM documents WHERE {' AND '.join(conditions)} ORDER BY {', '.join(ordering)}"
+        if exact and query.limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(query.limit)
+        return sql, parameters, exact
+
+    def _cursor_sql(self, query: Query, values: List[Any], after: bool) -> Optional[Tuple[str, List[Any]]]:
+        """
+        Keyset condition keeping rows strictly after (or before) a cursor
+        in ORDER BY order, or None if a cursor value is not a SQL scalar.
+        """
+        terms = []
+        for value, (field, direction) in zip(values, query.order_by):
+            scalar = _scalar(value)
+            if scalar is None:
+                return None
+            value_sql, rank_sql = self._expressions(field)
+            beyond = '>' if after == (direction == 'asc') else '<'
+            terms.append((f"({rank_sql} {beyond} ? OR ({rank_sql} = ? AND {value_sql} {beyond} ?))",
+                          [scalar[0], scalar[0], scalar[1]],
+                          f"({rank_sql} = ? AND {value_sql} IS ?)", list(scalar)))
+        if len(values) > len(query.order_by):
+            terms.append((f"id {'>' if after else '<'} ?", [values[-1]], None, None))
+        # (a > x) OR (a = x AND ((b > y) OR (b = y AND ...)))
+        sql, parameters = terms[-1][0], list(terms[-1][1])
+        for strict, strict_parameters, equal, equal_parameters in reversed(terms[:-1]):
+            sql = f"({strict} OR ({equal} AND {sql}))"
+            parameters = strict_parameters + equal_parameters + parameters
+        return sql, parameters
+
+    @staticmethod
+    def _quote(identifier: str) -> str:
+        return '"' + identifier.replace('"', '""') + '"'
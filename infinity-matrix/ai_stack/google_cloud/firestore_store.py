@@ -0,0 +1,932 @@
+"""
+Firestore Store - In-memory document store with sorted secondary indexes
+Keeps documents per collection and answers queries from single-field and composite indexes
+"""
+import heapq
+import itertools
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, Any, Callable, Iterator, Optional, Tuple
+
+from .firestore_transforms import apply_update, commit_clock, copy_value, resolve, touched_fields
+from .firestore_query import (ARRAY_CONTAINS, DIRECTIONS, MISSING, RANGE_OPERATORS, Descending, Query,
+                              directed, get_field, order_key, type_bounds)
+
+# More seeks than this (from 'in' / 'array-contains-any' expansion) fall back to a scan
+MAX_INDEX_SEEKS = 100
+
+WRITE_OPERATIONS = ('set', 'update', 'delete')
+
+
+class TransactionConflict(Exception):
+    """Raised when a document read by a transaction changed before it committed."""
+
+
+def index_definition(collection: str, fields: List[Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """
+    Name and normalized (field, direction) pairs of an index.
+
+    Raises:
+        ValueError: If fields is empty, a direction is unknown, or more
+                    than one field is 'array-contains'
+    """
+    normalized = []
+    for field in fields:
+        path, direction = (field, 'asc') if isinstance(field, str) else field
+        direction = {'ascending': 'asc', 'descending': 'desc'}.get(direction.lower(),
+                                                                  direction.lower())
+        if direction not in DIRECTIONS + (ARRAY_CONTAINS,):
+            raise ValueError(f"Unsupported index direction '{direction}'")
+        normalized.append((path, direction))
+    if not normalized:
+        raise ValueError("An index needs at least one field")
+    if sum(direction == ARRAY_CONTAINS for _, direction in normalized) > 1:
+        raise ValueError("An index can have only one array-contains field")
+
+    name = f"index_{collection}_" + '_'.join(f"{path}_{direction}"
+                                             for path, direction in normalized)
+    return name, tuple(normalized)
+
+
+class StorageBackend:
+    """
+    Interface FirestoreAgent uses to store documents.
+
+    Documents are plain dicts addressed by (collection, document ID). Each
+    write gives the document a new, store-wide increasing version; absent
+    documents have version 0. Writes call on_change(collection,
+    document_id, document, existed) while holding `lock`, with document
+    None for a delete. Reads may return the stored object itself, so
+    callers treat results as read-only.
+
+    DocumentStore keeps everything in memory; SQLiteStore persists to a
+    local database file.
+    """
+
+    on_change: Optional[Callable[[str, str, Optional[Dict[str, Any]], bool], Any]] = None
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Lock held by every write; hold it to read and act on a consistent state."""
+        raise NotImplementedError
+
+    def get(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """Stored document, or None."""
+        raise NotImplementedError
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """Documents for (collection, document ID) keys in one round trip, in key order (None if absent)."""
+        raise NotImplementedError
+
+    def read(self, collection: str, document_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Copy of a document (None if absent) and the version it was read at."""
+        raise NotImplementedError
+
+    def version(self, collection: str, document_id: str) -> int:
+        """Version of a document's last write, or 0 if it does not exist."""
+        raise NotImplementedError
+
+    def set(self, collection: str, document_id: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a copy of a document, replacing any existing one; returns the stored copy."""
+        raise NotImplementedError
+
+    def update(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge fields into an existing document; returns it, or None if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, collection: str, document_id: str) -> bool:
+        """Delete a document; False if it did not exist."""
+        raise NotImplementedError
+
+    def commit(self, reads: Dict[Tuple[str, str], int],
+               writes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Apply writes atomically, provided no document in the read set has
+        changed version since it was read.
+
+        Args:
+            reads: (collection, document ID) -> version read
+            writes: (operation, collection, document ID, data) tuples, applied
+                    in order; operation is 'set', 'update' (merge, creating
+                    a missing document) or 'delete'
+
+        Returns:
+            Each write's resulting document (None for deletes)
+
+        Raises:
+            TransactionConflict: If a read document has a different version
+            ValueError: If an operation is unknown
+        """
+        raise NotImplementedError
+
+    def items(self, collection: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """(document ID, document) pairs of a collection, by ID."""
+        raise NotImplementedError
+
+    def scan(self, collection: str, start_after: Optional[str] = None,
+             limit: int = 1000) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Next page of a collection in document ID order.
+
+        Args:
+            collection: Collection path
+            start_after: Last document ID of the previous page
+            limit: Most documents returned
+
+        Returns:
+            (document ID, copy of document) pairs; fewer than limit at the end
+        """
+        raise NotImplementedError
+
+    def create_index(self, collection: str, fields: List[Any]) -> str:
+        """
+        Create (or return the existing) index over fields.
+
+        Args:
+            collection: Collection path
+            fields: Field paths or (field, direction) tuples; direction is
+                    'asc', 'desc' or 'array-contains'
+
+        Returns:
+            Index name
+
+        Raises:
+            ValueError: If fields is empty, a direction is unknown, or more
+                        than one field is 'array-contains'
+        """
+        raise NotImplementedError
+
+    def query(self, collection: str, query: Query) -> List[Tuple[str, Dict[str, Any]]]:
+        """Run a query; returns (document ID, document) pairs."""
+        raise NotImplementedError
+
+    def explain(self, collection: str, query: Query) -> Optional[str]:
+        """Name of the index a query would use, or None for a collection scan."""
+        raise NotImplementedError
+
+    def list_indexes(self, collection: Optional[str] = None) -> List[str]:
+        raise NotImplementedError
+
+    def count(self, collection: Optional[str] = None) -> int:
+        """Number of stored documents, in one collection or overall."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the backend's resources."""
+
+
+class _Max:
+    """Sorts after every index key component."""
+
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return other is not self
+
+    def __eq__(self, other):
+        return other is self
+
+    def __hash__(self):
+        return 0
+
+
+_MAX = _Max()
+
+
+class SortedKeyList:
+    """
+    Sorted list split into chunks of up to 2 * LOAD items, with each chunk's
+    maximum kept in a separate list. Inserts and removals bisect the
+    maxima and then one chunk, so they stay O(log n) plus a small memmove
+    at any size; range scans walk chunks in order.
+    """
+
+    LOAD = 512
+
+    def __init__(self):
+        self._lists: List[list] = []
+        self._maxes: list = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        return itertools.chain.from_iterable(self._lists)
+
+    def add(self, value: Any) -> None:
+        """Insert a value."""
+        maxes = self._maxes
+        if not maxes:
+            self._lists.append([value])
+            maxes.append(value)
+        else:
+            pos = bisect_left(maxes, value)
+            if pos == len(maxes):
+                pos -= 1
+                self._lists[pos].append(value)
+                maxes[pos] = value
+            else:
+                insort(self._lists[pos], value)
+            chunk = self._lists[pos]
+            if len(chunk) > 2 * self.LOAD:
+                half = chunk[self.LOAD:]
+                del chunk[self.LOAD:]
+                maxes[pos] = chunk[-1]
+                self._lists.insert(pos + 1, half)
+                maxes.insert(pos + 1, half[-1])
+        self._len += 1
+
+    def discard(self, value: Any) -> bool:
+        """Remove a value if present."""
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._lists[pos]
+        index = bisect_left(chunk, value)
+        if index == len(chunk) or chunk[index] != value:
+            return False
+        del chunk[index]
+        self._len -= 1
+        if chunk:
+            self._maxes[pos] = chunk[-1]
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+        return True
+
+    def irange(self, low: Any, high: Any, reverse: bool = False) -> Iterator:
+        """Values v with low <= v < high, in order (or reverse order)."""
+        lists = self._lists
+        if not reverse:
+            pos = bisect_left(self._maxes, low)
+            if pos == len(lists):
+                return
+            index = bisect_left(lists[pos], low)
+            while pos < len(lists):
+                chunk = lists[pos]
+                for value in itertools.islice(chunk, index, None):
+                    if not value < high:
+                        return
+                    yield value
+                pos += 1
+                index = 0
+        else:
+            pos = bisect_left(self._maxes, high)
+            if pos == len(lists):
+                if not lists:
+                    return
+                pos -= 1
+                index = len(lists[pos])
+            else:
+                index = bisect_left(lists[pos], high)
+            while pos >= 0:
+                chunk = lists[pos]
+                for position in range(index - 1, -1, -1):
+                    value = chunk[position]
+                    if value < low:
+                        return
+                    yield value
+                pos -= 1
+                index = len(lists[pos]) if pos >= 0 else 0
+
+
+class SortedIndex:
+    """
+    Sorted index over one or more fields of a collection.
+
+    Each entry is a tuple of the fields' order keys (wrapped for descending
+    fields) followed by the document ID. Documents missing an indexed field
+    are not in the index. An 'array-contains' field gets one entry per
+    distinct array element, so array membership is an equality lookup.
+    """
+
+    def __init__(self, name: str, fields: Tuple[Tuple[str, str], ...]):
+        """
+        Initialize an empty index.
+
+        Args:
+            name: Index name
+            fields: (field path, 'asc' | 'desc' | 'array-contains') pairs
+        """
+        self.name = name
+        self.fields = fields
+        self.paths = {path for path, _ in fields}
+        self.top_level = {path.split('.', 1)[0] for path in self.paths}
+        self.entries = SortedKeyList()
+
+    def keys_for(self, document_id: str, document: Dict[str, Any]) -> List[Tuple]:
+        """Index entries of a document (none if it lacks an indexed field)."""
+        components = []
+        for path, direction in self.fields:
+            value = get_field(document, path)
+            if value is MISSING:
+                return []
+            if direction == ARRAY_CONTAINS:
+                if not isinstance(value, list):
+                    return []
+                components.append(list(dict.fromkeys(order_key(item) for item in value)))
+            elif direction == 'desc':
+                components.append([Descending(order_key(value))])
+            else:
+                components.append([order_key(value)])
+        return [key + (document_id,) for key in itertools.product(*components)]
+
+    def add(self, document_id: str, document: Dict[str, Any]) -> None:
+        for key in self.keys_for(document_id, document):
+            self.entries.add(key)
+
+    def replace(self, removed: List[Tuple], added: List[Tuple]) -> None:
+        """Swap a document's old entries for its new ones."""
+        for key in removed:
+            self.entries.discard(key)
+        for key in added:
+            self.entries.add(key)
+
+
+class _Plan:
+    """How a query runs on an index: key ranges to scan and whether order comes free."""
+
+    __slots__ = ('index', 'seeks', 'prefix_length', 'ordered', 'reverse', 'exact', 'order_length', 'score')
+
+    def __init__(self, index: SortedIndex, seeks: List[Tuple[Tuple, Tuple]], prefix_length: int,
+                 ordered: bool, reverse: bool, exact: bool, order_length: int, score: Tuple):
+        self.index = index
+        self.seeks = seeks
+        self.prefix_length = prefix_length
+        self.ordered = ordered
+        self.reverse = reverse
+        self.exact = exact  # Entries come in order_by then document ID order, ties included
+        self.order_length = order_length  # order_by fields the index orders (those not pinned by '==')
+        self.score = score
+
+
+def _plan(index: SortedIndex, query: Query) -> Optional[_Plan]:
+    """Match a query against an index, or None if the index cannot serve it."""
+    by_field: Dict[str, list] = {}
+    for query_filter in query.filters:
+        by_field.setdefault(query_filter.field, []).append(query_filter)
+    # Documents missing an indexed field are not in the index, so every
+    # indexed field must be one the query already requires
+    if not index.paths <= set(by_field) | {field for field, _ in query.order_by}:
+        return None
+
+    prefixes = [()]
+    position = 0
+    for path, direction in index.fields:
+        keys = None
+        for query_filter in by_field.get(path, ()):
+            if direction == ARRAY_CONTAINS:
+                if query_filter.operator == 'array-contains':
+                    keys = [query_filter.key]
+                elif query_filter.operator == 'array-contains-any':
+                    keys = sorted(query_filter.keys)
+            elif query_filter.operator == '==':
+                keys = [query_filter.key]
+            elif query_filter.operator == 'in':
+                keys = sorted(query_filter.keys)
+            if keys is not None:
+                break
+        if keys is None:
+            break
+        if len(prefixes) * len(keys) > MAX_INDEX_SEEKS:
+            return None
+        prefixes = [prefix + (directed(key, direction),) for prefix in prefixes for key in keys]
+        position += 1
+    if any(direction == ARRAY_CONTAINS for _, direction in index.fields[position:]):
+        return None
+
+    # Optional range on the next field
+    low = high = None
+    low_inclusive = high_inclusive = True
+    has_range = False
+    if position < len(index.fields):
+        path, direction = index.fields[position]
+        for query_filter in by_field.get(path, ()):
+            if query_filter.operator not in RANGE_OPERATORS:
+                continue
+            has_range = True
+            if query_filter.operator in ('>', '>='):
+                if low is None or query_filter.key > low[0] or (
+                        query_filter.key == low[0] and query_filter.operator == '>'):
+                    low = (query_filter.key,)
+                    low_inclusive = query_filter.operator == '>='
+            elif high is None or query_filter.key < high[0] or (
+                    query_filter.key == high[0] and query_filter.operator == '<'):
+                high = (query_filter.key,)
+                high_inclusive = query_filter.operator == '<='
+        if has_range:
+            # Range filters only match their own type
+            below, above = type_bounds((low or high)[0])
+            if low is None:
+                low, low_inclusive = (below,), True
+            if high is None:
+                high, high_inclusive = (above,), False
+
+    # Ordering: order_by fields pinned by a single '==' are constant
+    pinned = {f.field for f in query.filters if f.operator == '=='}
+    wanted = [(field, direction) for field, direction in query.order_by if field not in pinned]
+    remaining = index.fields[position:]
+    ordered, reverse = True, False
+    if wanted:
+        if len(wanted) > len(remaining) or any(
+                field != path for (field, _), (path, _) in zip(wanted, remaining)):
+            ordered = False
+        else:
+            same = [want == have for (_, want), (_, have) in zip(wanted, remaining)]
+            ordered = all(same) or not any(same)
+            reverse = not same[0]
+
+    if position == 0 and not has_range and not (wanted and ordered):
+        return None
+
+    if has_range:
+        if index.fields[position][1] == 'desc':
+            # A descending field stores the range upside down
+            low, high = (Descending(high[0]),), (Descending(low[0]),)
+            low_inclusive, high_inclusive = high_inclusive, low_inclusive
+        start = low if low_inclusive else low + (_MAX,)
+        stop = high + (_MAX,) if high_inclusive else high
+    else:
+        start, stop = (), (_MAX,)
+    seeks = [(prefix + start, prefix + stop) for prefix in prefixes]
+    exact = ordered and not reverse and len(remaining) == len(wanted)
+    score = (position + has_range, bool(wanted) and ordered, -len(index.fields))
+    return _Plan(index, seeks, position, ordered, reverse, exact, len(wanted), score)
+
+
+def _in_position_order(rows: Iterator[Tuple[str, Dict[str, Any]]],
+                       query: Query) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Rows already sorted by the order_by fields, with each run of ties
+    reordered by document ID (the index breaks them by its remaining
+    fields, or by ID descending when walked in reverse).
+    """
+    group, group_key = [], None
+    for document_id, document in rows:
+        key = query.position(document_id, document)[:-1]
+        if group and key != group_key:
+            group.sort(key=lambda row: row[0])
+            yield from group
+            group = []
+        group.append((document_id, document))
+        group_key = key
+    group.sort(key=lambda row: row[0])
+    yield from group
+
+
+class Collection:
+    """Documents of one collection and the indexes over them."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.versions: Dict[str, int] = {}  # Version of each stored document's last write
+        self.ids = SortedKeyList()  # Document IDs in order, for paging through the collection
+        self.indexes: Dict[str, SortedIndex] = {}
+
+    def put(self, document_id: str, document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Insert or replace a document, updating every index; returns the
+        replaced document, or None. Index entries are computed before
+        anything changes, so a document that cannot be indexed is rejected
+        with the collection untouched.
+        """
+        previous = self.documents.get(document_id)
+        changes = [(index, index.keys_for(document_id, previous) if previous is not None else [],
+                    index.keys_for(document_id, document)) for index in self.indexes.values()]
+        if previous is None:
+            self.ids.add(document_id)
+        self.documents[document_id] = document
+        for index, removed, added in changes:
+            index.replace(removed, added)
+        return previous
+
+    def merge(self, document_id: str, data: Dict[str, Any],
+              timestamp: Callable[[], str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Apply field-path update data to a stored document (see apply_update);
+        only the written top-level fields are replaced and only indexes over
+        them are updated.
+
+        Returns:
+            (document, previous values of the written top-level fields, MISSING
+            where absent), the latter for replace_fields to revert the update
+        """
+        document = self.documents[document_id]
+        previous = {field: document.get(field, MISSING) for field in touched_fields(data)}
+        values = apply_update({field: value for field, value in previous.items() if value is not MISSING},
+                              data, timestamp)
+        self.replace_fields(document_id, {field: values.get(field, MISSING) for field in previous})
+        return document, previous
+
+    def replace_fields(self, document_id: str, values: Dict[str, Any]) -> None:
+        """
+        Set top-level fields of a stored document (MISSING removes one) and
+        re-index it in the indexes over them; as in put, the new index
+        entries are computed before the document changes.
+        """
+        document = self.documents[document_id]
+        changes = []
+        for index in self.indexes.values():
+            if index.top_level.isdisjoint(values):
+                continue
+            updated = {}
+            for field in index.top_level:
+                value = values[field] if field in values else document.get(field, MISSING)
+                if value is not MISSING:
+                    updated[field] = value
+            changes.append((index, index.keys_for(document_id, document), index.keys_for(document_id, updated)))
+        for field, value in values.items():
+            if value is MISSING:
+                document.pop(field, None)
+            else:
+                document[field] = value
+        for index, removed, added in changes:
+            index.replace(removed, added)
+
+    def remove(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Delete a document from the collection and its indexes; returns it, or None if absent."""
+        document = self.documents.pop(document_id, None)
+        if document is None:
+            return None
+        del self.versions[document_id]
+        self.ids.discard(document_id)
+        for index in self.indexes.values():
+            index.replace(index.keys_for(document_id, document), [])
+        return document
+
+    def plan(self, query: Query) -> Optional[_Plan]:
+        """Best index plan for a query, or None to scan."""
+        best = None
+        for index in self.indexes.values():
+            candidate = _plan(index, query)
+            if candidate is not None and (best is None or candidate.score > best.score):
+                best = candidate
+        return best
+
+    def run(self, query: Query) -> List[Tuple[str, Dict[str, Any]]]:
+        """Execute a query, returning (document ID, document) pairs in the query's order."""
+        return list(itertools.islice(self.walk(query), query.limit))
+
+    def walk(self, query: Query) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Matching (document ID, document) pairs in the query's full order
+        (order_by, then document ID), after start_after and before end_before.
+
+        An index plan that yields order_by order seeks straight to
+        start_after, and a query without order_by or a usable index walks
+        the collection by ID; both stream, so reading k results costs
+        O(log n + k) however deep the cursor. Other plans collect and sort
+        every match first. Consume while holding the store lock.
+        """
+        plan = self.plan(query)
+        if plan is not None and plan.ordered:
+            rows = self._index_rows(plan, query, self._cursor_seeks(plan, query))
+            if not plan.exact:
+                rows = _in_position_order(rows, query)
+        elif plan is None and not query.order_by:
+            start = query.start_key[0] if query.start_key else ''
+            rows = ((document_id, self.documents[document_id]) for document_id in self.ids.irange(start, _MAX))
+            rows = (row for row in rows if query.matches(row[1]))
+        elif plan is None:
+            rows = query.sort([(document_id, document) for document_id, document in self.documents.items()
+                               if query.matches(document)])
+        else:
+            rows = query.sort(list(self._index_rows(plan, query, plan.seeks)))
+
+        if not query.has_cursors:
+            yield from rows
+            return
+        for document_id, document in rows:
+            position = query.position(document_id, document)
+            if not query.before_end(position):
+                return
+            if query.after_start(position):
+                yield document_id, document
+
+    def _cursor_seeks(self, plan: _Plan, query: Query) -> List[Tuple[Tuple, Tuple]]:
+        """An ordered plan's seeks narrowed to start at query.start_after."""
+        fields = (query.start_key or ())[:len(query.order_by)]
+        # An order_by field pinned by '==' is not in the index suffix
+        if not fields or plan.order_length != len(query.order_by):
+            return plan.seeks
+        if plan.exact and len(query.start_key) > len(query.order_by):
+            fields = query.start_key  # Entries end in the document ID: seek past the ties too
+        seeks = []
+        for start, stop in plan.seeks:
+            prefix = start[:plan.prefix_length]
+            if plan.reverse:
+                # The index stores the order_by fields in the opposite direction
+                flipped = tuple(key.key if isinstance(key, Descending) else Descending(key) for key in fields)
+                seeks.append((start, min(stop, prefix + flipped + (_MAX,))))
+            else:
+                seeks.append((max(start, prefix + fields), stop))
+        return seeks
+
+    def _index_rows(self, plan: _Plan, query: Query,
+                    seeks: List[Tuple[Tuple, Tuple]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Matching (document ID, document) pairs from an index, in the plan's order."""
+        ranges = [plan.index.entries.irange(start, stop, reverse=plan.reverse) for start, stop in seeks]
+        if len(ranges) == 1:
+            entries = ranges[0]
+        elif plan.ordered:
+            suffix = plan.prefix_length
+            entries = heapq.merge(*ranges, key=lambda entry: entry[suffix:], reverse=plan.reverse)
+        else:
+            entries = itertools.chain(*ranges)
+        deduplicate = len(ranges) > 1 or any(d == ARRAY_CONTAINS for _, d in plan.index.fields)
+
+        seen = set()
+        for entry in entries:
+            document_id = entry[-1]
+            if deduplicate:
+                if document_id in seen:
+                    continue
+                seen.add(document_id)
+            document = self.documents[document_id]
+            if query.matches(document):
+                yield document_id, document
+
+
+class DocumentStore(StorageBackend):
+    """
+    In-memory document database organized per collection.
+
+    Queries use the collection's best matching index: equality and 'in'
+    filters on leading index fields become key-range seeks, a range filter
+    on the next field narrows the seek, and when the remaining index
+    fields match order_by the scan stops after `limit` matches, giving
+    O(log n + k). Queries no index serves scan the collection.
+
+    Every write gives the document a new version from a store-wide
+    counter; absent documents have version 0. Writers lock the document's
+    stripe (one of STRIPES locks chosen by hashing its path) before the
+    store lock, so commit() can validate a read set and apply writes
+    atomically while transactions on other documents proceed. Commits are
+    all-or-nothing: a write that fails (a document that cannot be indexed)
+    reverts the writes before it.
+
+    When on_change is set it is called for every write of a successful
+    commit, with the lock still held, as on_change(collection, document_id,
+    document, existed); document is None for a delete.
+    """
+
+    STRIPES = 64
+
+    def __init__(self, on_change: Optional[Callable[[str, str, Optional[Dict[str, Any]], bool], Any]] = None):
+        self.collections: Dict[str, Collection] = {}
+        self.on_change = on_change
+        self._versions = itertools.count(1)
+        self._stripes = [threading.Lock() for _ in range(self.STRIPES)]
+        self._lock = threading.RLock()
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Lock held by every write; hold it to read and act on a consistent state."""
+        return self._lock
+
+    def get(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """Stored document, or None."""
+        entry = self.collections.get(collection)
+        return entry.documents.get(document_id) if entry is not None else None
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """Stored documents for (collection, document ID) keys, in key order (None if absent)."""
+        collections = self.collections
+        results = []
+        for collection, document_id in keys:
+            entry = collections.get(collection)
+            results.append(entry.documents.get(document_id) if entry is not None else None)
+        return results
+
+    def read(self, collection: str, document_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Copy of a document (None if absent) and the version it was read at."""
+        with self._stripes[self._stripe(collection, document_id)]:
+            entry = self.collections.get(collection)
+            document = entry.documents.get(document_id) if entry is not None else None
+            if document is None:
+                return None, 0
+            return copy_value(document), entry.versions[document_id]
+
+    def version(self, collection: str, document_id: str) -> int:
+        """Version of a document's last write, or 0 if it does not exist."""
+        entry = self.collections.get(collection)
+        return entry.versions.get(document_id, 0) if entry is not None else 0
+
+    def set(self, collection: str, document_id: str, document: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a copy of a document, replacing any existing one; returns the stored copy."""
+        with self._stripes[self._stripe(collection, document_id)], self._lock:
+            return self._apply([('set', collection, document_id, document)], commit_clock())[0]
+
+    def update(self, collection: str, document_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge fields into an existing document; returns it, or None if it does not exist."""
+        with self._stripes[self._stripe(collection, document_id)], self._lock:
+            if self.version(collection, document_id) == 0:
+                return None
+            return self._apply([('update', collection, document_id, data)], commit_clock())[0]
+
+    def delete(self, collection: str, document_id: str) -> bool:
+        """Delete a document; False if it did not exist."""
+        with self._stripes[self._stripe(collection, document_id)], self._lock:
+            if self.version(collection, document_id) == 0:
+                return False
+            self._apply([('delete', collection, document_id, None)], commit_clock())
+            return True
+
+    def commit(self, reads: Dict[Tuple[str, str], int],
+               writes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Apply writes atomically, provided no document in the read set has
+        changed version since it was read.
+
+        Args:
+            reads: (collection, document ID) -> version read
+            writes: (operation, collection, document ID, data) tuples, applied
+                    in order; operation is 'set', 'update' (merge, creating
+                    a missing document) or 'delete'
+
+        Returns:
+            Each write's resulting document (None for deletes)
+
+        Raises:
+            TransactionConflict: If a read document has a different version
+            ValueError: If an operation is unknown
+        """
+        for operation, _, _, _ in writes:
+            if operation not in WRITE_OPERATIONS:
+                raise ValueError(f"Unsupported write operation '{operation}'")
+        paths = itertools.chain(reads, ((collection, document_id) for _, collection, document_id, _ in writes))
+        # Lock stripes in index order so overlapping commits cannot deadlock
+        stripes = [self._stripes[i] for i in sorted({self._stripe(*path) for path in paths})]
+        for stripe in stripes:
+            stripe.acquire()
+        try:
+            for (collection, document_id), version in reads.items():
+                if self.version(collection, document_id) != version:
+                    raise TransactionConflict(f"Document '{collection}/{document_id}' changed "
+                                              f"after it was read")
+            timestamp = commit_clock()
+            with self._lock:
+                return self._apply(writes, timestamp)
+        finally:
+            for stripe in reversed(stripes):
+                stripe.release()
+
+    def items(self, collection: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """(document ID, document) pairs of a collection, by ID."""
+        with self._lock:
+            entry = self.collections.get(collection)
+            if entry is None:
+                return []
+            return [(document_id, entry.documents[document_id]) for document_id in entry.ids]
+
+    def scan(self, collection: str, start_after: Optional[str] = None,
+             limit: int = 1000) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Next page of a collection in document ID order.
+
+        Args:
+            collection: Collection path
+            start_after: Last document ID of the previous page
+            limit: Most documents returned
+
+        Returns:
+            (document ID, copy of document) pairs; fewer than limit at the end
+        """
+        with self._lock:
+            entry = self.collections.get(collection)
+            if entry is None:
+                return []
+            page = []
+            for document_id in entry.ids.irange(start_after or '', _MAX):
+                if document_id == start_after:
+                    continue
+                page.append((document_id, copy_value(entry.documents[document_id])))
+                if len(page) >= limit:
+                    break
+            return page
+
+    def create_index(self, collection: str, fields: List[Any]) -> str:
+        """
+        Create (or return the existing) sorted index over fields.
+
+        Args:
+            collection: Collection path
+            fields: Field paths or (field, direction) tuples; direction is
+                    'asc', 'desc' or 'array-contains'
+
+        Returns:
+            Index name
+
+        Raises:
+            ValueError: If fields is empty, a direction is unknown, or more
+                        than one field is 'array-contains'
+        """
+        name, normalized = index_definition(collection, fields)
+        with self._lock:
+            entry = self._collection(collection)
+            if name not in entry.indexes:
+                index = SortedIndex(name, normalized)
+                for document_id, document in entry.documents.items():
+                    index.add(document_id, document)
+                entry.indexes[name] = index
+        return name
+
+    def query(self, collection: str, query: Query) -> List[Tuple[str, Dict[str, Any]]]:
+        """Run a query; returns (document ID, document) pairs."""
+        with self._lock:
+            entry = self.collections.get(collection)
+            return entry.run(query) if entry is not None else []
+
+    def explain(self, collection: str, query: Query) -> Optional[str]:
+        """Name of the index a query would use, or None for a collection scan."""
+        with self._lock:
+            entry = self.collections.get(collection)
+            plan = entry.plan(query) if entry is not None else None
+            return plan.index.name if plan is not None else None
+
+    def list_indexes(self, collection: Optional[str] = None) -> List[str]:
+        with self._lock:
+            return [name for entry_name, entry in self.collections.items()
+                    if collection is None or entry_name == collection
+                    for name in entry.indexes]
+
+    def count(self, collection: Optional[str] = None) -> int:
+        """Number of stored documents, in one collection or overall."""
+        if collection is not None:
+            entry = self.collections.get(collection)
+            return len(entry.documents) if entry is not None else 0
+        return sum(len(entry.documents) for entry in self.collections.values())
+
+    def _stripe(self, collection: str, document_id: str) -> int:
+        return hash((collection, document_id)) % self.STRIPES
+
+    def _apply(self, writes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]],
+               timestamp: Callable[[], str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Apply writes all-or-nothing, then report them to on_change; the
+        caller holds their stripes and the store lock.
+        """
+        changes = []
+        undo = []
+        try:
+            results = [self._write(operation, collection, document_id, data, timestamp, changes, undo)
+                       for operation, collection, document_id, data in writes]
+        except BaseException:
+            self._revert(undo)
+            raise
+        if self.on_change is not None:
+            for change in changes:
+                self.on_change(*change)
+        return results
+
+    def _write(self, operation: str, collection: str, document_id: str, data: Optional[Dict[str, Any]],
+               timestamp: Callable[[], str], changes: List[Tuple], undo: List[Tuple]) -> Optional[Dict[str, Any]]:
+        """
+        Apply one write, queueing its change notification and recording in
+        undo how to revert it. A write that raises has changed nothing.
+        """
+        entry = self._collection(collection)
+        version = entry.versions.get(document_id)
+        if operation == 'delete':
+            previous = entry.remove(document_id)
+            if previous is None:
+                return None
+            undo.append((entry, document_id, version, previous, None))
+            changes.append((collection, document_id, None, True))
+            return None
+
+        if operation == 'update' and version is not None:
+            document, fields = entry.merge(document_id, data, timestamp)
+            undo.append((entry, document_id, version, None, fields))
+        else:
+            document = resolve(data, timestamp) if operation == 'set' else apply_update({}, data, timestamp)
+            undo.append((entry, document_id, version, entry.put(document_id, document), None))
+        entry.versions[document_id] = next(self._versions)
+        changes.append((collection, document_id, document, version is not None))
+        return document
+
+    @staticmethod
+    def _revert(undo: List[Tuple]) -> None:
+        """Revert applied writes, newest first."""
+        for entry, document_id, version, previous, fields in reversed(undo):
+            if fields is not None:
+                entry.replace_fields(document_id, fields)
+            elif previous is not None:
+                entry.put(document_id, previous)
+            else:
+                entry.remove(document_id)
+            if version is None:
+                entry.versions.pop(document_id, None)
+            else:
+                entry.versions[document_id] = version
+
+    def _collection(self, name: str) -> Collection:
+        entry = self.collections.get(name)
+        if entry is None:
+            entry = self.collections[name] = Collection(name)
+        return entry
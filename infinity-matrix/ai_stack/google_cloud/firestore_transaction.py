@@ -0,0 +1,84 @@
+"""
+Firestore Transaction - Optimistic read-write transactions for the Firestore agent
+Records the version of every document read and buffers writes until a validated commit
+"""
+from typing import Dict, List, Any, Optional, Tuple
+
+from .firestore_store import DocumentStore, TransactionConflict
+
+
+def stamp(operation: str, data: Optional[Dict[str, Any]], timestamp: str) -> Optional[Dict[str, Any]]:
+    """Copy of a write's data with the agent's metadata fields set to the commit time."""
+    if operation == 'set':
+        return dict(data, _created_at=timestamp, _updated_at=timestamp)
+    if operation == 'update':
+        return dict(data, _updated_at=timestamp)
+    return data
+
+
+class Transaction:
+    """
+    One attempt of a read-write transaction.
+
+    Reads go straight to the store and remember the version they saw;
+    writes are buffered. commit() applies the writes only if every
+    document read is still at that version, so a transaction never acts on
+    data another writer changed underneath it. As in Firestore, all reads
+    must come before the first write.
+    """
+
+    def __init__(self, store: DocumentStore):
+        self.store = store
+        self.reads: Dict[Tuple[str, str], int] = {}
+        self.writes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]] = []
+        self.committed = False
+
+    def get(self, collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Read a document and add it to the read set.
+
+        Returns:
+            A copy of the document, or None if it does not exist
+
+        Raises:
+            ValueError: If the transaction has already written
+            TransactionConflict: If the document changed since an earlier read
+        """
+        if self.writes:
+            raise ValueError("Transaction reads must come before its writes")
+        document, version = self.store.read(collection, document_id)
+        if self.reads.setdefault((collection, document_id), version) != version:
+            raise TransactionConflict(f"Document '{collection}/{document_id}' changed during the transaction")
+        return document
+
+    def set(self, collection: str, document_id: str, data: Dict[str, Any]) -> None:
+        """Buffer a write replacing the document."""
+        self.writes.append(('set', collection, document_id, dict(data)))
+
+    def update(self, collection: str, document_id: str, data: Dict[str, Any]) -> None:
+        """Buffer a merge into the document (created if missing)."""
+        self.writes.append(('update', collection, document_id, dict(data)))
+
+    def delete(self, collection: str, document_id: str) -> None:
+        """Buffer a delete of the document."""
+        self.writes.append(('delete', collection, document_id, None))
+
+    def commit(self, timestamp: str) -> List[Tuple[str, str, Optional[Dict[str, Any]]]]:
+        """
+        Validate the read set and apply the buffered writes atomically.
+
+        Args:
+            timestamp: Commit time stamped on every written document
+
+        Returns:
+            (collection, document ID, stored document or None) per write
+
+        Raises:
+            TransactionConflict: If a document read has since changed
+        """
+        writes = [(operation, collection, document_id, stamp(operation, data, timestamp))
+                  for operation, collection, document_id, data in self.writes]
+        documents = self.store.commit(self.reads, writes)
+        self.committed = True
+        return [(collection, document_id, document)
+                for (_, collection, document_id, _), document in zip(writes, documents)]
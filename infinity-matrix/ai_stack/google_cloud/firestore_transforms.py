@@ -0,0 +1,216 @@
+"""
+Firestore Transforms - Field paths, field masks and server-side transforms for the Firestore agent
+Applies increment, arrayUnion, arrayRemove, serverTimestamp and field deletes to the fields an update writes
+"""
+from datetime import datetime
+from typing import Dict, List, Any, Callable, Iterable, Set
+
+from .firestore_query import order_key
+
+
+class Transform:
+    """A value in update data that is computed from the stored field when the write applies."""
+
+    __slots__ = ()
+
+    def apply(self, current: Any, timestamp: Callable[[], str]) -> Any:
+        """
+        New field value given the current one (a private sentinel if the
+        field is absent); the current value is not changed.
+        """
+        raise NotImplementedError
+
+
+class Increment(Transform):
+    """Add to a numeric field; a missing or non-numeric field becomes the amount."""
+
+    __slots__ = ('amount',)
+
+    def __init__(self, amount: Any = 1):
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+            raise ValueError("Increment needs a number")
+        self.amount = amount
+
+    def apply(self, current: Any, timestamp: Callable[[], str]) -> Any:
+        if isinstance(current, bool) or not isinstance(current, (int, float)):
+            return self.amount
+        return current + self.amount
+
+    def __repr__(self) -> str:
+        return f"Increment({self.amount!r})"
+
+
+class ArrayUnion(Transform):
+    """Append the values an array field does not already contain."""
+
+    __slots__ = ('values',)
+
+    def __init__(self, values: Iterable[Any]):
+        self.values = list(values)
+
+    def apply(self, current: Any, timestamp: Callable[[], str]) -> Any:
+        array = list(current) if isinstance(current, list) else []
+        present = {order_key(item) for item in array}
+        for value in self.values:
+            key = order_key(value)
+            if key not in present:
+                present.add(key)
+                array.append(copy_value(value))
+        return array
+
+    def __repr__(self) -> str:
+        return f"ArrayUnion({self.values!r})"
+
+
+class ArrayRemove(Transform):
+    """Remove every element equal to one of the values; a non-array field becomes []."""
+
+    __slots__ = ('values',)
+
+    def __init__(self, values: Iterable[Any]):
+        self.values = list(values)
+
+    def apply(self, current: Any, timestamp: Callable[[], str]) -> Any:
+        if not isinstance(current, list):
+            return []
+        removed = {order_key(value) for value in self.values}
+        return [item for item in current if order_key(item) not in removed]
+
+    def __repr__(self) -> str:
+        return f"ArrayRemove({self.values!r})"
+
+
+class _ServerTimestamp(Transform):
+    __slots__ = ()
+
+    def apply(self, current: Any, timestamp: Callable[[], str]) -> Any:
+        return timestamp()
+
+    def __repr__(self) -> str:
+        return 'SERVER_TIMESTAMP'
+
+
+class _DeleteField(Transform):
+    __slots__ = ()
+
+    def apply(self, current: Any, timestamp: Callable[[], str]) -> Any:
+        return DELETE_FIELD
+
+    def __repr__(self) -> str:
+        return 'DELETE_FIELD'
+
+
+# Set the field to the commit time
+SERVER_TIMESTAMP = _ServerTimestamp()
+# Remove the field
+DELETE_FIELD = _DeleteField()
+
+_ABSENT = object()
+
+
+def commit_clock() -> Callable[[], str]:
+    """Timestamp source for one commit: utcnow() in ISO format, taken on first use and then reused."""
+    taken = []
+
+    def timestamp() -> str:
+        if not taken:
+            taken.append(datetime.utcnow().isoformat())
+        return taken[0]
+    return timestamp
+
+
+def touched_fields(data: Dict[str, Any]) -> Set[str]:
+    """Top-level fields an update with dotted field paths writes to."""
+    return {path.split('.', 1)[0] for path in data}
+
+
+def apply_update(document: Dict[str, Any], data: Dict[str, Any],
+                 timestamp: Callable[[], str]) -> Dict[str, Any]:
+    """
+    Apply update data to a document and return it.
+
+    Keys are field paths ('stats.count'); missing or non-map intermediate
+    fields become maps. Values that are Transforms are computed from the
+    current field value. Only the written fields are visited. The document
+    itself is changed, but maps and arrays inside it are not: maps along a
+    written path are copied (once per update) and transforms build new
+    arrays, so nested values the caller still holds keep their old state.
+    """
+    copied = {id(document)}  # Maps created by this update, safe to change
+    for path, value in data.items():
+        parent = document
+        parts = path.split('.')
+        for part in parts[:-1]:
+            child = parent.get(part)
+            if not isinstance(child, dict):
+                if value is DELETE_FIELD:
+                    parent = None
+                    break
+                child = {}
+            elif id(child) not in copied:
+                child = dict(child)
+            if id(child) not in copied:
+                parent[part] = child
+                copied.add(id(child))
+            parent = child
+        if parent is None:
+            continue
+        field = parts[-1]
+        if isinstance(value, Transform):
+            value = value.apply(parent.get(field, _ABSENT), timestamp)
+        else:
+            value = copy_value(value)  # Stored maps and arrays must not be the caller's
+        if value is DELETE_FIELD:
+            parent.pop(field, None)
+        else:
+            parent[field] = value
+    return document
+
+
+def resolve(data: Dict[str, Any], timestamp: Callable[[], str]) -> Dict[str, Any]:
+    """
+    Copy of document data for a full write (maps and arrays included),
+    with Transforms replaced by their result on an absent field.
+    """
+    document = {}
+    for field, value in data.items():
+        if isinstance(value, dict):
+            value = resolve(value, timestamp)
+        elif isinstance(value, list):
+            value = copy_value(value)
+        elif isinstance(value, Transform):
+            value = value.apply(_ABSENT, timestamp)
+            if value is DELETE_FIELD:
+                continue
+        document[field] = value
+    return document
+
+
+def copy_value(value: Any) -> Any:
+    """Deep copy of a JSON-like value (maps and arrays are copied, everything else shared)."""
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def project(document: Dict[str, Any], field_mask: List[str]) -> Dict[str, Any]:
+    """
+    The fields of a document named by a field mask, keeping their nesting
+    ({'stats': {'count': 4}} for 'stats.count'); absent fields are left out.
+    """
+    projection = {}
+    for path in field_mask:
+        value = document
+        parts = path.split('.')
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projection
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = copy_value(value)
+    return projection
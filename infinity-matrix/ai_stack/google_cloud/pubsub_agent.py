@@ -2,11 +2,33 @@
 Pub/Sub Agent - Enterprise-grade Google Cloud Pub/Sub integration
 Handles asynchronous messaging, event streaming, and queue management
 """
-import json
-from typing import Dict, List, Any, Callable, Optional
-from datetime import datetime
+import asyncio
+import bisect
+import heapq
+import itertools
+import os
+import time
+import threading
+from typing import Dict, List, Any, Callable, Optional, Set, Tuple
+from array import array
+from datetime import datetime, timezone
 from enum import Enum
 from collections import deque
+from concurrent.futures import Future
+from functools import partial
+
+from .pubsub_dispatch import SubscriberDispatcher
+from .pubsub_filter import FilterIndex, compile_filter
+from .pubsub_message import PubSubMessage
+from .pubsub_metrics import RATE_WINDOWS, PrometheusWriter, RateWindow, SubscriptionMetrics
+from .pubsub_storage import SegmentLog
+
+
+FLOW_CONTROL_POLICIES = ('block', 'raise', 'drop_oldest')
+
+
+class FlowControlError(Exception):
+    """Raised when a publish does not fit within a flow-control limit."""
 
 
 class MessageType(Enum):
@@ -19,59 +41,461 @@ class MessageType(Enum):
     CUSTOM = "custom"
 
 
+class TopicLog:
+    """
+    Append-only message log for a single topic.
+    Each message is stored once and addressed by a monotonically increasing
+    offset; subscriptions keep their own read cursor into the log.
+    """
+
+    def __init__(self):
+        """Initialize an empty log."""
+        self._messages = []
+        self._bytes_before = array('Q')  # Bytes appended before each entry of _messages
+        self._timestamps = array('Q')  # Non-decreasing publish time (ns) of each entry
+        self._head = 0  # Index of the first retained message in _messages
+        self.start_offset = 0  # Offset of the oldest retained message
+        self.end_offset = 0  # Offset the next appended message will get
+        self.total_bytes = 0  # Bytes ever appended
+
+    def __len__(self) -> int:
+        return self.end_offset - self.start_offset
+
+    def append(self, message: PubSubMessage) -> int:
+        """Append a message and return its offset."""
+        return self.append_batch([message])
+
+    def append_batch(self, messages: List[PubSubMessage], timestamp_ns: Optional[int] = None) -> int:
+        """
+        Append messages and return the offset of the first. Each is indexed
+        at its publish_time_ns (timestamp_ns is accepted for parity with
+        SegmentLog.append_batch; the messages already carry it).
+        """
+        offset = self.end_offset
+        total = self.total_bytes
+        bytes_before = self._bytes_before
+        timestamps = self._timestamps
+        last_timestamp = timestamps[-1] if timestamps else 0
+        for message in messages:
+            bytes_before.append(total)
+            total += len(message)
+            # Concurrent publishers stamp before taking the lock; clamp so
+            # the index stays sorted
+            last_timestamp = max(last_timestamp, message.publish_time_ns)
+            timestamps.append(last_timestamp)
+        self.total_bytes = total
+        self._messages.extend(messages)
+        self.end_offset += len(messages)
+        return offset
+
+    def read(self, offset: int, max_messages: int) -> List[PubSubMessage]:
+        """Return up to max_messages messages starting at offset."""
+        offset = max(offset, self.start_offset)
+        start = self._head + (offset - self.start_offset)
+        return self._messages[start:start + max_messages]
+
+    def bytes_since(self, offset: int) -> int:
+        """Payload bytes of the retained messages from offset on."""
+        offset = max(offset, self.start_offset)
+        if offset >= self.end_offset:
+            return 0
+        return self.total_bytes - self._bytes_before[self._head + offset - self.start_offset]
+
+    def offset_for_time(self, timestamp_ns: int) -> int:
+        """First retained offset published at or after timestamp_ns (end_offset if none)."""
+        index = bisect.bisect_left(self._timestamps, timestamp_ns, self._head)
+        return self.start_offset + index - self._head
+
+    def trim(self, offset: int) -> int:
+        """
+        Discard every message below offset.
+        
+        Returns:
+            Number of messages discarded
+        """
+        offset = min(offset, self.end_offset)
+        if offset <= self.start_offset:
+            return 0
+        discarded = offset - self.start_offset
+        self._head += discarded
+        self.start_offset = offset
+        # Compact once the dead prefix dominates so trimming stays amortized O(1)
+        if self._head >= 1024 and self._head * 2 >= len(self._messages):
+            del self._messages[:self._head]
+            del self._bytes_before[:self._head]
+            del self._timestamps[:self._head]
+            self._head = 0
+        return discarded
+
+
+class LeaseTable:
+    """
+    Outstanding (delivered but unacknowledged) messages of one subscription.
+    Leases are ordered by ack deadline in a heap so expiry checks only look
+    at the earliest deadline; acked or extended leases leave stale heap
+    entries that are skipped lazily.
+    """
+
+    def __init__(self):
+        """Initialize an empty lease table."""
+        # Integer message ID -> (deadline, message, delivery_attempt, offset, delivered_at)
+        self.leases = {}
+        self.ready = deque()  # (message, delivery_attempt, offset) awaiting redelivery
+        self._deadlines = []  # Heap of (deadline, message_id)
+
+    def __len__(self) -> int:
+        return len(self.leases)
+
+    def lease(self, message: PubSubMessage, delivery_attempt: int, offset: int,
+              deadline: float, delivered_at: float = 0.0) -> None:
+        """Record a delivered message that must be acked before deadline."""
+        message_id = message.id
+        self.leases[message_id] = (deadline, message, delivery_attempt, offset, delivered_at)
+        heapq.heappush(self._deadlines, (deadline, message_id))
+        if len(self._deadlines) > 2 * len(self.leases) + 64:
+            self._compact()
+
+    def release(self, message_id: int) -> Optional[Tuple[float, PubSubMessage, int, int, float]]:
+        """Remove a lease, returning it if it was outstanding."""
+        return self.leases.pop(message_id, None)
+
+    def extend(self, message_id: int, deadline: float) -> bool:
+        """Move the deadline of an outstanding lease."""
+        lease = self.leases.get(message_id)
+        if lease is None:
+            return False
+        self.lease(lease[1], lease[2], lease[3], deadline, lease[4])
+        return True
+
+    def expire(self, now: float) -> List[Tuple[PubSubMessage, int, int]]:
+        """Pop every lease whose deadline has passed."""
+        expired = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, message_id = heapq.heappop(self._deadlines)
+            lease = self.leases.get(message_id)
+            if lease is not None and lease[0] == deadline:
+                del self.leases[message_id]
+                expired.append((lease[1], lease[2], lease[3]))
+        return expired
+
+    def floor(self) -> Optional[int]:
+        """Lowest log offset still outstanding or awaiting redelivery."""
+        offsets = [lease[3] for lease in self.leases.values()]
+        offsets.extend(entry[2] for entry in self.ready)
+        return min(offsets) if offsets else None
+
+    def _compact(self) -> None:
+        """Rebuild the deadline heap without stale entries."""
+        self._deadlines = [(lease[0], message_id) for message_id, lease in self.leases.items()]
+        heapq.heapify(self._deadlines)
+
+
+class DedupWindow:
+    """
+    Idempotency keys seen on a topic within a sliding time window.
+    Keys live in a hash map for O(1) lookups; a ring of (expiry, key) in
+    insertion order lets expired keys be dropped from the front. The ring
+    never holds more than max_keys entries, so memory stays bounded.
+    """
+
+    def __init__(self, window_seconds: float, max_keys: int):
+        """
+        Initialize an empty window.
+        
+        Args:
+            window_seconds: How long a key suppresses duplicates
+            max_keys: Most keys remembered; the oldest are evicted first
+        """
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._message_ids = {}  # Idempotency key -> message ID of the first publish
+        self._ring = deque()  # (expires_at, key), oldest first
+
+    def __len__(self) -> int:
+        return len(self._message_ids)
+
+    def get(self, key: str, now: float) -> Optional[str]:
+        """Message ID recorded for a key within the window, or None."""
+        ring = self._ring
+        while ring and (ring[0][0] <= now or len(ring) >= self.max_keys):
+            self._message_ids.pop(ring.popleft()[1], None)
+        return self._message_ids.get(key)
+
+    def check(self, key: str, message_id: str, now: float) -> Optional[str]:
+        """
+        Record a key unless it was seen within the window.
+        
+        Returns:
+            Message ID of the earlier publish if the key is a duplicate, else None
+        """
+        existing = self.get(key, now)
+        if existing is not None:
+            return existing
+        self._message_ids[key] = message_id
+        self._ring.append((now + self.window_seconds, key))
+        return None
+
+
+class PublishBatcher:
+    """
+    Collects asynchronous publishes per topic and commits each batch in one
+    call once it reaches max_batch_size messages or its oldest message has
+    waited batch_timeout_ms. A background thread handles the timeouts.
+    """
+
+    def __init__(self, commit: Callable[[str, List[Tuple[Any, ...]]], List[Any]],
+                 max_batch_size: int = 100, batch_timeout_ms: int = 1000,
+                 max_pending: int = 10000):
+        """
+        Initialize the batcher.
+        
+        Args:
+            commit: Called with (topic, [(message, attributes, ordering_key,
+                    idempotency_key), ...]); returns a message ID or exception per item
+            max_batch_size: Messages per batch
+            batch_timeout_ms: Maximum time a message waits for its batch to fill
+            max_pending: Messages queued or committing before add() blocks
+        """
+        self._commit = commit
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout_ms / 1000.0
+        self.max_pending = max_pending
+        self._queued = 0  # Messages added but not yet committed
+        self._batches = {}  # Topic -> (deadline, [(message, attributes, ordering_key, idempotency_key, future)])
+        self._full = deque()  # (topic, batch) ready to commit
+        self._in_flight = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add(self, topic_name: str, message: Any, attributes: Optional[Dict[str, str]],
+            ordering_key: Optional[str] = None, idempotency_key: Optional[str] = None) -> Future:
+        """
+        Queue a message and return a future for its message ID. Blocks while
+        max_pending messages are already waiting, so a publisher that outruns
+        the commits (e.g. ones held up by flow control) is slowed down.
+        """
+        future = Future()
+        with self._cond:
+            while self._queued >= self.max_pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Publisher has been shut down")
+            self._queued += 1
+            pending = self._batches.get(topic_name)
+            if pending is None:
+                pending = self._batches[topic_name] = (time.monotonic() + self.batch_timeout, [])
+                self._cond.notify()
+            pending[1].append((message, attributes, ordering_key, idempotency_key, future))
+            if len(pending[1]) >= self.max_batch_size:
+                del self._batches[topic_name]
+                self._full.append((topic_name, pending[1]))
+                self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pubsub-batcher', daemon=True)
+                self._thread.start()
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Commit every pending batch now and wait for in-flight ones."""
+        with self._cond:
+            ready = list(self._full) + [(t, b) for t, (_, b) in self._batches.items()]
+            self._full.clear()
+            self._batches.clear()
+            self._in_flight += len(ready)
+        for topic_name, batch in ready:
+            self._commit_batch(topic_name, batch)
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def pending(self) -> int:
+        """Number of messages waiting to be committed."""
+        with self._cond:
+            return (sum(len(b) for _, b in self._batches.values())
+                    + sum(len(b) for _, b in self._full))
+
+    def close(self) -> None:
+        """Flush and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.flush()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        """Commit batches as they fill up or time out."""
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    for topic_name, (deadline, batch) in list(self._batches.items()):
+                        if deadline <= now:
+                            del self._batches[topic_name]
+                            self._full.append((topic_name, batch))
+                    if self._full:
+                        topic_name, batch = self._full.popleft()
+                        self._in_flight += 1
+                        break
+                    if self._closed:
+                        return
+                    deadlines = [deadline for deadline, _ in self._batches.values()]
+                    self._cond.wait(min(deadlines) - now if deadlines else None)
+            self._commit_batch(topic_name, batch)
+
+    def _commit_batch(self, topic_name: str, batch: List[Tuple[Any, ...]]) -> None:
+        """Commit one batch and resolve its futures."""
+        try:
+            results = self._commit(topic_name, [item[:-1] for item in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for item, result in zip(batch, results):
+            future = item[-1]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        with self._cond:
+            self._in_flight -= 1
+            self._queued -= len(batch)
+            self._cond.notify_all()
+
+
 class PubSubAgent:
     """
     Enterprise Pub/Sub agent for asynchronous messaging and event streaming.
     Supports multiple topics, subscriptions, batching, and dead-letter handling.
     """
     
-    def __init__(self):
-        """Initialize Pub/Sub agent with message queues and subscribers."""
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Initialize Pub/Sub agent with message queues and subscribers.
+        
+        Args:
+            config: Optional overrides for the default configuration
+        """
         self.topics = {}
         self.subscriptions = {}
-        self.message_queues = {}  # Topic -> deque of messages
+        self.topic_logs = {}  # Topic -> TopicLog shared by all its subscriptions
+        self.topic_subscriptions = {}  # Topic -> list of subscription names
+        self.topic_routes = {}  # Topic -> FilterIndex of its subscriptions' filters
+        self.topic_dedup = {}  # Topic -> DedupWindow of recent idempotency keys
         self.subscribers = {}  # Subscription -> list of callbacks
+        self.snapshots = {}  # Snapshot -> acknowledgement state captured from a subscription
         self.dead_letter_queue = deque(maxlen=1000)
         self.stats = {
             'messages_published': 0,
             'messages_received': 0,
-            'messages_failed': 0
+            'messages_failed': 0,
+            'messages_deduplicated': 0,
+            'messages_dropped': 0,
+            'messages_rejected': 0,
+            'publishes_blocked': 0
         }
         self.config = {
             'max_batch_size': 100,
             'batch_timeout_ms': 1000,
             'max_message_size': 10 * 1024 * 1024,  # 10MB
-            'retention_days': 7
+            'retention_days': 7,
+            # Default flow control of in-memory topics; durable topics are
+            # bounded by retention unless given limits in create_topic
+            'max_topic_backlog': 10000,
+            'max_topic_backlog_bytes': None,
+            'flow_control_policy': 'drop_oldest',  # 'block', 'raise' or 'drop_oldest'
+            'flow_control_timeout_seconds': 60,  # How long 'block' waits before raising
+            'max_pending_publishes': 10000,  # publish_async queue depth before it blocks
+            'max_delivery_attempts': 5,
+            'dispatch_backend': 'thread',  # 'thread' or 'asyncio'
+            'dispatch_workers': 8,
+            'subscriber_inbox_size': 1000,
+            'storage_mode': 'memory',  # 'memory' or 'disk'
+            'storage_dir': '.pubsub',
+            'segment_bytes': 64 * 1024 * 1024,
+            'fsync_policy': 'interval',  # 'always', 'interval' or 'never'
+            'fsync_interval_ms': 1000,
+            'checkpoint_interval_ms': 1000,
+            'dedup_window_seconds': 600,
+            'dedup_max_keys': 100000  # Per topic
         }
+        self.config.update(config or {})
+        self._lock = threading.RLock()
+        self._next_checkpoint = {}  # Topic -> monotonic time of next cursor checkpoint
+        self._published = threading.Condition(self._lock)
+        self._capacity = threading.Condition(self._lock)  # Notified when backlog is freed
+        self.publish_sequence = 0  # Bumped on every committed publish
+        # Microseconds at startup, so IDs keep increasing across restarts
+        self._message_ids = itertools.count(time.time_ns() // 1000)
+        self.batcher = PublishBatcher(
+            self._commit_messages,
+            max_batch_size=self.config['max_batch_size'],
+            batch_timeout_ms=self.config['batch_timeout_ms'],
+            max_pending=self.config['max_pending_publishes']
+        )
+        self.dispatcher = SubscriberDispatcher(
+            backend=self.config['dispatch_backend'],
+            max_workers=self.config['dispatch_workers'],
+            inbox_size=self.config['subscriber_inbox_size'],
+            on_error=self._record_callback_error,
+            on_delivered=self._record_push_timings
+        )
 
     def create_topic(self, topic_name: str, labels: Optional[Dict[str, str]] = None,
-                    message_retention_duration: int = 604800) -> str:
+                    message_retention_duration: int = 604800,
+                    flow_control: Optional[Dict[str, Any]] = None) -> str:
         """
-        Create a new Pub/Sub topic.
+        Create a new Pub/Sub topic. Creating an existing topic is a no-op so
+        that its log and subscription cursors survive. With storage_mode
+        'disk' the topic reopens (and recovers) its segment log on restart.
         
         Args:
             topic_name: Name of the topic (e.g., 'system-events')
             labels: Optional labels for organization
             message_retention_duration: Message retention in seconds (default 7 days)
+            flow_control: Optional limits on the retained backlog, e.g.
+                          {'max_messages': 5000, 'max_bytes': 10485760, 'policy': 'block'}
+                          (in-memory topics default to the max_topic_backlog* config)
             
         Returns:
             Topic name/ID
+            
+        Raises:
+            ValueError: If the flow-control settings are invalid
         """
-        topic_config = {
-            'name': topic_name,
-            'labels': labels or {},
-            'created_at': datetime.utcnow().isoformat(),
-            'message_retention_duration': message_retention_duration,
-            'message_count': 0
-        }
-        
-        self.topics[topic_name] = topic_config
-        self.message_queues[topic_name] = deque(maxlen=10000)
+        if flow_control is None and self.config['storage_mode'] == 'memory':
+            flow_control = {
+                'max_messages': self.config['max_topic_backlog'],
+                'max_bytes': self.config['max_topic_backlog_bytes']
+            }
+        flow_control = self._flow_control_settings(flow_control)
         
-        return topic_name
+        with self._lock:
+            if topic_name in self.topics:
+                return topic_name
+                
+            topic_config = {
+                'name': topic_name,
+                'labels': labels or {},
+                'created_at': datetime.utcnow().isoformat(),
+                'message_retention_duration': message_retention_duration,
+                'flow_control': flow_control,
+                'message_count': 0,
+                'messages_dropped': 0,
+                'publish_rate': RateWindow()
+            }
+            
+            self.topics[topic_name] = topic_config
+            self.topic_logs[topic_name] = self._open_topic_log(topic_name, message_retention_duration)
+            self.topic_subscriptions[topic_name] = []
+            self.topic_routes[topic_name] = FilterIndex()
+            self.topic_dedup[topic_name] = DedupWindow(self.config['dedup_window_seconds'],
+                                                       self.config['dedup_max_keys'])
+            
+            return topic_name
 
     def publish_message(self, topic_name: str, message: Dict[str, Any], 
-                       attributes: Optional[Dict[str, str]] = None) -> str:
+                       attributes: Optional[Dict[str, str]] = None,
+                       ordering_key: Optional[str] = None,
+                       idempotency_key: Optional[str] = None) -> str:
         """
         Publish a message to a topic.
         
@@ -79,109 +503,169 @@ class PubSubAgent:
             topic_name: Topic name
             message: Message data (will be JSON-encoded)
             attributes: Optional message attributes for filtering
+            ordering_key: Optional key; push subscribers receive messages with
+                          the same key one at a time, in publish order
+            idempotency_key: Optional key; republishing it on the same topic
+                             within config['dedup_window_seconds'] is dropped
             
+        Returns:
+            Message ID (for a dropped duplicate, the ID of the original)
+            
+        Raises:
+            FlowControlError: If a 'raise' limit is full, or a 'block' limit
+                              stays full for flow_control_timeout_seconds
+        """
+        result = self._commit_messages(
+            topic_name, [(message, attributes, ordering_key, idempotency_key)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def publish_message_async(self, topic_name: str, message: Dict[str, Any],
+                                    attributes: Optional[Dict[str, str]] = None,
+                                    ordering_key: Optional[str] = None,
+                                    idempotency_key: Optional[str] = None) -> str:
+        """
+        Awaitable publish_message: waits for flow-control capacity without
+        blocking the event loop.
+        
         Returns:
             Message ID
         """
-        if topic_name not in self.topics:
-            raise ValueError(f"Topic '{topic_name}' does not exist")
-            
-        if isinstance(message, dict):
-            message_data = json.dumps(message)
-        else:
-            message_data = str(message)
-            
-        # Check message size
-        if len(message_data) > self.config['max_message_size']:
-            self.stats['messages_failed'] += 1
-            self.dead_letter_queue.append({
-                'topic': topic_name,
-                'error': 'Message exceeds max size',
-                'timestamp': datetime.utcnow().isoformat()
-            })
-            raise ValueError("Message size exceeds limit")
-
-        # Create message envelope
-        message_envelope = {
-            'message_id': self._generate_message_id(),
-            'data': message_data,
-            'attributes': attributes or {},
-            'publish_time': datetime.utcnow().isoformat(),
-            'topic': topic_name
-        }
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(
+            self.publish_message, topic_name, message, attributes, ordering_key, idempotency_key))
+
+    def publish_async(self, topic_name: str, message: Dict[str, Any],
+                      attributes: Optional[Dict[str, str]] = None,
+                      ordering_key: Optional[str] = None,
+                      idempotency_key: Optional[str] = None) -> Future:
+        """
+        Queue a message on the background batcher.
         
-        # Add to topic queue
-        self.message_queues[topic_name].append(message_envelope)
-        self.topics[topic_name]['message_count'] += 1
-        self.stats['messages_published'] += 1
+        Messages are committed together once max_batch_size messages are
+        waiting for the topic or the oldest has waited batch_timeout_ms.
         
-        # Trigger callbacks for all subscriptions to this topic
-        self._trigger_subscribers(topic_name, message_envelope)
+        Args:
+            topic_name: Topic name
+            message: Message data (will be JSON-encoded)
+            attributes: Optional message attributes for filtering
+            ordering_key: Optional ordering key (see publish_message)
+            idempotency_key: Optional deduplication key (see publish_message)
+            
+        Returns:
+            Future resolving to the message ID
+        """
+        if topic_name not in self.topics:
+            raise ValueError(f"Topic '{topic_name}' does not exist")
+        return self.batcher.add(topic_name, message, attributes, ordering_key, idempotency_key)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Commit every message queued by publish_async now.
         
-        return message_envelope['message_id']
+        Args:
+            timeout: Maximum seconds to wait for in-flight batches
+            
+        Returns:
+            True if nothing is left pending
+        """
+        return self.batcher.flush(timeout)
 
-    def publish_batch(self, topic_name: str, messages: List[Dict[str, Any]]) -> List[str]:
+    def publish_batch(self, topic_name: str, messages: List[Dict[str, Any]],
+                      attributes: Optional[List[Optional[Dict[str, str]]]] = None,
+                      ordering_keys: Optional[List[Optional[str]]] = None,
+                      idempotency_keys: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
         """
         Publish multiple messages in a batch.
         
         Args:
             topic_name: Topic name
             messages: List of message data
+            attributes: Optional per-message attributes, parallel to messages
+            ordering_keys: Optional per-message ordering keys, parallel to messages
+            idempotency_keys: Optional per-message deduplication keys, parallel to messages
             
         Returns:
-            List of message IDs
+            Message ID per message, parallel to messages; None for a message
+            that was rejected (over max_message_size, and dead-lettered)
         """
         if len(messages) > self.config['max_batch_size']:
             raise ValueError(f"Batch size exceeds limit of {self.config['max_batch_size']}")
             
-        message_ids = []
-        for message in messages:
-            try:
-                msg_id = self.publish_message(topic_name, message)
-                message_ids.append(msg_id)
-            except Exception as e:
-                self.stats['messages_failed'] += 1
-                self.dead_letter_queue.append({
-                    'error': str(e),
-                    'timestamp': datetime.utcnow().isoformat()
-                })
-                
-        return message_ids
+        attributes = attributes or [None] * len(messages)
+        ordering_keys = ordering_keys or [None] * len(messages)
+        idempotency_keys = idempotency_keys or [None] * len(messages)
+        results = self._commit_messages(
+            topic_name, list(zip(messages, attributes, ordering_keys, idempotency_keys)))
+        return [None if isinstance(result, Exception) else result for result in results]
 
     def create_subscription(self, subscription_name: str, topic_name: str,
                           ack_deadline_seconds: int = 60,
-                          filter_expression: Optional[str] = None) -> str:
+                          filter_expression: Optional[str] = None,
+                          max_delivery_attempts: Optional[int] = None,
+                          flow_control: Optional[Dict[str, Any]] = None,
+                          retain_acked_messages: bool = False) -> str:
         """
-        Create a subscription to a topic.
+        Create a subscription to a topic. The subscription receives messages
+        published after it was created.
         
         Args:
             subscription_name: Subscription name
             topic_name: Topic to subscribe to
             ack_deadline_seconds: Time to acknowledge messages
-            filter_expression: Optional CEL expression to filter messages
+            filter_expression: Optional attribute filter, e.g.
+                               'attributes.type = "alert" AND hasPrefix(attributes.region, "us")'
+            max_delivery_attempts: Deliveries before a message is dead-lettered
+                                   (defaults to config['max_delivery_attempts'])
+            flow_control: Optional limits on messages published but not yet
+                          pulled, e.g. {'max_messages': 1000, 'policy': 'block'}
+            retain_acked_messages: Keep delivered messages for the topic's
+                                   retention duration so seek() can replay them
             
         Returns:
             Subscription name/ID
-        """
-        if topic_name not in self.topics:
-            raise ValueError(f"Topic '{topic_name}' does not exist")
             
-        subscription = {
-            'name': subscription_name,
-            'topic': topic_name,
-            'created_at': datetime.utcnow().isoformat(),
-            'ack_deadline_seconds': ack_deadline_seconds,
-            'filter_expression': filter_expression,
-            'message_count': 0,
-            'callbacks': []
-        }
-        
-        self.subscriptions[subscription_name] = subscription
-        self.subscribers[subscription_name] = []
+        Raises:
+            ValueError: If the topic does not exist, or the filter or
+                        flow-control settings are invalid
+        """
+        # Parse once; invalid filters fail here rather than on delivery
+        compiled_filter = compile_filter(filter_expression) if filter_expression else None
+        flow_control = self._flow_control_settings(flow_control)
         
-        return subscription_name
+        with self._lock:
+            if topic_name not in self.topics:
+                raise ValueError(f"Topic '{topic_name}' does not exist")
+                
+            subscription = {
+                'name': subscription_name,
+                'topic': topic_name,
+                'created_at': datetime.utcnow().isoformat(),
+                'ack_deadline_seconds': ack_deadline_seconds,
+                'filter_expression': filter_expression,
+                'filter': compiled_filter,
+                'max_delivery_attempts': max_delivery_attempts or self.config['max_delivery_attempts'],
+                'flow_control': flow_control,
+                'retain_acked_messages': retain_acked_messages,
+                'message_count': 0,
+                'messages_dropped': 0,
+                'cursor': self._initial_cursor(topic_name, subscription_name),
+                'leases': LeaseTable(),
+                'metrics': SubscriptionMetrics(),
+                'callbacks': []
+            }
+            
+            if subscription_name in self.subscriptions:
+                self.delete_subscription(subscription_name)
+            self.subscriptions[subscription_name] = subscription
+            self.subscribers[subscription_name] = []
+            self.topic_subscriptions[topic_name].append(subscription_name)
+            self.topic_routes[topic_name].add(subscription_name, compiled_filter)
+            
+            return subscription_name
 
-    def subscribe(self, subscription_name: str, callback: Callable[[Dict[str, Any]], None]) -> str:
+    def subscribe(self, subscription_name: str, callback: Callable[[PubSubMessage], None]) -> str:
         """
         Subscribe to a subscription with a callback.
         
@@ -192,26 +676,30 @@ class PubSubAgent:
         Returns:
             Subscriber ID
         """
-        if subscription_name not in self.subscriptions:
-            raise ValueError(f"Subscription '{subscription_name}' does not exist")
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                raise ValueError(f"Subscription '{subscription_name}' does not exist")
+                
+            subscriber_id = f"sub_{len(self.subscribers[subscription_name])}"
             
-        subscriber_id = f"sub_{len(self.subscribers[subscription_name])}"
-        
-        self.subscriptions[subscription_name]['callbacks'].append({
-            'id': subscriber_id,
-            'callback': callback,
-            'created_at': datetime.utcnow().isoformat()
-        })
-        
-        self.subscribers[subscription_name].append(callback)
-        
-        return subscriber_id
+            self.subscriptions[subscription_name]['callbacks'].append({
+                'id': subscriber_id,
+                'callback': callback,
+                'created_at': datetime.utcnow().isoformat()
+            })
+            
+            self.subscribers[subscription_name].append(callback)
+            
+            return subscriber_id
 
     def pull_messages(self, subscription_name: str, max_messages: int = 10,
-                     auto_ack: bool = False) -> List[Dict[str, Any]]:
+                     auto_ack: bool = False) -> List[PubSubMessage]:
         """
         Pull messages from a subscription.
         
+        Messages whose ack deadline expired or that were nacked are redelivered
+        first; each delivered message is leased until acknowledged.
+        
         Args:
             subscription_name: Subscription name
             max_messages: Maximum messages to pull
@@ -220,31 +708,59 @@ class PubSubAgent:
         Returns:
             List of messages
         """
-        if subscription_name not in self.subscriptions:
-            raise ValueError(f"Subscription '{subscription_name}' does not exist")
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                raise ValueError(f"Subscription '{subscription_name}' does not exist")
+                
+            subscription = self.subscriptions[subscription_name]
+            topic_name = subscription['topic']
+            topic_log = self.topic_logs[topic_name]
+            leases = subscription['leases']
+            now = time.monotonic()
+            now_ns = time.time_ns()
             
-        subscription = self.subscriptions[subscription_name]
-        topic_name = subscription['topic']
-        
-        # Get messages from topic queue
-        messages = []
-        topic_queue = self.message_queues[topic_name]
-        
-        while len(messages) < max_messages and topic_queue:
-            message = topic_queue.popleft()
+            for message, delivery_attempt, offset in leases.expire(now):
+                self._requeue(subscription, message, delivery_attempt, offset)
+                
+            messages = []
+            while len(messages) < max_messages and leases.ready:
+                message, delivery_attempt, offset = leases.ready.popleft()
+                messages.append(message)
+                self._deliver(subscription, message, delivery_attempt + 1, offset, now, auto_ack)
+                
+            # Read forward from this subscription's cursor; the log is not consumed
+            start_cursor = max(subscription['cursor'], topic_log.start_offset)
+            cursor = start_cursor
             
-            # Apply filter if exists
-            if subscription['filter_expression']:
-                if not self._matches_filter(message, subscription['filter_expression']):
-                    continue
+            while len(messages) < max_messages and cursor < topic_log.end_offset:
+                for message in topic_log.read(cursor, max_messages - len(messages)):
+                    cursor += 1
                     
-            messages.append(message)
+                    # Apply filter if exists
+                    if subscription['filter'] and not subscription['filter'](message.attributes):
+                        continue
+                            
+                    messages.append(message)
+                    self._deliver(subscription, message, 1, cursor - 1, now, auto_ack)
+                        
+            subscription['cursor'] = cursor
+            if cursor != start_cursor:
+                self._capacity.notify_all()
+                
+            if messages:
+                metrics = subscription['metrics']
+                metrics.publish_to_deliver.record_many([now_ns - m.publish_time_ns for m in messages])
+                metrics.delivered.add(len(messages), now)
+                if auto_ack:
+                    metrics.acked.add(len(messages), now)
             
-            if auto_ack:
-                subscription['message_count'] += 1
-                self.stats['messages_received'] += 1
+            # Only the slowest cursor holds back retention (unless messages are
+            # retained by time); durable logs also use pulls to checkpoint cursors
+            if (start_cursor == topic_log.start_offset or isinstance(topic_log, SegmentLog)
+                    or subscription['retain_acked_messages']):
+                self._trim_topic_log(topic_name)
                 
-        return messages
+            return messages
 
     def acknowledge_messages(self, subscription_name: str, message_ids: List[str]) -> bool:
         """
@@ -257,11 +773,23 @@ class PubSubAgent:
         Returns:
             Success status
         """
-        if subscription_name in self.subscriptions:
-            self.subscriptions[subscription_name]['message_count'] += len(message_ids)
-            self.stats['messages_received'] += len(message_ids)
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                return False
+                
+            subscription = self.subscriptions[subscription_name]
+            now = time.monotonic()
+            waited = []  # Nanoseconds from delivery to ack
+            for message_id in self._message_keys(message_ids):
+                lease = subscription['leases'].release(message_id)
+                if lease is not None:
+                    waited.append(int((now - lease[4]) * 1_000_000_000))
+            if waited:
+                subscription['message_count'] += len(waited)
+                self.stats['messages_received'] += len(waited)
+                subscription['metrics'].deliver_to_ack.record_many(waited)
+                subscription['metrics'].acked.add(len(waited), now)
             return True
-        return False
 
     def nack_messages(self, subscription_name: str, message_ids: List[str]) -> bool:
         """
@@ -274,32 +802,256 @@ class PubSubAgent:
         Returns:
             Success status
         """
-        # Messages would be requeued here
-        return True
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                return False
+                
+            subscription = self.subscriptions[subscription_name]
+            for message_id in self._message_keys(message_ids):
+                lease = subscription['leases'].release(message_id)
+                if lease is not None:
+                    self._requeue(subscription, lease[1], lease[2], lease[3])
+            return True
 
-    def delete_topic(self, topic_name: str) -> bool:
-        """Delete a topic and all its subscriptions."""
-        if topic_name in self.topics:
-            # Delete all subscriptions for this topic
-            subs_to_delete = [s for s, sub in self.subscriptions.items() 
-                            if sub['topic'] == topic_name]
-            for sub in subs_to_delete:
-                del self.subscriptions[sub]
-                del self.subscribers[sub]
+    def modify_ack_deadline(self, subscription_name: str, message_ids: List[str],
+                            ack_deadline_seconds: int) -> bool:
+        """
+        Extend (or shorten) the ack deadline of outstanding messages.
+        A deadline of 0 makes the messages immediately available for redelivery.
+        
+        Args:
+            subscription_name: Subscription name
+            message_ids: List of message IDs to modify
+            ack_deadline_seconds: New deadline, counted from now
+            
+        Returns:
+            Success status
+        """
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                return False
+                
+            if ack_deadline_seconds <= 0:
+                return self.nack_messages(subscription_name, message_ids)
+                
+            deadline = time.monotonic() + ack_deadline_seconds
+            leases = self.subscriptions[subscription_name]['leases']
+            for message_id in self._message_keys(message_ids):
+                leases.extend(message_id, deadline)
+            return True
+
+    def resume_ordering_key(self, subscription_name: str, ordering_key: str,
+                            skip_failed: bool = False) -> bool:
+        """
+        Resume push delivery of an ordering key paused by a failed callback.
+        
+        The failed message (already recorded in the dead-letter queue) is
+        retried first unless skip_failed is set; messages published for the
+        key while it was paused follow in order.
+        
+        Args:
+            subscription_name: Subscription name
+            ordering_key: Paused ordering key
+            skip_failed: Drop the failed message instead of retrying it
+            
+        Returns:
+            False if the key was not paused
+        """
+        return self.dispatcher.resume((subscription_name, ordering_key), skip_failed)
+
+    def is_outstanding(self, subscription_name: str, message_id: str) -> bool:
+        """Check whether a pulled message is still leased (not acked, nacked or expired)."""
+        subscription = self.subscriptions.get(subscription_name)
+        keys = self._message_keys([message_id])
+        return subscription is not None and bool(keys) and keys[0] in subscription['leases'].leases
+
+    def create_snapshot(self, snapshot_name: str, subscription_name: str) -> str:
+        """
+        Capture a subscription's acknowledgement state: its unacknowledged
+        messages and everything published after. The snapshot holds the
+        unacknowledged messages themselves (they may already be trimmed from
+        the topic log, which keeps only what a subscription has yet to read)
+        and keeps later messages from being trimmed until it is deleted.
+        
+        Args:
+            snapshot_name: Snapshot name (an existing snapshot is replaced)
+            subscription_name: Subscription to capture
+            
+        Returns:
+            Snapshot name/ID
+        """
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                raise ValueError(f"Subscription '{subscription_name}' does not exist")
                 
-            del self.topics[topic_name]
-            if topic_name in self.message_queues:
-                del self.message_queues[topic_name]
+            subscription = self.subscriptions[subscription_name]
+            leases = subscription['leases']
+            # (offset, message) of every leased or redelivery-pending message, by offset
+            unacked = {lease[3]: lease[1] for lease in leases.leases.values()}
+            unacked.update((entry[2], entry[0]) for entry in leases.ready)
+            cursor = max(subscription['cursor'], self.topic_logs[subscription['topic']].start_offset)
+            self.snapshots[snapshot_name] = {
+                'name': snapshot_name,
+                'topic': subscription['topic'],
+                'subscription': subscription_name,
+                'created_at': datetime.utcnow().isoformat(),
+                'offset': cursor,
+                'cursor': cursor,
+                'unacked': sorted(unacked.items())
+            }
+            return snapshot_name
+
+    def delete_snapshot(self, snapshot_name: str) -> bool:
+        """Delete a snapshot, releasing the messages it retained."""
+        with self._lock:
+            snapshot = self.snapshots.pop(snapshot_name, None)
+            if snapshot is None:
+                return False
+            self._trim_topic_log(snapshot['topic'], force=True)
+            self._capacity.notify_all()
             return True
-        return False
+
+    def list_snapshots(self, topic_name: Optional[str] = None) -> List[str]:
+        """List snapshots, optionally filtered by topic."""
+        return [name for name, snapshot in self.snapshots.items()
+                if topic_name is None or snapshot['topic'] == topic_name]
+
+    def seek(self, subscription_name: str, timestamp: Any = None,
+             snapshot: Optional[str] = None) -> int:
+        """
+        Move a subscription to a point in time or to a snapshot.
+        
+        Seeking to a timestamp treats messages published before it as
+        acknowledged and redelivers every retained message published at or
+        after it; the start position is found by binary search over the
+        topic log's publish times. Seeking to a snapshot restores the
+        acknowledgement state it captured. Outstanding leases are dropped.
+        Push subscribers get the messages re-dispatched in the background.
+        
+        Only retained messages can be replayed: subscriptions created with
+        retain_acked_messages keep them for the topic's retention duration.
+        
+        Args:
+            subscription_name: Subscription name
+            timestamp: datetime (naive values are UTC) or epoch seconds
+            snapshot: Snapshot name, instead of timestamp
+            
+        Returns:
+            Number of messages that will be delivered again
+            
+        Raises:
+            ValueError: If the subscription or snapshot does not exist, the
+                        snapshot belongs to another topic, or not exactly one
+                        of timestamp and snapshot is given
+        """
+        if (timestamp is None) == (snapshot is None):
+            raise ValueError("Specify exactly one of timestamp or snapshot")
+            
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                raise ValueError(f"Subscription '{subscription_name}' does not exist")
+                
+            subscription = self.subscriptions[subscription_name]
+            topic_log = self.topic_logs[subscription['topic']]
+            leases = subscription['leases'] = LeaseTable()
+            
+            if snapshot is not None:
+                captured = self.snapshots.get(snapshot)
+                if captured is None:
+                    raise ValueError(f"Snapshot '{snapshot}' does not exist")
+                if captured['topic'] != subscription['topic']:
+                    raise ValueError(f"Snapshot '{snapshot}' is not of topic '{subscription['topic']}'")
+                cursor = max(captured['cursor'], topic_log.start_offset)
+                for offset, message in captured['unacked']:
+                    leases.ready.append((message, 0, offset))
+            else:
+                cursor = topic_log.offset_for_time(self._time_ns(timestamp))
+                
+            subscription['cursor'] = cursor
+            end = topic_log.end_offset
+            self._trim_topic_log(subscription['topic'], force=True)
+            self._capacity.notify_all()
+            
+            if self.subscribers[subscription_name]:
+                redeliver = [entry[0] for entry in leases.ready]
+                threading.Thread(target=self._replay_push, name='pubsub-replay', daemon=True,
+                                 args=(subscription_name, redeliver, cursor, end)).start()
+            return len(leases.ready) + end - cursor
+
+    def delete_topic(self, topic_name: str) -> bool:
+        """Delete a topic and all its subscriptions."""
+        with self._lock:
+            if topic_name in self.topics:
+                # Delete all subscriptions for this topic
+                for sub in self.topic_subscriptions.pop(topic_name, []):
+                    del self.subscriptions[sub]
+                    del self.subscribers[sub]
+                    
+                del self.topics[topic_name]
+                topic_log = self.topic_logs.pop(topic_name, None)
+                if isinstance(topic_log, SegmentLog):
+                    topic_log.delete()
+                self.topic_routes.pop(topic_name, None)
+                self.topic_dedup.pop(topic_name, None)
+                for snapshot_name in [n for n, s in self.snapshots.items() if s['topic'] == topic_name]:
+                    del self.snapshots[snapshot_name]
+                self._capacity.notify_all()
+                return True
+            return False
 
     def delete_subscription(self, subscription_name: str) -> bool:
         """Delete a subscription."""
-        if subscription_name in self.subscriptions:
-            del self.subscriptions[subscription_name]
-            del self.subscribers[subscription_name]
-            return True
-        return False
+        with self._lock:
+            if subscription_name in self.subscriptions:
+                topic_name = self.subscriptions.pop(subscription_name)['topic']
+                del self.subscribers[subscription_name]
+                self.topic_subscriptions[topic_name].remove(subscription_name)
+                self.topic_routes[topic_name].remove(subscription_name)
+                topic_log = self.topic_logs[topic_name]
+                if isinstance(topic_log, SegmentLog):
+                    topic_log.cursors.pop(subscription_name, None)
+                self._trim_topic_log(topic_name, force=True)
+                self._capacity.notify_all()
+                return True
+            return False
+
+    def wait_for_subscribers(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued push delivery has run.
+        
+        Args:
+            timeout: Maximum seconds to wait (None waits forever)
+            
+        Returns:
+            True if all deliveries completed
+        """
+        return self.dispatcher.wait_idle(timeout)
+
+    def wait_for_publish(self, since_sequence: int, timeout: Optional[float] = None) -> int:
+        """
+        Block until something is published after publish_sequence was since_sequence.
+        Lets pull-based consumers wait for new messages instead of polling.
+        
+        Args:
+            since_sequence: publish_sequence observed before the last empty pull
+            timeout: Maximum seconds to wait (None waits forever)
+            
+        Returns:
+            Current publish_sequence
+        """
+        with self._published:
+            self._published.wait_for(lambda: self.publish_sequence != since_sequence, timeout)
+            return self.publish_sequence
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Flush pending publishes, stop background work and close durable logs."""
+        self.batcher.close()
+        self.dispatcher.shutdown(wait=wait)
+        with self._lock:
+            for topic_name, topic_log in self.topic_logs.items():
+                if isinstance(topic_log, SegmentLog):
+                    self._trim_topic_log(topic_name, force=True)
+                    topic_log.close()
 
     def list_topics(self) -> List[str]:
         """List all topics."""
@@ -308,64 +1060,581 @@ class PubSubAgent:
     def list_subscriptions(self, topic_name: Optional[str] = None) -> List[str]:
         """List subscriptions, optionally filtered by topic."""
         if topic_name:
-            return [name for name, sub in self.subscriptions.items() 
-                   if sub['topic'] == topic_name]
+            return list(self.topic_subscriptions.get(topic_name, []))
         return list(self.subscriptions.keys())
 
     def get_topic_stats(self, topic_name: str) -> Dict[str, Any]:
         """Get statistics for a topic."""
         if topic_name not in self.topics:
             return {}
+        publish_rate = self.topics[topic_name]['publish_rate']
         return {
             'name': topic_name,
             'message_count': self.topics[topic_name]['message_count'],
-            'queue_size': len(self.message_queues[topic_name]),
-            'subscriptions': [s for s, sub in self.subscriptions.items() 
-                            if sub['topic'] == topic_name]
+            'queue_size': len(self.topic_logs[topic_name]),
+            'queue_bytes': self.topic_logs[topic_name].bytes_since(0),
+            'messages_dropped': self.topics[topic_name]['messages_dropped'],
+            'publish_rate_per_second': {f"{window}s": publish_rate.rate(window)
+                                        for window in RATE_WINDOWS},
+            'subscriptions': list(self.topic_subscriptions[topic_name])
         }
 
     def get_subscription_stats(self, subscription_name: str) -> Dict[str, Any]:
-        """Get statistics for a subscription."""
-        if subscription_name not in self.subscriptions:
-            return {}
-        return {
-            'name': subscription_name,
-            'topic': self.subscriptions[subscription_name]['topic'],
-            'message_count': self.subscriptions[subscription_name]['message_count'],
-            'callbacks': len(self.subscriptions[subscription_name]['callbacks'])
-        }
+        """
+        Get statistics for a subscription, including latency summaries in
+        seconds: publish_to_deliver, deliver_to_ack (pull) and callback (push).
+        """
+        with self._lock:
+            if subscription_name not in self.subscriptions:
+                return {}
+            metrics = self.subscriptions[subscription_name]['metrics']
+            oldest_ns = self._oldest_unacked_ns(subscription_name, self.dispatcher.lane_heads())
+            return {
+                'name': subscription_name,
+                'topic': self.subscriptions[subscription_name]['topic'],
+                'message_count': self.subscriptions[subscription_name]['message_count'],
+                'backlog': self._subscription_backlog(subscription_name),
+                'messages_dropped': self.subscriptions[subscription_name]['messages_dropped'],
+                'outstanding': len(self.subscriptions[subscription_name]['leases']),
+                'pending_redelivery': len(self.subscriptions[subscription_name]['leases'].ready),
+                'paused_ordering_keys': [key[1] for key in self.dispatcher.paused_lanes()
+                                         if isinstance(key, tuple) and key[0] == subscription_name],
+                'callbacks': len(self.subscriptions[subscription_name]['callbacks']),
+                'oldest_unacked_age_seconds': (time.time_ns() - oldest_ns) / 1e9 if oldest_ns else 0.0,
+                'ack_rate_per_second': {f"{window}s": metrics.acked.rate(window)
+                                        for window in RATE_WINDOWS},
+                'latency': {
+                    'publish_to_deliver': metrics.publish_to_deliver.summary(),
+                    'deliver_to_ack': metrics.deliver_to_ack.summary(),
+                    'callback': metrics.callback.summary()
+                }
+            }
 
     def get_global_stats(self) -> Dict[str, Any]:
         """Get global Pub/Sub statistics."""
         return {
             'topics': len(self.topics),
             'subscriptions': len(self.subscriptions),
+            'snapshots': len(self.snapshots),
             'messages_published': self.stats['messages_published'],
             'messages_received': self.stats['messages_received'],
             'messages_failed': self.stats['messages_failed'],
-            'dead_letter_queue_size': len(self.dead_letter_queue)
+            'messages_deduplicated': self.stats['messages_deduplicated'],
+            'messages_dropped': self.stats['messages_dropped'],
+            'messages_rejected': self.stats['messages_rejected'],
+            'publishes_blocked': self.stats['publishes_blocked'],
+            'dead_letter_queue_size': len(self.dead_letter_queue),
+            'pending_deliveries': self.dispatcher.pending(),
+            'paused_deliveries': self.dispatcher.paused(),
+            'callback_failures': self.dispatcher.stats['failed']
         }
 
-    def _trigger_subscribers(self, topic_name: str, message: Dict[str, Any]) -> None:
-        """Trigger all subscribers for a topic."""
-        for sub_name, sub_config in self.subscriptions.items():
-            if sub_config['topic'] == topic_name:
-                for callback_config in sub_config['callbacks']:
-                    try:
-                        callback_config['callback'](message)
-                    except Exception as e:
-                        self.dead_letter_queue.append({
-                            'error': str(e),
-                            'message': message,
-                            'timestamp': datetime.utcnow().isoformat()
-                        })
-
-    def _matches_filter(self, message: Dict[str, Any], filter_expr: str) -> bool:
-        """Check if message matches filter expression."""
-        # Simplified filter matching
-        return True
+    def export_prometheus(self) -> str:
+        """
+        Render agent counters, queue-depth gauges, per-topic and per-subscription
+        rates and latency summaries in the Prometheus text exposition format.
+        
+        Returns:
+            Exposition text, e.g. for a /metrics endpoint
+        """
+        writer = PrometheusWriter(prefix='pubsub_')
+        with self._lock:
+            for stat, value in self.stats.items():
+                writer.add(f"{stat}_total", 'counter', f"Total {stat.replace('_', ' ')}.", value)
+            writer.add('dead_letter_queue_size', 'gauge', 'Messages in the dead-letter queue.',
+                       len(self.dead_letter_queue))
+            writer.add('dispatch_pending_messages', 'gauge',
+                       'Push deliveries queued or running.', self.dispatcher.pending())
+            writer.add('dispatch_paused_messages', 'gauge',
+                       'Push deliveries held by paused ordering keys.', self.dispatcher.paused())
+            
+            for topic_name, topic in self.topics.items():
+                labels = {'topic': topic_name}
+                topic_log = self.topic_logs[topic_name]
+                writer.add('topic_messages_published_total', 'counter',
+                           'Messages published to the topic.', topic['message_count'], labels)
+                writer.add('topic_messages_dropped_total', 'counter',
+                           'Messages dropped by topic flow control.', topic['messages_dropped'], labels)
+                writer.add('topic_queue_messages', 'gauge',
+                           'Messages retained in the topic log.', len(topic_log), labels)
+                writer.add('topic_queue_bytes', 'gauge',
+                           'Payload bytes retained in the topic log.', topic_log.bytes_since(0), labels)
+                for window in RATE_WINDOWS:
+                    writer.add('topic_publish_rate', 'gauge',
+                               'Messages published per second over a sliding window.',
+                               topic['publish_rate'].rate(window), dict(labels, window=f"{window}s"))
+                    
+            lane_heads = self.dispatcher.lane_heads()
+            now_ns = time.time_ns()
+            for subscription_name, subscription in self.subscriptions.items():
+                labels = {'subscription': subscription_name, 'topic': subscription['topic']}
+                metrics = subscription['metrics']
+                oldest_ns = self._oldest_unacked_ns(subscription_name, lane_heads)
+                writer.add('subscription_messages_acked_total', 'counter',
+                           'Messages acknowledged or delivered to push callbacks.',
+                           subscription['message_count'], labels)
+                writer.add('subscription_backlog_messages', 'gauge',
+                           'Retained messages not yet pulled.',
+                           self._subscription_backlog(subscription_name), labels)
+                writer.add('subscription_outstanding_messages', 'gauge',
+                           'Delivered messages awaiting acknowledgement.',
+                           len(subscription['leases']), labels)
+                writer.add('subscription_pending_redelivery_messages', 'gauge',
+                           'Nacked or expired messages awaiting redelivery.',
+                           len(subscription['leases'].ready), labels)
+                writer.add('subscription_oldest_unacked_message_age_seconds', 'gauge',
+                           'Age of the oldest message not yet acknowledged.',
+                           (now_ns - oldest_ns) / 1e9 if oldest_ns else 0.0, labels)
+                for window in RATE_WINDOWS:
+                    window_labels = dict(labels, window=f"{window}s")
+                    writer.add('subscription_delivery_rate', 'gauge',
+                               'Messages delivered per second over a sliding window.',
+                               metrics.delivered.rate(window), window_labels)
+                    writer.add('subscription_ack_rate', 'gauge',
+                               'Messages acknowledged per second over a sliding window.',
+                               metrics.acked.rate(window), window_labels)
+                writer.add_summary('publish_to_deliver_seconds',
+                                   'Time from publish to delivery.', metrics.publish_to_deliver, labels)
+                writer.add_summary('deliver_to_ack_seconds',
+                                   'Time from pull to acknowledgement.', metrics.deliver_to_ack, labels)
+                writer.add_summary('callback_seconds',
+                                   'Push subscriber callback execution time.', metrics.callback, labels)
+        return writer.render()
+
+    def _commit_messages(self, topic_name: str,
+                         items: List[Tuple[Any, Optional[Dict[str, str]], Optional[str], Optional[str]]]) -> List[Any]:
+        """
+        Encode a batch of messages and append it to the topic log in one step.
+        The batch shares a publish time. Messages whose
+        idempotency key was seen within the dedup window are dropped.
+        
+        Returns:
+            Message ID (the original's, for a duplicate), or the exception
+            that rejected it, per item
+        """
+        if topic_name not in self.topics:
+            raise ValueError(f"Topic '{topic_name}' does not exist")
+            
+        publish_time_ns = time.time_ns()
+        max_message_size = self.config['max_message_size']
+        messages = []
+        results = []
+        keyed = []  # (result index, message index, idempotency key)
+        
+        for index, (payload, attributes, ordering_key, idempotency_key) in enumerate(items):
+            message = PubSubMessage(self._generate_message_id(), publish_time_ns, payload,
+                                    attributes, ordering_key or '', topic_name)
+            
+            # Check message size; this encodes the payload once and the bytes
+            # are what the log stores and subscribers receive
+            if len(message.data) > max_message_size:
+                self.stats['messages_failed'] += 1
+                self.dead_letter_queue.append({
+                    'topic': topic_name,
+                    'error': 'Message exceeds max size',
+                    'timestamp': datetime.utcnow().isoformat()
+                })
+                results.append(ValueError("Message size exceeds limit"))
+                continue
+                
+            if idempotency_key is not None:
+                keyed.append((index, len(messages), idempotency_key))
+            messages.append(message)
+            results.append(message.message_id)
+            
+        with self._lock:
+            if keyed:
+                # Answer retries from the dedup window first, so a duplicate
+                # never evicts, waits for or is rejected for lack of capacity
+                duplicates = self._find_duplicates(topic_name, keyed, messages, results, record=False)
+                fresh = [m for i, m in enumerate(messages) if i not in duplicates]
+            else:
+                fresh = messages
+                
+            if fresh:
+                # May wait for capacity (releasing the lock) or raise
+                self._reserve_capacity(topic_name, len(fresh), sum(map(len, fresh)))
+                if keyed:
+                    # Record the keys only once the messages will be stored; a
+                    # key published while this waited is a duplicate as well
+                    duplicates = self._find_duplicates(topic_name, keyed, messages, results, record=True)
+                    fresh = [m for i, m in enumerate(messages) if i not in duplicates]
+            if keyed:
+                self.stats['messages_deduplicated'] += len(duplicates)
+            messages = fresh
+                    
+            # Store once in the topic log; every subscription reads it by offset
+            topic_log = self.topic_logs[topic_name]
+            topic_log.append_batch(messages, publish_time_ns)
+            self.topics[topic_name]['message_count'] += len(messages)
+            self.stats['messages_published'] += len(messages)
+            if messages:
+                self.topics[topic_name]['publish_rate'].add(len(messages))
+            
+            # Nothing can ever read it: new subscriptions start at the log end.
+            # A durable log is bounded by retention and its checkpointed cursors
+            if (isinstance(topic_log, TopicLog) and not self.topic_subscriptions[topic_name]
+                    and not self._snapshot_offsets(topic_name)):
+                topic_log.trim(topic_log.end_offset)
+                
+            # Hand off to push subscribers without running their callbacks here
+            for message in messages:
+                self._trigger_subscribers(topic_name, message)
+                
+            if messages:
+                self.publish_sequence += 1
+                self._published.notify_all()
+                
+        return results
+
+    def _find_duplicates(self, topic_name: str, keyed: List[Tuple[int, int, str]],
+                         messages: List[PubSubMessage], results: List[Any], record: bool) -> Set[int]:
+        """
+        Indexes into messages of those whose idempotency key was published
+        within the topic's dedup window or earlier in the batch; their results
+        become the original message IDs. With record=True the other messages'
+        keys are recorded in the window.
+        """
+        dedup = self.topic_dedup[topic_name]
+        now = time.monotonic()
+        batch_ids = {}  # Idempotency key -> ID of the batch's first message with it
+        duplicates = set()
+        for result_index, message_index, idempotency_key in keyed:
+            message_id = messages[message_index].message_id
+            if record:
+                original_id = dedup.check(idempotency_key, message_id, now)
+            else:
+                original_id = dedup.get(idempotency_key, now)
+                if original_id is None:
+                    original_id = batch_ids.setdefault(idempotency_key, message_id)
+                    if original_id == message_id:
+                        original_id = None
+            if original_id is not None:
+                duplicates.add(message_index)
+            results[result_index] = message_id if original_id is None else original_id
+        return duplicates
+
+    def _trigger_subscribers(self, topic_name: str, message: PubSubMessage) -> None:
+        """
+        Queue a message for every push subscription whose filter matches.
+        Keyed messages get a lane per (subscription, ordering key) so keys are
+        delivered in parallel but each key one message at a time.
+        """
+        ordering_key = message.ordering_key
+        for sub_name in self.topic_routes[topic_name].match(message.attributes):
+            callbacks = self.subscribers[sub_name]
+            lane_key = (sub_name, ordering_key) if ordering_key else sub_name
+            if callbacks and not self.dispatcher.submit(lane_key, callbacks, message,
+                                                        ordered=bool(ordering_key)):
+                self.stats['messages_failed'] += 1
+                self.dead_letter_queue.append({
+                    'subscription': sub_name,
+                    'error': 'Subscriber inbox full',
+                    'message': message,
+                    'timestamp': datetime.utcnow().isoformat()
+                })
+
+    def _reserve_capacity(self, topic_name: str, count: int, size: int) -> None:
+        """
+        Make room for count messages of size bytes under the topic's and its
+        subscriptions' flow-control limits. Called with the lock held;
+        'block' waits on _capacity, which releases the lock while waiting.
+        
+        Raises:
+            FlowControlError: For a full 'raise' limit, or a 'block' timeout
+            ValueError: If the topic is deleted while waiting
+        """
+        deadline = None
+        while True:
+            if topic_name not in self.topics:
+                raise ValueError(f"Topic '{topic_name}' does not exist")
+            topic_log = self.topic_logs[topic_name]
+            # Push subscriptions take messages as they are published; their
+            # cursor does not follow delivery, so only pull ones read the log
+            pulled = [name for name in self.topic_subscriptions[topic_name] if not self.subscribers[name]]
+            scopes = [(self.topics[topic_name], topic_log.start_offset)]
+            for name in pulled:
+                subscription = self.subscriptions[name]
+                if subscription['flow_control'] is not None:
+                    scopes.append((subscription, max(subscription['cursor'], topic_log.start_offset)))
+                    
+            blocked_on = None
+            for owner, start in scopes:
+                limits = owner['flow_control']
+                if limits is None:
+                    continue
+                target = self._fit_offset(topic_log, start, limits, count, size)
+                if target == start:
+                    continue
+                if limits['policy'] == 'drop_oldest':
+                    if owner is self.topics[topic_name]:
+                        # Only count messages some subscription had not read yet
+                        readers = [max(self.subscriptions[name]['cursor'], start) for name in pulled]
+                        topic_log.trim(target)
+                        dropped = max(0, target - min(readers)) if readers else 0
+                    else:
+                        dropped = target - start
+                        owner['cursor'] = target
+                    owner['messages_dropped'] += dropped
+                    self.stats['messages_dropped'] += dropped
+                elif limits['policy'] == 'raise':
+                    self.stats['messages_rejected'] += count
+                    raise FlowControlError(f"Flow control limit reached for '{owner['name']}'")
+                else:
+                    blocked_on = owner['name']
+                    
+            if blocked_on is None:
+                return
+            timeout = self.config['flow_control_timeout_seconds']
+            if deadline is None:
+                self.stats['publishes_blocked'] += 1
+                deadline = time.monotonic() + timeout if timeout is not None else None
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                self.stats['messages_rejected'] += count
+                raise FlowControlError(f"Timed out waiting for capacity on '{blocked_on}'")
+            self._capacity.wait(remaining)
+
+    @staticmethod
+    def _fit_offset(topic_log, start: int, limits: Dict[str, Any], count: int, size: int) -> int:
+        """
+        Lowest offset from which the backlog plus the incoming messages fits
+        the limits (start if it already fits). An empty backlog always fits.
+        """
+        end = topic_log.end_offset
+        target = start
+        if limits['max_messages'] is not None:
+            target = max(target, end + count - limits['max_messages'])
+        max_bytes = limits['max_bytes']
+        if max_bytes is not None and topic_log.bytes_since(target) + size > max_bytes:
+            low, high = target, end
+            while low < high:
+                middle = (low + high) // 2
+                if topic_log.bytes_since(middle) + size <= max_bytes:
+                    high = middle
+                else:
+                    low = middle + 1
+            target = low
+        return min(target, end)
+
+    def _flow_control_settings(self, flow_control: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Validate flow-control settings; None when nothing is limited."""
+        if not flow_control:
+            return None
+        unknown = set(flow_control) - {'max_messages', 'max_bytes', 'policy'}
+        if unknown:
+            raise ValueError(f"Unknown flow control settings: {sorted(unknown)}")
+        settings = {
+            'max_messages': flow_control.get('max_messages'),
+            'max_bytes': flow_control.get('max_bytes'),
+            'policy': flow_control.get('policy') or self.config['flow_control_policy']
+        }
+        if settings['policy'] not in FLOW_CONTROL_POLICIES:
+            raise ValueError(f"Unknown flow control policy '{settings['policy']}'")
+        for limit in ('max_messages', 'max_bytes'):
+            if settings[limit] is not None and settings[limit] <= 0:
+                raise ValueError(f"Flow control {limit} must be positive")
+        if settings['max_messages'] is None and settings['max_bytes'] is None:
+            return None
+        return settings
+
+    def _replay_push(self, subscription_name: str, redeliver: List[PubSubMessage],
+                     offset: int, end: int) -> None:
+        """Re-dispatch a seeked push subscription's messages, waiting for inbox room."""
+        pending = list(redeliver)
+        while True:
+            with self._lock:
+                subscription = self.subscriptions.get(subscription_name)
+                if subscription is None:
+                    return
+                if not pending:
+                    topic_log = self.topic_logs[subscription['topic']]
+                    offset = max(offset, topic_log.start_offset)
+                    chunk = topic_log.read(offset, min(100, end - offset)) if offset < end else []
+                    if not chunk:
+                        return
+                    offset += len(chunk)
+                    message_filter = subscription['filter']
+                    pending = [m for m in chunk if not message_filter or message_filter(m.attributes)]
+                callbacks = self.subscribers[subscription_name]
+                
+            for message in pending:
+                key = message.ordering_key
+                lane_key = (subscription_name, key) if key else subscription_name
+                if not self.dispatcher.submit(lane_key, callbacks, message, ordered=bool(key), timeout=30):
+                    self.stats['messages_failed'] += 1
+                    self.dead_letter_queue.append({
+                        'subscription': subscription_name,
+                        'error': 'Subscriber inbox full',
+                        'message': message,
+                        'timestamp': datetime.utcnow().isoformat()
+                    })
+            pending = []
+
+    @staticmethod
+    def _time_ns(timestamp: Any) -> int:
+        """Convert a datetime (naive means UTC) or epoch seconds to epoch nanoseconds."""
+        if isinstance(timestamp, datetime):
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            timestamp = timestamp.timestamp()
+        return int(timestamp * 1_000_000_000)
+
+    def _record_push_timings(self, lane_key: Any, messages: List[PubSubMessage],
+                             started_ns: List[int], finished_ns: int) -> None:
+        """Record delivery and callback latency of a batch the dispatcher delivered."""
+        subscription_name = lane_key[0] if isinstance(lane_key, tuple) else lane_key
+        ended_ns = started_ns[1:]
+        ended_ns.append(finished_ns)
+        with self._lock:
+            subscription = self.subscriptions.get(subscription_name)
+            if subscription is None:
+                return
+            metrics = subscription['metrics']
+            metrics.publish_to_deliver.record_many(
+                [started - message.publish_time_ns for message, started in zip(messages, started_ns)])
+            metrics.callback.record_many([end - start for start, end in zip(started_ns, ended_ns)])
+            now = time.monotonic()
+            metrics.delivered.add(len(messages), now)
+            metrics.acked.add(len(messages), now)
+
+    def _oldest_unacked_ns(self, subscription_name: str,
+                           lane_heads: List[Tuple[Any, PubSubMessage]]) -> Optional[int]:
+        """
+        Publish time of the oldest message the subscription has not acknowledged:
+        outstanding and redelivered leases, queued push deliveries, or (for
+        pull subscriptions) the next unread message in the topic log.
+        """
+        subscription = self.subscriptions[subscription_name]
+        leases = subscription['leases']
+        times = [lease[1].publish_time_ns for lease in leases.leases.values()]
+        times.extend(entry[0].publish_time_ns for entry in leases.ready)
+        times.extend(message.publish_time_ns for key, message in lane_heads
+                     if (key[0] if isinstance(key, tuple) else key) == subscription_name)
+        if not self.subscribers[subscription_name]:
+            topic_log = self.topic_logs[subscription['topic']]
+            unread = topic_log.read(max(subscription['cursor'], topic_log.start_offset), 1)
+            if unread:
+                times.append(unread[0].publish_time_ns)
+        return min(times) if times else None
 
-    def _generate_message_id(self) -> str:
-        """Generate a unique message ID."""
-        import uuid
-        return str(uuid.uuid4())[:16]
+    def _record_callback_error(self, message: PubSubMessage, error: Exception) -> None:
+        """Dead-letter a message whose subscriber callback raised."""
+        self.dead_letter_queue.append({
+            'error': str(error),
+            'message': message,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+
+    def _deliver(self, subscription: Dict[str, Any], message: PubSubMessage,
+                 delivery_attempt: int, offset: int, now: float, auto_ack: bool) -> None:
+        """Lease a pulled message, or count it as received when auto-acked."""
+        if auto_ack:
+            subscription['message_count'] += 1
+            self.stats['messages_received'] += 1
+        else:
+            deadline = now + subscription['ack_deadline_seconds']
+            subscription['leases'].lease(message, delivery_attempt, offset, deadline, now)
+
+    def _requeue(self, subscription: Dict[str, Any], message: PubSubMessage,
+                 delivery_attempt: int, offset: int) -> None:
+        """Queue a message for redelivery, or dead-letter it once out of attempts."""
+        if delivery_attempt >= subscription['max_delivery_attempts']:
+            self.stats['messages_failed'] += 1
+            self.dead_letter_queue.append({
+                'subscription': subscription['name'],
+                'error': f"Exceeded {subscription['max_delivery_attempts']} delivery attempts",
+                'message': message,
+                'timestamp': datetime.utcnow().isoformat()
+            })
+        else:
+            subscription['leases'].ready.append((message, delivery_attempt, offset))
+
+    def _trim_topic_log(self, topic_name: str, force: bool = False) -> None:
+        """
+        Drop messages every subscription of the topic has read past. Snapshots
+        and subscriptions that retain acked messages hold trimming back.
+        """
+        topic_log = self.topic_logs[topic_name]
+        if isinstance(topic_log, TopicLog):
+            floors = [self.subscriptions[s]['cursor'] for s in self.topic_subscriptions[topic_name]]
+            floors.extend(self._retention_floors(topic_name))
+            topic_log.trim(min(floors) if floors else topic_log.end_offset)
+            return
+            
+        # Durable logs checkpoint cursors periodically; unacked messages stay
+        # below the checkpoint so they are redelivered after a restart
+        now = time.monotonic()
+        if not force and now < self._next_checkpoint.get(topic_name, 0):
+            return
+        self._next_checkpoint[topic_name] = now + self.config['checkpoint_interval_ms'] / 1000.0
+        for name in self.topic_subscriptions[topic_name]:
+            subscription = self.subscriptions[name]
+            floor = subscription['leases'].floor()
+            cursor = subscription['cursor']
+            topic_log.cursors[name] = cursor if floor is None else min(cursor, floor)
+        topic_log.save_cursors()
+        floors = list(topic_log.cursors.values())
+        floors.extend(self._retention_floors(topic_name))
+        topic_log.trim(min(floors) if floors else topic_log.start_offset)
+
+    def _retention_floors(self, topic_name: str) -> List[int]:
+        """Offsets pinned by snapshots and by subscriptions retaining acked messages."""
+        floors = self._snapshot_offsets(topic_name)
+        retained = [name for name in self.topic_subscriptions[topic_name]
+                    if self.subscriptions[name]['retain_acked_messages']]
+        if retained:
+            topic_log = self.topic_logs[topic_name]
+            retention_ns = self.topics[topic_name]['message_retention_duration'] * 1_000_000_000
+            retention_floor = topic_log.offset_for_time(time.time_ns() - retention_ns)
+            floors.extend(min(self.subscriptions[name]['cursor'], retention_floor) for name in retained)
+        return floors
+
+    def _snapshot_offsets(self, topic_name: str) -> List[int]:
+        """Offset each of the topic's snapshots reads the log from (it holds its unacked messages itself)."""
+        return [snapshot['offset'] for snapshot in self.snapshots.values()
+                if snapshot['topic'] == topic_name]
+
+    def _open_topic_log(self, topic_name: str, retention_seconds: int):
+        """Create the topic's log for the configured storage mode."""
+        if self.config['storage_mode'] == 'memory':
+            return TopicLog()
+        if self.config['storage_mode'] != 'disk':
+            raise ValueError(f"Unknown storage mode '{self.config['storage_mode']}'")
+        return SegmentLog(
+            os.path.join(self.config['storage_dir'], topic_name),
+            segment_bytes=self.config['segment_bytes'],
+            fsync_policy=self.config['fsync_policy'],
+            fsync_interval_ms=self.config['fsync_interval_ms'],
+            retention_seconds=retention_seconds,
+            encode=PubSubMessage.to_record,
+            decode=partial(PubSubMessage.from_record, topic=topic_name)
+        )
+
+    def _initial_cursor(self, topic_name: str, subscription_name: str) -> int:
+        """Resume a durable subscription from its checkpoint, else start at the log end."""
+        topic_log = self.topic_logs[topic_name]
+        if isinstance(topic_log, SegmentLog) and subscription_name in topic_log.cursors:
+            return max(topic_log.cursors[subscription_name], topic_log.start_offset)
+        return topic_log.end_offset
+
+    def _subscription_backlog(self, subscription_name: str) -> int:
+        """Number of retained messages the subscription has not read yet."""
+        subscription = self.subscriptions[subscription_name]
+        topic_log = self.topic_logs[subscription['topic']]
+        return topic_log.end_offset - max(subscription['cursor'], topic_log.start_offset)
+
+    def _generate_message_id(self) -> int:
+        """Generate a unique, increasing message ID."""
+        return next(self._message_ids)
+
+    @staticmethod
+    def _message_keys(message_ids: List[Any]) -> List[int]:
+        """Convert caller-supplied message IDs to lease keys, skipping malformed ones."""
+        keys = []
+        for message_id in message_ids:
+            try:
+                keys.append(int(message_id))
+            except (TypeError, ValueError):
+                continue
+        return keys
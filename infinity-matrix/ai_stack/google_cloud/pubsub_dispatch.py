@@ -0,0 +1,349 @@
+"""
+Subscriber Dispatch - Asynchronous callback delivery for the Pub/Sub agent
+Runs subscriber callbacks off the publishing thread on a thread pool or an asyncio loop
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Callable, Optional, Hashable, Tuple
+from collections import deque
+
+
+class _Lane:
+    """Bounded inbox of messages that must be delivered in order."""
+
+    __slots__ = ('inbox', 'callbacks', 'scheduled', 'ordered', 'paused', 'current')
+
+    def __init__(self, callbacks: List[Callable], ordered: bool = False):
+        self.inbox = deque()
+        self.callbacks = callbacks
+        self.scheduled = False
+        self.ordered = ordered
+        self.paused = False
+        self.current = None  # Message being delivered, once taken off the inbox
+
+
+class SubscriberDispatcher:
+    """
+    Delivers published messages to subscriber callbacks asynchronously.
+
+    Every lane (one per subscription, or per subscription and ordering key)
+    has a bounded inbox drained by at most one worker at a time, so a lane
+    sees its messages in publish order while different lanes run in
+    parallel. Publishing only appends to the inbox, so it never waits on a
+    callback.
+
+    An ordered lane pauses when a callback fails: the failed message stays
+    at the head of the inbox and later messages queue behind it until
+    resume() is called. Paused messages do not count as pending.
+
+    When on_delivered is set, each delivered batch is reported with the
+    wall-clock time (ns) each message's callbacks started and the time the
+    last one finished, so callers can derive delivery and callback latency.
+    """
+
+    BACKENDS = ('thread', 'asyncio')
+
+    def __init__(self, backend: str = 'thread', max_workers: int = 8,
+                 inbox_size: int = 1000, drain_batch: int = 32,
+                 on_error: Optional[Callable[[Any, Exception], None]] = None,
+                 on_delivered: Optional[Callable[[Hashable, List[Any], List[int], int], None]] = None):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            backend: 'thread' (thread pool) or 'asyncio' (event loop thread)
+            max_workers: Worker threads for the pool / sync callbacks
+            inbox_size: Maximum queued messages per lane
+            drain_batch: Messages a worker delivers before yielding the lane
+            on_error: Called with (message, exception) when a callback raises
+            on_delivered: Called with (lane_key, messages, started_ns, finished_ns)
+                          after each batch
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown dispatch backend '{backend}'")
+
+        self.backend = backend
+        self.max_workers = max_workers
+        self.inbox_size = inbox_size
+        self.drain_batch = drain_batch
+        self.on_error = on_error
+        self.on_delivered = on_delivered
+        self.stats = {
+            'dispatched': 0,
+            'failed': 0,
+            'overflowed': 0
+        }
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._pending = 0
+        self._paused = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._space = threading.Condition(self._lock)  # Notified when inboxes shrink
+        self._executor = None
+        self._loop = None
+        self._loop_thread = None
+
+    def submit(self, lane_key: Hashable, callbacks: List[Callable], message: Any,
+               ordered: bool = False, timeout: float = 0) -> bool:
+        """
+        Queue a message for delivery to a lane's callbacks.
+
+        Args:
+            lane_key: Lane identifier (subscription name, or subscription and ordering key)
+            callbacks: Callbacks to invoke, in order, for each message
+            message: Message to deliver
+            ordered: Pause the lane when a callback fails instead of moving on
+            timeout: Seconds to wait for room when the inbox is full
+
+        Returns:
+            False if the lane's inbox is full and the message was not queued
+        """
+        with self._lock:
+            lane = self._lanes.get(lane_key)
+            if lane is None:
+                lane = self._lanes[lane_key] = _Lane(callbacks, ordered)
+            if len(lane.inbox) >= self.inbox_size and timeout:
+                self._space.wait_for(lambda: len(lane.inbox) < self.inbox_size, timeout)
+                # The lane may have drained and been removed while waiting
+                lane = self._lanes.setdefault(lane_key, lane)
+            if len(lane.inbox) >= self.inbox_size:
+                self.stats['overflowed'] += 1
+                return False
+
+            lane.callbacks = callbacks
+            lane.inbox.append(message)
+            if lane.paused:
+                self._paused += 1
+                return True
+            self._pending += 1
+            if lane.scheduled:
+                return True
+            lane.scheduled = True
+
+        self._schedule(lane_key, lane)
+        return True
+
+    def resume(self, lane_key: Hashable, skip_failed: bool = False) -> bool:
+        """
+        Restart delivery on a paused lane, retrying the failed message first.
+
+        Args:
+            lane_key: Lane to resume
+            skip_failed: Drop the failed message instead of retrying it
+
+        Returns:
+            False if the lane is not paused
+        """
+        with self._lock:
+            lane = self._lanes.get(lane_key)
+            if lane is None or not lane.paused:
+                return False
+            if skip_failed:
+                lane.inbox.popleft()
+                self._paused -= 1
+            lane.paused = False
+            self._paused -= len(lane.inbox)
+            self._pending += len(lane.inbox)
+            if not lane.inbox:
+                del self._lanes[lane_key]
+                return True
+            lane.scheduled = True
+
+        self._schedule(lane_key, lane)
+        return True
+
+    def paused_lanes(self) -> List[Hashable]:
+        """Keys of the lanes waiting for resume()."""
+        with self._lock:
+            return [key for key, lane in self._lanes.items() if lane.paused]
+
+    def lane_heads(self) -> List[Tuple[Hashable, Any]]:
+        """The oldest undelivered message of every lane, with its lane key."""
+        with self._lock:
+            heads = []
+            for key, lane in self._lanes.items():
+                head = lane.current
+                if head is None and lane.inbox:
+                    head = lane.inbox[0]
+                if head is not None:
+                    heads.append((key, head))
+            return heads
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued message has been delivered.
+
+        Returns:
+            True if idle, False if the timeout expired first
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def pending(self) -> int:
+        """Number of queued or in-flight messages."""
+        return self._pending
+
+    def paused(self) -> int:
+        """Number of messages held in paused lanes."""
+        return self._paused
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker pool and event loop."""
+        if wait:
+            self.wait_idle()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if wait:
+                self._loop_thread.join()
+            self._loop = None
+            self._loop_thread = None
+
+    def _schedule(self, lane_key: Hashable, lane: _Lane) -> None:
+        """Hand a lane to the backend for draining."""
+        if self.backend == 'thread':
+            self._get_executor().submit(self._drain, lane_key, lane)
+        else:
+            asyncio.run_coroutine_threadsafe(self._drain_async(lane_key, lane), self._get_loop())
+
+    def _take(self, lane_key: Hashable, lane: _Lane) -> List[Any]:
+        """Pop the next batch from a lane, releasing the lane once it is empty."""
+        with self._lock:
+            batch = []
+            lane.current = None
+            while lane.inbox and len(batch) < self.drain_batch:
+                batch.append(lane.inbox.popleft())
+            if not batch:
+                lane.scheduled = False
+                if self._lanes.get(lane_key) is lane:
+                    del self._lanes[lane_key]
+            else:
+                self._space.notify_all()
+            return batch
+
+    def _done(self, delivered: int, failed: int) -> None:
+        """Account for a delivered batch and wake waiters once idle."""
+        with self._lock:
+            self._pending -= delivered
+            self.stats['dispatched'] += delivered
+            self.stats['failed'] += failed
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _pause(self, lane: _Lane, undelivered: List[Any], delivered: int, failed: int) -> None:
+        """Put a failed ordered batch back at the head of its lane and hold the lane."""
+        with self._lock:
+            lane.inbox.extendleft(reversed(undelivered))
+            lane.current = None
+            lane.paused = True
+            lane.scheduled = False
+            self._pending -= delivered + len(lane.inbox)
+            self._paused += len(lane.inbox)
+            self.stats['dispatched'] += delivered
+            self.stats['failed'] += failed
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _drain(self, lane_key: Hashable, lane: _Lane) -> None:
+        """Thread backend: deliver batches until the lane is empty."""
+        timed = self.on_delivered is not None
+        batch = self._take(lane_key, lane)
+        while batch:
+            failed = 0
+            started = []
+            for index, message in enumerate(batch):
+                ok = True
+                lane.current = message
+                if timed:
+                    started.append(time.time_ns())
+                for callback in lane.callbacks:
+                    try:
+                        callback(message)
+                    except Exception as e:
+                        ok = False
+                        failed += 1
+                        self._report(message, e)
+                if not ok and lane.ordered:
+                    if timed:
+                        self._observe(lane_key, batch[:index + 1], started)
+                    self._pause(lane, batch[index:], index, failed)
+                    return
+            if timed:
+                self._observe(lane_key, batch, started)
+            self._done(len(batch), failed)
+            batch = self._take(lane_key, lane)
+
+    async def _drain_async(self, lane_key: Hashable, lane: _Lane) -> None:
+        """Asyncio backend: await coroutine callbacks, offload sync ones."""
+        loop = asyncio.get_running_loop()
+        timed = self.on_delivered is not None
+        batch = self._take(lane_key, lane)
+        while batch:
+            failed = 0
+            started = []
+            for index, message in enumerate(batch):
+                ok = True
+                lane.current = message
+                if timed:
+                    started.append(time.time_ns())
+                for callback in lane.callbacks:
+                    try:
+                        if asyncio.iscoroutinefunction(callback):
+                            await callback(message)
+                        else:
+                            await loop.run_in_executor(self._get_executor(), callback, message)
+                    except Exception as e:
+                        ok = False
+                        failed += 1
+                        self._report(message, e)
+                if not ok and lane.ordered:
+                    if timed:
+                        self._observe(lane_key, batch[:index + 1], started)
+                    self._pause(lane, batch[index:], index, failed)
+                    return
+            if timed:
+                self._observe(lane_key, batch, started)
+            self._done(len(batch), failed)
+            batch = self._take(lane_key, lane)
+
+    def _observe(self, lane_key: Hashable, messages: List[Any], started: List[int]) -> None:
+        """Forward a delivered batch's timings to on_delivered."""
+        finished = time.time_ns()
+        try:
+            self.on_delivered(lane_key, messages, started, finished)
+        except Exception:
+            pass
+
+    def _report(self, message: Any, error: Exception) -> None:
+        """Forward a callback failure to the error handler."""
+        if self.on_error is not None:
+            try:
+                self.on_error(message, error)
+            except Exception:
+                pass
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Create the worker pool on first use."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='pubsub-dispatch')
+        return self._executor
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the event loop thread on first use."""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name='pubsub-dispatch-loop',
+                                              daemon=True)
+                    thread.start()
+                    self._loop_thread = thread
+                    self._loop = loop
+        return self._loop
@@ -0,0 +1,448 @@
+"""
+Pub/Sub Emulator - Local HTTP front-end for the in-process Pub/Sub agent
+Serves the core of the Pub/Sub v1 REST API so other processes can use a PubSubAgent
+
+Run from ai_stack/: python -m google_cloud.pubsub_emulator [--port PORT] [--storage-dir DIR]
+"""
+import argparse
+import base64
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional, Tuple
+
+from .pubsub_agent import FlowControlError, PubSubAgent
+from .pubsub_message import PubSubMessage
+
+_ROUTE = re.compile(
+    r'^/v1/projects/(?P<project>[^/]+)/(?P<kind>topics|subscriptions|snapshots)'
+    r'(?:/(?P<name>[^/:]+))?(?::(?P<verb>[A-Za-z]+))?$'
+)
+
+_STATUS = {400: 'INVALID_ARGUMENT', 404: 'NOT_FOUND', 405: 'METHOD_NOT_ALLOWED',
+           429: 'RESOURCE_EXHAUSTED', 500: 'INTERNAL'}
+
+
+class EmulatorError(Exception):
+    """Error returned to the client with an HTTP status code."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class PubSubEmulator:
+    """
+    HTTP server exposing a PubSubAgent through Pub/Sub v1 REST routes:
+
+        PUT/GET/DELETE  /v1/projects/{p}/topics/{topic}
+        POST            /v1/projects/{p}/topics/{topic}:publish
+        PUT/GET/DELETE  /v1/projects/{p}/subscriptions/{sub}
+        POST            /v1/projects/{p}/subscriptions/{sub}:pull
+        POST            /v1/projects/{p}/subscriptions/{sub}:acknowledge
+        POST            /v1/projects/{p}/subscriptions/{sub}:modifyAckDeadline
+        POST            /v1/projects/{p}/subscriptions/{sub}:streamingPull
+        POST            /v1/projects/{p}/subscriptions/{sub}:seek
+        PUT/GET/DELETE  /v1/projects/{p}/snapshots/{snapshot}
+        GET             /metrics  (Prometheus text format)
+
+    streamingPull keeps the response open and writes newline-delimited JSON
+    batches of messages, holding back delivery while the stream's unacked
+    messages exceed maxOutstandingMessages or maxOutstandingBytes.
+    """
+
+    def __init__(self, agent: Optional[PubSubAgent] = None, host: str = '127.0.0.1',
+                 port: int = 8085, pull_wait_seconds: float = 1.0,
+                 max_outstanding_messages: int = 1000,
+                 max_outstanding_bytes: int = 100 * 1024 * 1024):
+        """
+        Initialize the emulator.
+
+        Args:
+            agent: Agent to serve (a new one is created if omitted)
+            host: Interface to bind
+            port: Port to bind (0 picks a free port)
+            pull_wait_seconds: How long an empty :pull waits for new messages
+            max_outstanding_messages: Default streaming flow-control message limit
+            max_outstanding_bytes: Default streaming flow-control byte limit
+        """
+        self.agent = agent or PubSubAgent()
+        self.pull_wait_seconds = pull_wait_seconds
+        self.max_outstanding_messages = max_outstanding_messages
+        self.max_outstanding_bytes = max_outstanding_bytes
+        self._acked = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+        handler = type('PubSubEmulatorHandler', (_EmulatorHandler,), {'emulator': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'PubSubEmulator':
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='pubsub-emulator',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve on the calling thread until stop() is called."""
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        """Close open streams and stop the server."""
+        self._stopping.set()
+        with self._acked:
+            self._acked.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    # Resource handlers: return a JSON-serializable response body
+
+    def handle(self, method: str, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        match = _ROUTE.match(path)
+        if match is None:
+            raise EmulatorError(404, f"Unknown resource {path}")
+        project, kind, name, verb = match.group('project', 'kind', 'name', 'verb')
+
+        if name is None:
+            if method != 'GET':
+                raise EmulatorError(405, f"{method} not allowed on {path}")
+            if kind == 'topics':
+                return {'topics': [{'name': self._topic_path(project, t)}
+                                   for t in self.agent.list_topics()]}
+            if kind == 'snapshots':
+                return {'snapshots': [self._snapshot_resource(project, s)
+                                      for s in self.agent.list_snapshots()]}
+            return {'subscriptions': [self._subscription_resource(project, s)
+                                      for s in self.agent.list_subscriptions()]}
+
+        route = (kind, verb or '', method)
+        if route == ('topics', '', 'PUT'):
+            retention = self._seconds(body.get('messageRetentionDuration'), 604800)
+            self.agent.create_topic(name, labels=body.get('labels'),
+                                    message_retention_duration=retention)
+            return {'name': self._topic_path(project, name), 'labels': body.get('labels', {})}
+        if route == ('topics', '', 'GET'):
+            self._require_topic(name)
+            return {'name': self._topic_path(project, name)}
+        if route == ('topics', '', 'DELETE'):
+            self._require_topic(name)
+            self.agent.delete_topic(name)
+            return {}
+        if route == ('topics', 'publish', 'POST'):
+            return self._publish(name, body.get('messages', []))
+        if route == ('subscriptions', '', 'PUT'):
+            topic_name = body.get('topic', '').rsplit('/', 1)[-1]
+            self._require_topic(topic_name)
+            dead_letter_policy = body.get('deadLetterPolicy') or {}
+            self.agent.create_subscription(
+                name, topic_name,
+                ack_deadline_seconds=int(body.get('ackDeadlineSeconds', 10)),
+                filter_expression=body.get('filter') or None,
+                max_delivery_attempts=dead_letter_policy.get('maxDeliveryAttempts')
+            )
+            return self._subscription_resource(project, name)
+        if route == ('subscriptions', '', 'GET'):
+            self._require_subscription(name)
+            return self._subscription_resource(project, name)
+        if route == ('subscriptions', '', 'DELETE'):
+            self._require_subscription(name)
+            self.agent.delete_subscription(name)
+            return {}
+        if route == ('subscriptions', 'pull', 'POST'):
+            return self._pull(name, int(body.get('maxMessages', 10)),
+                              bool(body.get('returnImmediately', False)))
+        if route == ('subscriptions', 'acknowledge', 'POST'):
+            self._require_subscription(name)
+            self.agent.acknowledge_messages(name, body.get('ackIds', []))
+            self._notify_acked()
+            return {}
+        if route == ('subscriptions', 'modifyAckDeadline', 'POST'):
+            self._require_subscription(name)
+            self.agent.modify_ack_deadline(name, body.get('ackIds', []),
+                                           int(body.get('ackDeadlineSeconds', 0)))
+            self._notify_acked()
+            return {}
+        if route == ('subscriptions', 'seek', 'POST'):
+            self._require_subscription(name)
+            if body.get('snapshot'):
+                self.agent.seek(name, snapshot=body['snapshot'].rsplit('/', 1)[-1])
+            else:
+                self.agent.seek(name, timestamp=self._parse_time(body.get('time', '')))
+            return {}
+        if route == ('snapshots', '', 'PUT'):
+            self.agent.create_snapshot(name, body.get('subscription', '').rsplit('/', 1)[-1])
+            return self._snapshot_resource(project, name)
+        if route == ('snapshots', '', 'GET'):
+            self._require_snapshot(name)
+            return self._snapshot_resource(project, name)
+        if route == ('snapshots', '', 'DELETE'):
+            self._require_snapshot(name)
+            self.agent.delete_snapshot(name)
+            return {}
+        raise EmulatorError(405, f"{method} not allowed on {path}")
+
+    def stream_pull(self, path: str, body: Dict[str, Any], write) -> None:
+        """
+        Serve a streaming pull, writing message batches until the client goes
+        away or the emulator stops.
+        """
+        match = _ROUTE.match(path)
+        name = match.group('name')
+        self._require_subscription(name)
+        max_messages = int(body.get('maxOutstandingMessages') or self.max_outstanding_messages)
+        max_bytes = int(body.get('maxOutstandingBytes') or self.max_outstanding_bytes)
+        outstanding: Dict[str, int] = {}
+        outstanding_bytes = 0
+        last_write = time.monotonic()
+
+        while not self._stopping.is_set() and name in self.agent.subscriptions:
+            for ack_id in [a for a in outstanding if not self.agent.is_outstanding(name, a)]:
+                outstanding_bytes -= outstanding.pop(ack_id)
+
+            room = max_messages - len(outstanding)
+            if room <= 0 or outstanding_bytes >= max_bytes:
+                # Flow control: wait for the client to ack
+                with self._acked:
+                    self._acked.wait(0.5)
+                continue
+
+            sequence = self.agent.publish_sequence
+            messages = self.agent.pull_messages(name, max_messages=min(room, 100))
+            if messages:
+                received = []
+                for message in messages:
+                    size = len(message.data)
+                    outstanding[message.message_id] = size
+                    outstanding_bytes += size
+                    received.append(self._received_message(message))
+                write({'receivedMessages': received})
+                last_write = time.monotonic()
+                continue
+
+            self.agent.wait_for_publish(sequence, timeout=0.5)
+            if time.monotonic() - last_write >= 15:
+                write({})  # Heartbeat so dead clients are noticed
+                last_write = time.monotonic()
+
+    def _publish(self, topic_name: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self._require_topic(topic_name)
+        if not messages:
+            raise EmulatorError(400, "At least one message is required")
+        payloads = []
+        for message in messages:
+            data = base64.b64decode(message.get('data', ''))
+            if len(data) > self.agent.config['max_message_size']:
+                raise EmulatorError(400, "Message size exceeds limit")
+            payloads.append(data)
+        message_ids = self.agent.publish_batch(topic_name, payloads,
+                                               [m.get('attributes') for m in messages],
+                                               [m.get('orderingKey') for m in messages])
+        if None in message_ids:
+            raise EmulatorError(400, "Message rejected by the topic")
+        return {'messageIds': message_ids}
+
+    def _pull(self, name: str, max_messages: int, return_immediately: bool) -> Dict[str, Any]:
+        self._require_subscription(name)
+        deadline = time.monotonic() + self.pull_wait_seconds
+        while True:
+            sequence = self.agent.publish_sequence
+            messages = self.agent.pull_messages(name, max_messages=max_messages)
+            remaining = deadline - time.monotonic()
+            if messages or return_immediately or remaining <= 0:
+                return {'receivedMessages': [self._received_message(m) for m in messages]}
+            self.agent.wait_for_publish(sequence, timeout=remaining)
+
+    def _received_message(self, message: PubSubMessage) -> Dict[str, Any]:
+        message_id = message.message_id
+        return {
+            'ackId': message_id,
+            'message': {
+                'data': base64.b64encode(message.data).decode('ascii'),
+                'attributes': dict(message.attributes),
+                'messageId': message_id,
+                'orderingKey': message.ordering_key,
+                'publishTime': message.publish_time + 'Z'
+            }
+        }
+
+    def _subscription_resource(self, project: str, name: str) -> Dict[str, Any]:
+        subscription = self.agent.subscriptions[name]
+        return {
+            'name': f"projects/{project}/subscriptions/{name}",
+            'topic': self._topic_path(project, subscription['topic']),
+            'ackDeadlineSeconds': subscription['ack_deadline_seconds'],
+            'filter': subscription['filter_expression'] or '',
+            'deadLetterPolicy': {'maxDeliveryAttempts': subscription['max_delivery_attempts']}
+        }
+
+    def _snapshot_resource(self, project: str, name: str) -> Dict[str, Any]:
+        snapshot = self.agent.snapshots[name]
+        return {
+            'name': f"projects/{project}/snapshots/{name}",
+            'topic': self._topic_path(project, snapshot['topic'])
+        }
+
+    def _require_snapshot(self, name: str) -> None:
+        if name not in self.agent.snapshots:
+            raise EmulatorError(404, f"Snapshot '{name}' does not exist")
+
+    def _require_topic(self, name: str) -> None:
+        if name not in self.agent.topics:
+            raise EmulatorError(404, f"Topic '{name}' does not exist")
+
+    def _require_subscription(self, name: str) -> None:
+        if name not in self.agent.subscriptions:
+            raise EmulatorError(404, f"Subscription '{name}' does not exist")
+
+    def _notify_acked(self) -> None:
+        with self._acked:
+            self._acked.notify_all()
+
+    @staticmethod
+    def _topic_path(project: str, name: str) -> str:
+        return f"projects/{project}/topics/{name}"
+
+    @staticmethod
+    def _parse_time(value: str) -> datetime:
+        """Parse an RFC 3339 timestamp such as '2024-01-01T12:00:00.5Z'."""
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise EmulatorError(400, f"Invalid time '{value}'")
+
+    @staticmethod
+    def _seconds(duration: Optional[str], default: int) -> int:
+        """Parse a protobuf Duration string such as '600s'."""
+        if not duration:
+            return default
+        return int(float(str(duration).rstrip('s')))
+
+
+class _EmulatorHandler(BaseHTTPRequestHandler):
+    """Translates HTTP requests into PubSubEmulator calls."""
+
+    protocol_version = 'HTTP/1.1'
+    emulator: PubSubEmulator = None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method: str) -> None:
+        path = self.path.split('?', 1)[0]
+        try:
+            body = self._read_body()
+            if method == 'POST' and path.endswith(':streamingPull'):
+                self._stream(path, body)
+                return
+            if method == 'GET' and path == '/metrics':
+                self._send_text(200, self.emulator.agent.export_prometheus(),
+                                'text/plain; version=0.0.4; charset=utf-8')
+                return
+            self._send(200, self.emulator.handle(method, path, body))
+        except EmulatorError as e:
+            self._send_error(e.code, str(e))
+        except FlowControlError as e:
+            self._send_error(429, str(e))
+        except ValueError as e:
+            self._send_error(404 if 'does not exist' in str(e) else 400, str(e))
+        except Exception as e:
+            self._send_error(500, str(e))
+
+    def _read_body(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except json.JSONDecodeError as e:
+            raise EmulatorError(400, f"Invalid JSON body: {e}")
+
+    def _send(self, code: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, code: int, text: str, content_type: str) -> None:
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, code: int, message: str) -> None:
+        self._send(code, {'error': {'code': code, 'message': message,
+                                    'status': _STATUS.get(code, 'UNKNOWN')}})
+
+    def _stream(self, path: str, body: Dict[str, Any]) -> None:
+        # Validate before committing to a chunked 200 response
+        match = _ROUTE.match(path)
+        if match is None or match.group('kind') != 'subscriptions':
+            raise EmulatorError(404, f"Unknown resource {path}")
+        self.emulator._require_subscription(match.group('name'))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write(payload: Dict[str, Any]) -> None:
+            line = json.dumps(payload).encode('utf-8') + b'\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.flush()
+
+        try:
+            self.emulator.stream_pull(path, body, write)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+def main() -> None:
+    """Run the emulator in the foreground."""
+    parser = argparse.ArgumentParser(description='Local Pub/Sub emulator backed by PubSubAgent')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    parser.add_argument('--storage-dir', help='Persist topics on disk in this directory')
+    args = parser.parse_args()
+
+    config = {'storage_mode': 'disk', 'storage_dir': args.storage_dir} if args.storage_dir else None
+    emulator = PubSubEmulator(PubSubAgent(config=config), host=args.host, port=args.port)
+    print(f"Pub/Sub emulator listening on {emulator.url}")
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.agent.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Pub/Sub Filter - Attribute filter expressions for Pub/Sub subscriptions
+Parses subscription filters once into predicates and indexes them for routing
+"""
+import re
+from typing import Dict, List, Callable, Optional, FrozenSet, Tuple
+
+# Token kinds: string literal, punctuation, identifier
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<op>!=|[=:(),.\-])
+      | (?P<ident>[A-Za-z_][A-Za-z0-9_\-]*)
+    )''', re.VERBOSE)
+
+_KEYWORDS = ('AND', 'OR', 'NOT')
+
+Term = Tuple[str, str]
+
+
+class CompiledFilter:
+    """
+    A parsed subscription filter.
+
+    Calling it with a message's attributes evaluates the predicate. `terms`
+    holds attribute equalities of which at least one must be present for the
+    filter to match (None when no such set exists), used for index routing.
+    """
+
+    __slots__ = ('expression', 'predicate', 'terms')
+
+    def __init__(self, expression: str, predicate: Callable[[Dict[str, str]], bool],
+                 terms: Optional[FrozenSet[Term]]):
+        self.expression = expression
+        self.predicate = predicate
+        self.terms = terms
+
+    def __call__(self, attributes: Dict[str, str]) -> bool:
+        return self.predicate(attributes)
+
+    def __repr__(self) -> str:
+        return f"CompiledFilter({self.expression!r})"
+
+
+def compile_filter(expression: str) -> CompiledFilter:
+    """
+    Compile a filter expression.
+
+    Supported syntax:
+        attributes.key = "value"        attributes.key != "value"
+        attributes:key                  hasPrefix(attributes.key, "prefix")
+        NOT expr / -expr                expr AND expr / expr OR expr / ( expr )
+
+    Args:
+        expression: Filter expression
+
+    Returns:
+        Compiled filter
+
+    Raises:
+        ValueError: If the expression is not valid
+    """
+    parser = _Parser(expression)
+    predicate, terms = parser.parse()
+    return CompiledFilter(expression, predicate, terms)
+
+
+class FilterIndex:
+    """
+    Routes a message's attributes to the subscriptions whose filters match.
+
+    Filters that require one of a known set of attribute equalities are
+    indexed by those (key, value) terms and only evaluated when the message
+    carries one of them; the rest are evaluated on every message.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._filters: Dict[str, Optional[CompiledFilter]] = {}
+        self._unfiltered: Dict[str, None] = {}
+        self._unindexed: Dict[str, CompiledFilter] = {}
+        self._by_term: Dict[Term, Dict[str, None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def add(self, name: str, compiled: Optional[CompiledFilter]) -> None:
+        """Register a subscription and its filter (None matches everything)."""
+        self.remove(name)
+        self._filters[name] = compiled
+        if compiled is None:
+            self._unfiltered[name] = None
+        elif compiled.terms is None:
+            self._unindexed[name] = compiled
+        else:
+            for term in compiled.terms:
+                self._by_term.setdefault(term, {})[name] = None
+
+    def remove(self, name: str) -> None:
+        """Unregister a subscription."""
+        compiled = self._filters.pop(name, None)
+        self._unfiltered.pop(name, None)
+        self._unindexed.pop(name, None)
+        if compiled is not None and compiled.terms is not None:
+            for term in compiled.terms:
+                names = self._by_term.get(term)
+                if names is not None:
+                    names.pop(name, None)
+                    if not names:
+                        del self._by_term[term]
+
+    def match(self, attributes: Dict[str, str]) -> List[str]:
+        """Return the subscriptions whose filters accept the attributes."""
+        matched = list(self._unfiltered)
+        for name, compiled in self._unindexed.items():
+            if compiled(attributes):
+                matched.append(name)
+        if self._by_term and attributes:
+            candidates = {}
+            for term in attributes.items():
+                names = self._by_term.get(term)
+                if names:
+                    candidates.update(names)
+            for name in candidates:
+                if self._filters[name](attributes):
+                    matched.append(name)
+        return matched
+
+
+class _Parser:
+    """Recursive-descent parser producing (predicate, terms) pairs."""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = self._tokenize(expression)
+        self.pos = 0
+
+    def parse(self) -> Tuple[Callable[[Dict[str, str]], bool], Optional[FrozenSet[Term]]]:
+        if not self.tokens:
+            raise ValueError("Filter expression is empty")
+        result = self._or()
+        if self.pos < len(self.tokens):
+            self._error(f"unexpected '{self.tokens[self.pos][1]}'")
+        return result
+
+    def _tokenize(self, expression: str) -> List[Tuple[str, str]]:
+        tokens = []
+        pos = 0
+        end = len(expression.rstrip())
+        while pos < end:
+            match = _TOKEN_RE.match(expression, pos)
+            if match is None:
+                raise ValueError(f"Invalid filter expression at position {pos}: {expression!r}")
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'string':
+                value = re.sub(r'\\(.)', r'\1', value[1:-1])
+            elif kind == 'ident' and value in _KEYWORDS:
+                kind = 'keyword'
+            tokens.append((kind, value))
+            pos = match.end()
+        return tokens
+
+    def _error(self, reason: str) -> None:
+        raise ValueError(f"Invalid filter expression ({reason}): {self.expression!r}")
+
+    def _peek(self, kind: str, value: Optional[str] = None) -> bool:
+        if self.pos >= len(self.tokens):
+            return False
+        token_kind, token_value = self.tokens[self.pos]
+        return token_kind == kind and (value is None or token_value == value)
+
+    def _expect(self, kind: str, value: Optional[str] = None) -> str:
+        if not self._peek(kind, value):
+            found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else 'end of input'
+            self._error(f"expected {value or kind}, found '{found}'")
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def _or(self):
+        parts = [self._and()]
+        while self._peek('keyword', 'OR'):
+            self.pos += 1
+            parts.append(self._and())
+        if len(parts) == 1:
+            return parts[0]
+        predicates = tuple(p for p, _ in parts)
+        terms = None
+        if all(t is not None for _, t in parts):
+            terms = frozenset().union(*(t for _, t in parts))
+        return (lambda attrs: any(p(attrs) for p in predicates)), terms
+
+    def _and(self):
+        parts = [self._unary()]
+        while self._peek('keyword', 'AND'):
+            self.pos += 1
+            parts.append(self._unary())
+        if len(parts) == 1:
+            return parts[0]
+        predicates = tuple(p for p, _ in parts)
+        # Any conjunct's required terms are required by the whole; pick the narrowest
+        indexed = [t for _, t in parts if t is not None]
+        terms = min(indexed, key=len) if indexed else None
+        return (lambda attrs: all(p(attrs) for p in predicates)), terms
+
+    def _unary(self):
+        if self._peek('keyword', 'NOT') or self._peek('op', '-'):
+            self.pos += 1
+            predicate, _ = self._unary()
+            return (lambda attrs: not predicate(attrs)), None
+        return self._primary()
+
+    def _primary(self):
+        if self._peek('op', '('):
+            self.pos += 1
+            result = self._or()
+            self._expect('op', ')')
+            return result
+        if self._peek('ident', 'hasPrefix'):
+            self.pos += 1
+            self._expect('op', '(')
+            key = self._attribute_key('.')
+            self._expect('op', ',')
+            prefix = self._expect('string')
+            self._expect('op', ')')
+            return (lambda attrs: key in attrs and attrs[key].startswith(prefix)), None
+        if self._peek('ident', 'attributes'):
+            self.pos += 1
+            if self._peek('op', ':'):
+                self.pos += 1
+                key = self._key()
+                return (lambda attrs: key in attrs), None
+            self._expect('op', '.')
+            key = self._key()
+            if self._peek('op', '='):
+                self.pos += 1
+                value = self._expect('string')
+                return (lambda attrs: attrs.get(key) == value), frozenset([(key, value)])
+            if self._peek('op', '!='):
+                self.pos += 1
+                value = self._expect('string')
+                return (lambda attrs: attrs.get(key) != value), None
+            self._error(f"expected '=' or '!=' after attributes.{key}")
+        found = self.tokens[self.pos][1] if self.pos < len(self.tokens) else 'end of input'
+        self._error(f"unexpected '{found}'")
+
+    def _attribute_key(self, separator: str) -> str:
+        self._expect('ident', 'attributes')
+        self._expect('op', separator)
+        return self._key()
+
+    def _key(self) -> str:
+        if self._peek('string'):
+            return self._expect('string')
+        if self._peek('ident') or self._peek('keyword'):
+            self.pos += 1
+            return self.tokens[self.pos - 1][1]
+        return self._expect('ident')
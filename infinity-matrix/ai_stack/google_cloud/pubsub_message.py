@@ -0,0 +1,132 @@
+"""
+Pub/Sub Message - Compact message record for the Pub/Sub agent
+Holds one published message with an integer ID, a nanosecond timestamp and encoded payload bytes
+"""
+import json
+import struct
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Dict, Any, Optional, Mapping
+
+# Shared by every message published without attributes
+NO_ATTRIBUTES: Mapping[str, str] = MappingProxyType({})
+
+# Durable record: message ID, publish time (epoch ns), ordering key length, attributes length
+_RECORD = struct.Struct('<QQHI')
+
+
+def encode_payload(payload: Any) -> bytes:
+    """Encode a payload the way messages are stored: dicts as JSON, bytes as-is, else str()."""
+    if isinstance(payload, dict):
+        return json.dumps(payload).encode('utf-8')
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    return str(payload).encode('utf-8')
+
+
+class PubSubMessage:
+    """
+    A published message.
+
+    The payload is encoded on first use of `data` and the bytes are cached,
+    so the size check, the topic log and every delivery share one buffer.
+    Item access (message['message_id'], message['data'], ...) returns the
+    fields of the dict envelopes earlier versions used.
+    """
+
+    __slots__ = ('id', 'publish_time_ns', 'attributes', 'ordering_key', 'topic',
+                 '_payload', '_data')
+
+    def __init__(self, message_id: int, publish_time_ns: int, payload: Any = None,
+                 attributes: Optional[Mapping[str, str]] = None, ordering_key: str = '',
+                 topic: str = '', data: Optional[bytes] = None):
+        """
+        Create a message.
+
+        Args:
+            message_id: Unique, increasing integer ID
+            publish_time_ns: Publish time in epoch nanoseconds
+            payload: Message data, encoded lazily (see encode_payload)
+            attributes: Message attributes
+            ordering_key: Ordering key ('' for none)
+            topic: Topic name
+            data: Already-encoded payload bytes (instead of payload)
+        """
+        self.id = message_id
+        self.publish_time_ns = publish_time_ns
+        self.attributes = attributes or NO_ATTRIBUTES
+        self.ordering_key = ordering_key
+        self.topic = topic
+        self._payload = payload
+        self._data = data
+
+    @property
+    def data(self) -> bytes:
+        """Encoded payload."""
+        if self._data is None:
+            self._data = encode_payload(self._payload)
+            self._payload = None
+        return self._data
+
+    @property
+    def message_id(self) -> str:
+        """Message ID in its string form, as returned by publish."""
+        return str(self.id)
+
+    @property
+    def publish_time(self) -> str:
+        """Publish time as a naive UTC ISO-8601 string."""
+        seconds, nanos = divmod(self.publish_time_ns, 1_000_000_000)
+        moment = datetime.fromtimestamp(seconds, timezone.utc).replace(microsecond=nanos // 1000)
+        return moment.replace(tzinfo=None).isoformat()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'data':
+            return self.data.decode('utf-8', 'surrogateescape')
+        if key in ('message_id', 'attributes', 'ordering_key', 'publish_time', 'topic'):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the message as a plain envelope dict."""
+        return {
+            'message_id': self.message_id,
+            'data': self['data'],
+            'attributes': dict(self.attributes),
+            'ordering_key': self.ordering_key,
+            'publish_time': self.publish_time,
+            'topic': self.topic
+        }
+
+    def to_record(self) -> bytes:
+        """Serialize for a durable topic log."""
+        key = self.ordering_key.encode('utf-8')
+        attributes = json.dumps(self.attributes).encode('utf-8') if self.attributes else b''
+        return b''.join((_RECORD.pack(self.id, self.publish_time_ns, len(key), len(attributes)),
+                         key, attributes, self.data))
+
+    @classmethod
+    def from_record(cls, record: bytes, topic: str = '') -> 'PubSubMessage':
+        """Rebuild a message written by to_record."""
+        message_id, publish_time_ns, key_length, attributes_length = _RECORD.unpack_from(record)
+        position = _RECORD.size + key_length
+        key = record[_RECORD.size:position].decode('utf-8')
+        attributes = None
+        if attributes_length:
+            attributes = json.loads(record[position:position + attributes_length])
+            position += attributes_length
+        return cls(message_id, publish_time_ns, attributes=attributes, ordering_key=key,
+                   topic=topic, data=record[position:])
+
+    def __repr__(self) -> str:
+        return (f"PubSubMessage(id={self.id}, topic={self.topic!r}, "
+                f"ordering_key={self.ordering_key!r}, size={len(self)})")
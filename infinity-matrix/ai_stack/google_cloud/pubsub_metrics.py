@@ -0,0 +1,257 @@
+"""
+Pub/Sub Metrics - Latency histograms, sliding-window rates and Prometheus text export
+Recording is a few integer operations so it can sit on the publish and delivery paths
+"""
+import math
+import time
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+# Sub-buckets per power of two: values are kept to within 1/16 (6.25%)
+_SUB_BITS = 4
+_SUB_COUNT = 1 << _SUB_BITS
+_LINEAR_LIMIT = 2 * _SUB_COUNT  # Values below this get one bucket each
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+RATE_WINDOWS = (60, 300)  # Seconds
+
+
+def _bucket_index(value: int) -> int:
+    if value < _LINEAR_LIMIT:
+        return value
+    shift = value.bit_length() - _SUB_BITS - 1
+    return (shift << _SUB_BITS) + (value >> shift)
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """Lowest and highest value counted in a bucket."""
+    if index < _LINEAR_LIMIT:
+        return index, index
+    shift = (index >> _SUB_BITS) - 1
+    lowest = (index - (shift << _SUB_BITS)) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of non-negative integer latencies in nanoseconds.
+
+    Buckets are linear within each power of two (16 per octave), so any
+    recorded value is reported to within 6.25% from 1ns up to max_value_ns
+    using a few hundred counters. Values above max_value_ns are clamped.
+    Not thread-safe: callers record under the lock that guards the owner.
+    """
+
+    __slots__ = ('counts', 'total', 'max_value_ns')
+
+    def __init__(self, max_value_ns: int = 3600 * 1_000_000_000):
+        """
+        Initialize an empty histogram.
+
+        Args:
+            max_value_ns: Largest value tracked exactly; larger ones are clamped
+        """
+        self.max_value_ns = max_value_ns
+        self.counts = [0] * (_bucket_index(max_value_ns) + 1)
+        self.total = 0  # Sum of recorded values, for averages and Prometheus _sum
+
+    def record(self, value_ns: int) -> None:
+        """Count one latency."""
+        # _bucket_index inlined with literal constants; this is on the hot path
+        if value_ns < 32:
+            if value_ns < 0:
+                value_ns = 0
+            self.counts[value_ns] += 1
+        else:
+            if value_ns > self.max_value_ns:
+                value_ns = self.max_value_ns
+            shift = value_ns.bit_length() - 5
+            self.counts[(shift << 4) + (value_ns >> shift)] += 1
+        self.total += value_ns
+
+    def record_many(self, values_ns: Iterable[int]) -> None:
+        """Count a batch of latencies; cheaper per value than record()."""
+        counts = self.counts
+        limit = self.max_value_ns
+        total = 0
+        for value_ns in values_ns:
+            if value_ns < 32:
+                if value_ns < 0:
+                    value_ns = 0
+                counts[value_ns] += 1
+            else:
+                if value_ns > limit:
+                    value_ns = limit
+                shift = value_ns.bit_length() - 5
+                counts[(shift << 4) + (value_ns >> shift)] += 1
+            total += value_ns
+        self.total += total
+
+    def count(self) -> int:
+        """Number of recorded values."""
+        return sum(self.counts)
+
+    def percentile(self, fraction: float) -> int:
+        """
+        Value at or below which `fraction` of recorded values fall.
+
+        Returns:
+            Highest value of the matching bucket, or 0 if nothing was recorded
+        """
+        total = self.count()
+        if not total:
+            return 0
+        rank = max(1, math.ceil(fraction * total))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(_bucket_bounds(index)[1], self.max_value_ns)
+        return self.max_value_ns
+
+    def max(self) -> int:
+        """Highest recorded value (to bucket precision)."""
+        for index in range(len(self.counts) - 1, -1, -1):
+            if self.counts[index]:
+                return min(_bucket_bounds(index)[1], self.max_value_ns)
+        return 0
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        """Add another histogram's counts to this one."""
+        if len(other.counts) != len(self.counts):
+            raise ValueError("Histograms must have the same range to merge")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def summary(self, quantiles: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, Any]:
+        """Count, mean, max and quantiles in seconds."""
+        count = self.count()
+        result = {
+            'count': count,
+            'mean_seconds': self.total / count / 1e9 if count else 0.0,
+            'max_seconds': self.max() / 1e9
+        }
+        for fraction in quantiles:
+            result[f"p{fraction * 100:g}_seconds"] = self.percentile(fraction) / 1e9
+        return result
+
+
+class RateWindow:
+    """
+    Event counts in one-second slots of a ring, for rates over sliding windows.
+    Adding advances the ring lazily, so idle periods cost nothing.
+    """
+
+    __slots__ = ('_slots', '_second')
+
+    def __init__(self, max_window_seconds: int = max(RATE_WINDOWS)):
+        """
+        Initialize an empty window.
+
+        Args:
+            max_window_seconds: Longest window rate() will be asked for
+        """
+        self._slots = [0] * (max_window_seconds + 1)
+        self._second = 0
+
+    def add(self, count: int = 1, now: Optional[float] = None) -> None:
+        """Count events at monotonic time `now` (defaults to the current time)."""
+        second = int(time.monotonic() if now is None else now)
+        if second > self._second:
+            self._advance(second)
+        # A time read just before another thread advanced counts as current
+        self._slots[self._second % len(self._slots)] += count
+
+    def rate(self, window_seconds: int, now: Optional[float] = None) -> float:
+        """
+        Events per second over the last `window_seconds` complete seconds.
+
+        Raises:
+            ValueError: If the window is longer than the ring
+        """
+        if not 0 < window_seconds < len(self._slots):
+            raise ValueError(f"Rate window must be between 1 and {len(self._slots) - 1} seconds")
+        second = int(time.monotonic() if now is None else now)
+        if second > self._second:
+            self._advance(second)
+        second = self._second
+        size = len(self._slots)
+        return sum(self._slots[(second - age) % size]
+                   for age in range(1, window_seconds + 1)) / window_seconds
+
+    def _advance(self, second: int) -> None:
+        """Clear the slots of the seconds skipped since the last event."""
+        size = len(self._slots)
+        if second - self._second >= size:
+            self._slots = [0] * size
+        else:
+            for skipped in range(self._second + 1, second + 1):
+                self._slots[skipped % size] = 0
+        self._second = second
+
+
+class SubscriptionMetrics:
+    """Latency histograms and delivery rates of one subscription."""
+
+    __slots__ = ('publish_to_deliver', 'deliver_to_ack', 'callback', 'delivered', 'acked')
+
+    def __init__(self):
+        self.publish_to_deliver = LatencyHistogram()
+        self.deliver_to_ack = LatencyHistogram()  # Pull subscriptions
+        self.callback = LatencyHistogram()  # Push subscriptions
+        self.delivered = RateWindow()
+        self.acked = RateWindow()
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and not math.isfinite(value):
+        return '+Inf' if value > 0 else ('-Inf' if value < 0 else 'NaN')
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusWriter:
+    """
+    Builds a Prometheus text exposition (format 0.0.4).
+    Samples of a metric family are grouped under one HELP/TYPE header
+    regardless of the order they are added in.
+    """
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self._families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def add(self, name: str, metric_type: str, help_text: str, value: float,
+            labels: Optional[Dict[str, Any]] = None, suffix: str = '') -> None:
+        """Add one sample to the family `name`."""
+        name = self.prefix + name
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (metric_type, help_text, [])
+        label_text = ''
+        if labels:
+            label_text = '{' + ','.join(f'{key}="{_escape(val)}"'
+                                        for key, val in labels.items()) + '}'
+        family[2].append(f"{name}{suffix}{label_text} {_format_value(value)}")
+
+    def add_summary(self, name: str, help_text: str, histogram: LatencyHistogram,
+                    labels: Optional[Dict[str, Any]] = None,
+                    quantiles: Iterable[float] = DEFAULT_QUANTILES) -> None:
+        """Add a latency histogram as a summary in seconds."""
+        labels = dict(labels or {})
+        for fraction in quantiles:
+            self.add(name, 'summary', help_text, histogram.percentile(fraction) / 1e9,
+                     dict(labels, quantile=f"{fraction:g}"))
+        self.add(name, 'summary', help_text, histogram.total / 1e9, labels, suffix='_sum')
+        self.add(name, 'summary', help_text, histogram.count(), labels, suffix='_count')
+
+    def render(self) -> str:
+        """The exposition text."""
+        lines = []
+        for name, (metric_type, help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
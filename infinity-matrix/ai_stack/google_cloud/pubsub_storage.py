@@ -0,0 +1,406 @@
+"""
+Pub/Sub Storage - Durable append-only segment log for Pub/Sub topics
+Stores topic messages on disk as length-prefixed records with an mmap'd offset index
+"""
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+from typing import Dict, List, Any, Callable, Optional
+
+# Record header: payload length, payload crc32, publish time (epoch ns)
+_RECORD = struct.Struct('<IIQ')
+# Index entry: record position in the segment file, publish time (epoch ns)
+_INDEX_ENTRY = struct.Struct('<QQ')
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class _Segment:
+    """One log file and its offset index, starting at base_offset."""
+
+    __slots__ = ('base_offset', 'log_path', 'index_path', 'writer', 'reader',
+                 'index', 'index_file', 'count', 'size', 'last_timestamp_ns', 'sealed')
+
+    def __init__(self, directory: str, base_offset: int):
+        self.base_offset = base_offset
+        self.log_path = os.path.join(directory, f"{base_offset:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_offset:020d}.index")
+        self.writer = None
+        self.reader = None
+        self.index = None
+        self.index_file = None
+        self.count = 0
+        self.size = 0
+        self.last_timestamp_ns = 0
+        self.sealed = False
+
+    @property
+    def end_offset(self) -> int:
+        return self.base_offset + self.count
+
+    def entry(self, i: int):
+        """Return (position, timestamp_ns) of the i-th record."""
+        return _INDEX_ENTRY.unpack_from(self.index, i * _INDEX_ENTRY.size)
+
+    def open_sealed(self) -> None:
+        """Map the index of a segment that no longer receives appends."""
+        self.sealed = True
+        self.size = os.path.getsize(self.log_path)
+        self.count = os.path.getsize(self.index_path) // _INDEX_ENTRY.size
+        if self.count:
+            self.index_file = open(self.index_path, 'rb')
+            self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.last_timestamp_ns = self.entry(self.count - 1)[1]
+
+    def open_active(self, index_capacity: int) -> None:
+        """Open for appends, recovering the tail after an unclean shutdown."""
+        if not os.path.exists(self.log_path):
+            open(self.log_path, 'wb').close()
+        self.index_file = open(self.index_path, 'a+b')
+        self.index_file.truncate(index_capacity * _INDEX_ENTRY.size)
+        self.index = mmap.mmap(self.index_file.fileno(), 0)
+        self._recover()
+        self.writer = open(self.log_path, 'ab')
+
+    def _recover(self) -> None:
+        """Rebuild the index from the log file, dropping a torn final record."""
+        position = 0
+        count = 0
+        capacity = len(self.index) // _INDEX_ENTRY.size
+        with open(self.log_path, 'rb') as f:
+            while count < capacity:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    break
+                length, crc, timestamp_ns = _RECORD.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                _INDEX_ENTRY.pack_into(self.index, count * _INDEX_ENTRY.size, position, timestamp_ns)
+                self.last_timestamp_ns = timestamp_ns
+                position += _RECORD.size + length
+                count += 1
+        if position != os.path.getsize(self.log_path):
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(position)
+        self.count = count
+        self.size = position
+
+    def seal(self, sync: bool = False) -> None:
+        """
+        Stop appending: shrink the index to its used size and remap read-only.
+        With sync, the log and index are forced to disk before they are closed.
+        """
+        self.writer.flush()
+        if sync:
+            os.fsync(self.writer.fileno())
+        self.writer.close()
+        self.writer = None
+        self.index.flush()
+        self.index.close()
+        self.index_file.truncate(self.count * _INDEX_ENTRY.size)
+        if sync:
+            os.fsync(self.index_file.fileno())
+        self.index_file.close()
+        self.index = None
+        self.index_file = None
+        self.open_sealed()
+
+    def read(self, first: int, last: int) -> List[bytes]:
+        """Return the payloads of records first..last-1 (segment-relative)."""
+        if self.reader is None:
+            self.reader = open(self.log_path, 'rb')
+        start = self.entry(first)[0]
+        end = self.entry(last)[0] if last < self.count else self.size
+        self.reader.seek(start)
+        chunk = self.reader.read(end - start)
+        payloads = []
+        position = 0
+        while position < len(chunk):
+            length = _RECORD.unpack_from(chunk, position)[0]
+            position += _RECORD.size
+            payloads.append(chunk[position:position + length])
+            position += length
+        return payloads
+
+    def close(self) -> None:
+        for handle in (self.writer, self.reader, self.index, self.index_file):
+            if handle is not None:
+                handle.close()
+        self.writer = self.reader = self.index = self.index_file = None
+
+    def delete(self) -> None:
+        self.close()
+        for path in (self.log_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SegmentLog:
+    """
+    Durable topic log with the same interface as the in-memory TopicLog.
+
+    Messages are appended to fixed-size segment files as length-prefixed,
+    checksummed records. Each segment has an mmap'd index of record
+    positions and publish times, so reads seek straight to an offset and
+    only the messages being read are held in memory. Segments are deleted
+    whole once every reader has passed them or they fall out of retention.
+
+    Subscription cursors are checkpointed alongside the segments in
+    `cursors` so readers resume where they left off after a restart.
+    """
+
+    CURSORS_FILE = 'cursors.json'
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 index_capacity: int = 1 << 20, fsync_policy: str = 'interval',
+                 fsync_interval_ms: int = 1000, retention_seconds: Optional[int] = None,
+                 encode: Callable[[Any], bytes] = None, decode: Callable[[bytes], Any] = None):
+        """
+        Open (or create) a topic log directory, recovering any existing segments.
+
+        Args:
+            directory: Directory holding this topic's segments
+            segment_bytes: Size at which the active segment is rolled
+            index_capacity: Maximum records per segment
+            fsync_policy: 'always' (every append), 'interval' or 'never'
+            fsync_interval_ms: Minimum time between fsyncs for 'interval'
+            retention_seconds: Delete segments whose newest message is older
+            encode: Serializes a message to record bytes (default: JSON)
+            decode: Rebuilds a message from record bytes (default: JSON)
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync_policy}'")
+
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_capacity = index_capacity
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.retention_seconds = retention_seconds
+        self.encode = encode or (lambda message: json.dumps(message).encode('utf-8'))
+        self.decode = decode or json.loads
+        self._segments: List[_Segment] = []
+        self._bases: List[int] = []
+        self._base_bytes: List[int] = []  # Bytes written to the log before each segment
+        self._last_fsync = time.monotonic()
+        self._next_retention_check = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+        bases = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.log'))
+        for base in bases[:-1]:
+            segment = _Segment(directory, base)
+            segment.open_sealed()
+            self._add_segment(segment)
+        self._roll(bases[-1] if bases else 0)
+        self.start_offset = self._segments[0].base_offset
+        self._last_timestamp_ns = max(segment.last_timestamp_ns for segment in self._segments)
+        self.cursors: Dict[str, int] = self._load_cursors()
+
+    def __len__(self) -> int:
+        return self.end_offset - self.start_offset
+
+    @property
+    def end_offset(self) -> int:
+        return self._segments[-1].end_offset
+
+    def append(self, message: Dict[str, Any]) -> int:
+        """Append a message and return its offset."""
+        return self.append_batch([message])
+
+    def append_batch(self, messages: List[Dict[str, Any]],
+                     timestamp_ns: Optional[int] = None) -> int:
+        """
+        Append messages as one write, then fsync according to policy.
+
+        Args:
+            messages: Messages to append
+            timestamp_ns: Publish time indexed for offset_for_time (default:
+                          now); raised to the latest indexed time if older,
+                          so the index stays sorted
+
+        Returns:
+            Offset of the first message
+        """
+        first_offset = self.end_offset
+        timestamp_ns = self._last_timestamp_ns = max(timestamp_ns or time.time_ns(), self._last_timestamp_ns)
+        segment = self._segments[-1]
+        encode = self.encode
+        buffer = bytearray()
+        for message in messages:
+            if segment.size + len(buffer) >= self.segment_bytes or segment.count >= self.index_capacity:
+                segment.writer.write(buffer)
+                buffer = bytearray()
+                segment = self._roll(segment.end_offset)
+            payload = encode(message)
+            _INDEX_ENTRY.pack_into(segment.index, segment.count * _INDEX_ENTRY.size,
+                                   segment.size + len(buffer), timestamp_ns)
+            buffer += _RECORD.pack(len(payload), zlib.crc32(payload), timestamp_ns)
+            buffer += payload
+            segment.count += 1
+        segment.writer.write(buffer)
+        segment.writer.flush()
+        segment.size += len(buffer)
+        segment.last_timestamp_ns = timestamp_ns
+
+        now = time.monotonic()
+        if self.fsync_policy == 'always' or (
+                self.fsync_policy == 'interval' and now - self._last_fsync >= self.fsync_interval):
+            self.sync()
+        if self.retention_seconds and now >= self._next_retention_check:
+            self._next_retention_check = now + 1.0
+            self.expire(time.time_ns() - self.retention_seconds * 1_000_000_000)
+        return first_offset
+
+    def read(self, offset: int, max_messages: int) -> List[Dict[str, Any]]:
+        """Return up to max_messages messages starting at offset."""
+        offset = max(offset, self.start_offset)
+        messages = []
+        i = bisect.bisect_right(self._bases, offset) - 1
+        while len(messages) < max_messages and i < len(self._segments):
+            segment = self._segments[i]
+            first = offset - segment.base_offset
+            last = min(segment.count, first + max_messages - len(messages))
+            if first < last:
+                messages.extend(map(self.decode, segment.read(first, last)))
+                offset = segment.base_offset + last
+            i += 1
+        return messages
+
+    def bytes_since(self, offset: int) -> int:
+        """Bytes on disk (headers included) of the retained messages from offset on."""
+        offset = max(offset, self.start_offset)
+        if offset >= self.end_offset:
+            return 0
+        i = bisect.bisect_right(self._bases, offset) - 1
+        segment = self._segments[i]
+        position = self._base_bytes[i] + segment.entry(offset - segment.base_offset)[0]
+        return self._base_bytes[-1] + self._segments[-1].size - position
+
+    def offset_for_time(self, timestamp_ns: int) -> int:
+        """
+        First retained offset appended at or after timestamp_ns (end_offset
+        if none). Binary-searches the segments by their newest timestamp,
+        then that segment's index.
+        """
+        low = bisect.bisect_right(self._bases, self.start_offset) - 1
+        high = len(self._segments)
+        while low < high:
+            middle = (low + high) // 2
+            segment = self._segments[middle]
+            if segment.count and segment.last_timestamp_ns >= timestamp_ns:
+                high = middle
+            else:
+                low = middle + 1
+        if low == len(self._segments):
+            return self.end_offset
+        segment = self._segments[low]
+        first, last = max(0, self.start_offset - segment.base_offset), segment.count
+        while first < last:
+            middle = (first + last) // 2
+            if segment.entry(middle)[1] >= timestamp_ns:
+                last = middle
+            else:
+                first = middle + 1
+        return segment.base_offset + first
+
+    def trim(self, offset: int) -> int:
+        """
+        Discard every message below offset. Disk space is reclaimed a whole
+        segment at a time.
+
+        Returns:
+            Number of messages discarded
+        """
+        offset = min(offset, self.end_offset)
+        if offset <= self.start_offset:
+            return 0
+        discarded = offset - self.start_offset
+        self.start_offset = offset
+        while len(self._segments) > 1 and self._segments[0].end_offset <= offset:
+            self._drop_oldest()
+        return discarded
+
+    def expire(self, cutoff_ns: int) -> int:
+        """
+        Delete sealed segments whose newest message was published before cutoff_ns.
+
+        Returns:
+            Number of messages discarded
+        """
+        discarded = 0
+        while len(self._segments) > 1 and self._segments[0].last_timestamp_ns < cutoff_ns:
+            end = self._segments[0].end_offset
+            discarded += max(0, end - self.start_offset)
+            self.start_offset = max(self.start_offset, end)
+            self._drop_oldest()
+        return discarded
+
+    def sync(self) -> None:
+        """Force appended records and the active index to disk."""
+        segment = self._segments[-1]
+        os.fsync(segment.writer.fileno())
+        segment.index.flush()
+        self._last_fsync = time.monotonic()
+
+    def save_cursors(self) -> None:
+        """Atomically persist the subscription cursors next to the segments."""
+        path = os.path.join(self.directory, self.CURSORS_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.cursors, f)
+            f.flush()
+            if self.fsync_policy != 'never':
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _load_cursors(self) -> Dict[str, int]:
+        """Return the last persisted subscription cursors."""
+        path = os.path.join(self.directory, self.CURSORS_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def close(self) -> None:
+        """Flush and close every segment."""
+        if self.fsync_policy != 'never':
+            self.sync()
+        for segment in self._segments:
+            segment.close()
+
+    def delete(self) -> None:
+        """Close the log and remove its directory."""
+        for segment in self._segments:
+            segment.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _add_segment(self, segment: _Segment) -> None:
+        previous = self._segments[-1] if self._segments else None
+        self._base_bytes.append(self._base_bytes[-1] + previous.size if previous else 0)
+        self._segments.append(segment)
+        self._bases.append(segment.base_offset)
+
+    def _roll(self, base_offset: int) -> _Segment:
+        """Seal the active segment and start a new one at base_offset."""
+        if self._segments and not self._segments[-1].sealed:
+            # sync() only reaches the active segment: records appended under
+            # 'always' or 'interval' must not be left unsynced in a sealed one
+            self._segments[-1].seal(sync=self.fsync_policy != 'never')
+            if self._segments[-1].count == 0:
+                self._segments.pop().delete()
+                self._bases.pop()
+                self._base_bytes.pop()
+        segment = _Segment(self.directory, base_offset)
+        segment.open_active(self.index_capacity)
+        self._add_segment(segment)
+        return segment
+
+    def _drop_oldest(self) -> None:
+        self._segments.pop(0).delete()
+        self._bases.pop(0)
+        self._base_bytes.pop(0)
@@ -0,0 +1,872 @@
+#!/usr/bin/env python3
+"""Tests for the Firestore agent."""
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from .firestore_agent import FirestoreAgent
+from .firestore_backup import zstandard
+from .firestore_cache import MISS, DocumentCache, approximate_size
+from .firestore_query import Filter, Query, order_key
+from .firestore_sqlite import SQLiteStore
+from .firestore_store import DocumentStore, SortedKeyList, TransactionConflict
+from .firestore_transforms import DELETE_FIELD, SERVER_TIMESTAMP, ArrayRemove, ArrayUnion, Increment
+
+
+class TestFirestoreQueries(unittest.TestCase):
+    """Test query execution and index selection."""
+
+    def setUp(self):
+        """Initialize an agent with a small collection."""
+        self.agent = FirestoreAgent()
+        self.systems = [
+            {'name': 'alpha', 'status': 'healthy', 'agents': 7, 'tags': ['core', 'gpu']},
+            {'name': 'beta', 'status': 'degraded', 'agents': 3, 'tags': ['edge']},
+            {'name': 'gamma', 'status': 'healthy', 'agents': 12, 'tags': ['core']},
+            {'name': 'delta', 'status': 'healthy', 'agents': 1, 'stats': {'count': 4}},
+            {'name': 'epsilon', 'status': 'offline'}
+        ]
+        for system in self.systems:
+            self.agent.add_document('systems', dict(system), document_id=system['name'])
+
+    def names(self, documents):
+        return [document['name'] for document in documents]
+
+    def test_get_documents_filters(self):
+        """Test equality, range, in and array-contains filters."""
+        self.assertEqual(sorted(self.names(self.agent.get_documents(
+            'systems', [('status', '==', 'healthy')]))), ['alpha', 'delta', 'gamma'])
+        self.assertEqual(sorted(self.names(self.agent.get_documents('systems', [('agents', '>=', 7)]))),
+                         ['alpha', 'gamma'])
+        self.assertEqual(sorted(self.names(self.agent.get_documents(
+            'systems', [('status', 'in', ['degraded', 'offline'])]))), ['beta', 'epsilon'])
+        self.assertEqual(sorted(self.names(self.agent.get_documents(
+            'systems', [('tags', 'array-contains', 'core')]))), ['alpha', 'gamma'])
+        self.assertEqual(self.names(self.agent.get_documents('systems', [('stats.count', '==', 4)])),
+                         ['delta'])
+        self.assertEqual(len(self.agent.get_documents('systems', limit=2)), 2)
+
+    def test_query_documents_order_and_limit(self):
+        """Test order_by, limit and exclusion of documents missing the order field."""
+        results = self.agent.query_documents('systems', {
+            'where': [{'field': 'status', 'operator': '==', 'value': 'healthy'}],
+            'order_by': [{'field': 'agents', 'direction': 'desc'}],
+            'limit': 2
+        })
+        self.assertEqual(self.names(results), ['gamma', 'alpha'])
+
+        results = self.agent.query_documents('systems', {'order_by': [{'field': 'agents'}]})
+        self.assertEqual(self.names(results), ['delta', 'beta', 'alpha', 'gamma'])
+
+    def test_composite_index_serves_query(self):
+        """Test that a composite index is chosen and returns ordered results."""
+        index = self.agent.create_index('systems', [('status', 'asc'), ('agents', 'desc')])
+        query = Query([Filter('status', '==', 'healthy'), Filter('agents', '<', 10)],
+                      [('agents', 'desc')], limit=5)
+
+        self.assertEqual(self.agent.db.explain('systems', query), index)
+        self.assertEqual(self.names(d for _, d in self.agent.db.query('systems', query)),
+                         ['alpha', 'delta'])
+        self.assertEqual(self.agent.create_index('systems', [('status', 'asc'), ('agents', 'desc')]),
+                         index)
+
+    def test_index_follows_writes(self):
+        """Test that updates and deletes keep indexes current."""
+        self.agent.create_index('systems', [('agents', 'asc')])
+        self.agent.update_document('systems', 'beta', {'agents': 20})
+        self.agent.delete_document('systems', 'gamma')
+
+        results = self.agent.query_documents('systems', {'order_by': [{'field': 'agents'}]})
+        self.assertEqual(self.names(results), ['delta', 'alpha', 'beta'])
+        self.assertEqual(self.agent.get_stats()['indexes'], 1)
+
+    def test_invalid_operator(self):
+        """Test that unknown operators are rejected."""
+        with self.assertRaises(ValueError):
+            self.agent.get_documents('systems', [('agents', '~=', 1)])
+
+
+class TestFirestoreCache(unittest.TestCase):
+    """Test the TTL/LRU document cache."""
+
+    def setUp(self):
+        """Initialize a cache on a manual clock."""
+        self.now = 0.0
+        self.cache = DocumentCache(max_entries=3, max_bytes=None, ttl=10, negative_ttl=2,
+                                   clock=lambda: self.now)
+
+    def test_entries_expire(self):
+        """Test that documents and misses expire after their TTLs."""
+        self.cache.put('c/a', {'n': 1})
+        self.cache.put_missing('c/b')
+        self.now = 1
+        self.assertIsNone(self.cache.get('c/b'))
+        self.now = 5
+        self.assertEqual(self.cache.get('c/a'), {'n': 1})
+        self.assertIs(self.cache.get('c/b'), MISS)
+        self.now = 10
+        self.assertIs(self.cache.get('c/a'), MISS)
+
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['negative_hits'], stats['misses']), (1, 1, 2))
+        self.assertEqual(stats['expirations'], 2)
+
+    def test_lru_eviction_by_count_and_bytes(self):
+        """Test that the least recently read entries are evicted first."""
+        for key in ('c/a', 'c/b', 'c/c'):
+            self.cache.put(key, {'key': key})
+        self.cache.get('c/a')
+        self.cache.put('c/d', {'key': 'c/d'})
+        self.assertNotIn('c/b', self.cache)
+        self.assertIn('c/a', self.cache)
+
+        small = DocumentCache(max_entries=100, max_bytes=1000)
+        for i in range(20):
+            small.put(f"c/{i}", {'payload': 'x' * 100})
+        self.assertLessEqual(small.get_stats()['bytes'], 1000)
+        self.assertGreater(small.get_stats()['evictions'], 0)
+        self.assertIn('c/19', small)
+
+    def test_bulk_reads_coalesce_misses(self):
+        """Test that bulk reads answer hits from the cache and fetch all misses in one call."""
+        agent = FirestoreAgent()
+        for name in ('a', 'b', 'c'):
+            agent.add_document('systems', {'name': name}, document_id=name)
+        agent.add_document('users', {'name': 'u'}, document_id='u1')
+        agent.cache.clear()
+        agent.get_document('systems', 'a')
+
+        calls = []
+        get_many = agent.db.get_many
+        agent.db.get_many = lambda keys: calls.append(list(keys)) or get_many(keys)
+        documents = agent.get_documents_by_ids('systems', ['c', 'a', 'missing', 'c', 'b'])
+        self.assertEqual([d and d['name'] for d in documents], ['c', 'a', None, 'c', 'b'])
+        self.assertEqual(calls, [[('systems', 'c'), ('systems', 'missing'), ('systems', 'b')]])
+
+        documents = agent.get_all(['users/u1', '/systems/b', 'systems/missing'])
+        self.assertEqual([d and d['name'] for d in documents], ['u', 'b', None])
+        self.assertEqual(calls[1:], [[('users', 'u1')]])
+        with self.assertRaises(ValueError):
+            agent.get_all(['systems'])
+
+    def test_agent_reads_through_cache(self):
+        """Test that the agent caches reads and remembers missing documents."""
+        agent = FirestoreAgent({'cache_max_entries': 2})
+        for name in ('a', 'b', 'c'):
+            agent.add_document('systems', {'name': name}, document_id=name)
+        self.assertEqual(agent.get_stats()['cached_documents'], 2)
+        self.assertEqual(agent.get_document('systems', 'a')['name'], 'a')
+
+        self.assertIsNone(agent.get_document('systems', 'missing'))
+        self.assertIsNone(agent.get_document('systems', 'missing'))
+        agent.delete_document('systems', 'b')
+        self.assertIsNone(agent.get_document('systems', 'b'))
+        cache = agent.get_stats()['cache']
+        self.assertEqual(cache['negative_hits'], 2)
+        self.assertEqual(cache['misses'], 2)
+
+    def test_in_place_updates_keep_byte_budget(self):
+        """Test that documents growing in place are re-measured against cache_max_bytes."""
+        agent = FirestoreAgent({'cache_max_bytes': 100000})
+        agent.add_document('items', {'tags': [], 'n': 0}, document_id='a')
+        for n in range(20):
+            agent.update_document('items', 'a', {'tags': ArrayUnion([f"{n:04d}" * 250]), 'n': n})
+            agent.batch_write([{'type': 'update', 'path': 'items/a', 'data': {'n': Increment(1)}}])
+        stored = agent.db.get('items', 'a')
+        self.assertEqual(agent.cache.get_stats()['bytes'], approximate_size(stored))
+
+        for n in range(20, 200):
+            agent.update_document('items', 'a', {'tags': ArrayUnion([f"{n:04d}" * 250])})
+        self.assertGreater(approximate_size(agent.db.get('items', 'a')), 100000)
+        self.assertNotIn('items/a', agent.cache)
+        self.assertEqual(agent.cache.get_stats()['bytes'], 0)
+
+
+class TestFirestoreListeners(unittest.TestCase):
+    """Test the change feed and collection listeners."""
+
+    def setUp(self):
+        """Initialize an agent with two systems."""
+        self.agent = FirestoreAgent()
+        self.agent.add_document('systems', {'status': 'healthy', 'agents': 2}, document_id='a')
+        self.agent.add_document('systems', {'status': 'degraded', 'agents': 5}, document_id='b')
+
+    def listen(self, **kwargs):
+        events = []
+        self.agent.listen_to_collection('systems', events.append, **kwargs)
+        return events
+
+    def summary(self, events):
+        self.assertTrue(self.agent.wait_for_listeners(5))
+        return [(event['type'], event['document_id']) for event in events]
+
+    def test_snapshot_then_deltas(self):
+        """Test the initial snapshot and added/modified/removed deltas for a filtered view."""
+        events = self.listen(filters=[('status', '==', 'healthy')])
+        self.agent.update_document('systems', 'b', {'status': 'healthy'})
+        self.agent.update_document('systems', 'a', {'agents': 3})
+        self.agent.update_document('systems', 'a', {'status': 'offline'})
+        self.agent.add_document('systems', {'status': 'offline'}, document_id='c')
+        self.agent.delete_document('systems', 'b')
+
+        self.assertEqual(self.summary(events), [('added', 'a'), ('added', 'b'), ('modified', 'a'),
+                                                ('removed', 'a'), ('removed', 'b')])
+        self.assertEqual(events[2]['document']['agents'], 3)
+        self.assertEqual(events[2]['document']['status'], 'healthy')
+        tokens = [event['resume_token'] for event in events]
+        self.assertEqual(tokens, sorted(tokens))
+
+    def test_resume_receives_only_missed_changes(self):
+        """Test that a resumed listener is sent one event per document changed since its token."""
+        events = self.listen()
+        self.summary(events)
+        token = events[-1]['resume_token']
+        self.agent.stop_listener('listener_0')
+
+        self.agent.update_document('systems', 'a', {'agents': 4})
+        self.agent.update_document('systems', 'a', {'agents': 6})
+        self.agent.delete_document('systems', 'b')
+        self.agent.add_document('systems', {'status': 'healthy'}, document_id='c')
+        self.agent.add_document('systems', {'status': 'healthy'}, document_id='d')
+        self.agent.delete_document('systems', 'd')
+        self.assertEqual(len(events), 2)
+
+        resumed = self.listen(resume_token=token)
+        self.assertEqual(self.summary(resumed), [('modified', 'a'), ('removed', 'b'), ('added', 'c')])
+        self.assertEqual(resumed[0]['document']['agents'], 6)
+
+        with self.assertRaises(ValueError):
+            self.listen(resume_token=token + 100)
+        small = FirestoreAgent({'change_log_size': 2})
+        for i in range(5):
+            small.add_document('systems', {'n': i})
+        with self.assertRaises(ValueError):
+            small.listen_to_collection('systems', print, resume_token=1)
+
+    def test_stopped_listener_gets_nothing(self):
+        """Test that stop_listener detaches the listener from the feed."""
+        events = self.listen()
+        self.agent.stop_listener('listener_0')
+        self.agent.update_document('systems', 'a', {'agents': 9})
+        self.assertEqual(len(self.summary(events)), 2)
+        self.assertEqual(self.agent.get_stats()['active_listeners'], 0)
+
+
+class TestFirestoreTransactions(unittest.TestCase):
+    """Test optimistic transactions."""
+
+    def setUp(self):
+        """Initialize an agent with a counter document."""
+        self.agent = FirestoreAgent({'transaction_max_attempts': 50, 'transaction_backoff': 0.0005})
+        self.agent.add_document('counters', {'value': 0}, document_id='total')
+
+    def increment(self, document_id):
+        def callback(transaction):
+            document = transaction.get('counters', document_id) or {'value': 0}
+            transaction.set('counters', document_id, {'value': document['value'] + 1})
+            return document['value'] + 1
+        return self.agent.transaction(callback)
+
+    def test_concurrent_increments_are_serializable(self):
+        """Test that conflicting transactions retry until every increment lands."""
+        def worker(document_id):
+            for _ in range(50):
+                self.increment(document_id)
+
+        threads = [threading.Thread(target=worker, args=(document_id,))
+                   for document_id in ['total'] * 6 + ['a', 'b']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.agent.get_document('counters', 'total')['value'], 300)
+        self.assertEqual(self.agent.get_document('counters', 'a')['value'], 50)
+        stats = self.agent.get_stats()['transactions']
+        self.assertEqual((stats['committed'], stats['failed'], stats['active']), (400, 0, 0))
+
+    def test_writes_are_buffered_until_commit(self):
+        """Test that writes are invisible before commit and discarded when the callback fails."""
+        def callback(transaction):
+            transaction.update('counters', 'total', {'value': 5})
+            transaction.delete('counters', 'missing')
+            self.assertEqual(self.agent.db.get('counters', 'total')['value'], 0)
+            raise RuntimeError('abort')
+
+        with self.assertRaises(RuntimeError):
+            self.agent.transaction(callback)
+        self.assertEqual(self.agent.get_document('counters', 'total')['value'], 0)
+
+        def read_after_write(transaction):
+            transaction.set('counters', 'x', {})
+            transaction.get('counters', 'x')
+        with self.assertRaises(ValueError):
+            self.agent.transaction(read_after_write)
+
+    def test_conflict_after_last_attempt(self):
+        """Test that a transaction whose reads always change gives up with TransactionConflict."""
+        def callback(transaction):
+            transaction.get('counters', 'total')
+            self.agent.update_document('counters', 'total', {'value': 1})
+            transaction.set('counters', 'copy', {})
+
+        with self.assertRaises(TransactionConflict):
+            self.agent.transaction(callback, max_attempts=3)
+        self.assertIsNone(self.agent.get_document('counters', 'copy'))
+        self.assertEqual(self.agent.get_stats()['transactions']['conflicts'], 3)
+
+        # A document created after being read as missing is a conflict too
+        store = DocumentStore()
+        _, version = store.read('c', 'd')
+        store.set('c', 'd', {})
+        with self.assertRaises(TransactionConflict):
+            store.commit({('c', 'd'): version}, [('delete', 'c', 'd', None)])
+
+
+class TestFirestoreBatchWrite(unittest.TestCase):
+    """Test chunked, pipelined batch writes."""
+
+    def setUp(self):
+        """Initialize an agent."""
+        self.agent = FirestoreAgent()
+
+    def test_chunks_unbounded_iterables(self):
+        """Test that a generator is split into 500-op commits with one timestamp each."""
+        operations = ({'type': 'set', 'path': 'items', 'document_id': f"i{n:04d}", 'data': {'n': n}}
+                      for n in range(1200))
+        outcome = self.agent.batch_write(operations, max_in_flight=2)
+
+        self.assertTrue(outcome['success'])
+        self.assertEqual((outcome['operations'], outcome['commits']), (1200, 3))
+        self.assertEqual([result['index'] for result in outcome['results']], list(range(1200)))
+        self.assertEqual(len({result['update_time'] for result in outcome['results']}), 3)
+        self.assertEqual(self.agent.db.count('items'), 1200)
+        stored = self.agent.get_document('items', 'i0042')
+        self.assertEqual(stored['_created_at'], outcome['results'][42]['update_time'])
+
+    def test_update_and_delete_use_document_ids(self):
+        """Test document paths and IDs for update and delete, and per-op errors."""
+        self.agent.add_document('items', {'n': 1}, document_id='a')
+        self.agent.add_document('items', {'n': 2}, document_id='b')
+        outcome = self.agent.batch_write([
+            {'type': 'update', 'path': 'items/a', 'data': {'m': 5}},
+            {'type': 'delete', 'path': 'items', 'document_id': 'b'},
+            {'type': 'update', 'path': 'items', 'data': {'m': 6}},
+            {'type': 'upsert', 'path': 'items/c'},
+            {'type': 'set', 'path': 'items', 'data': {'n': 3}}
+        ])
+
+        self.assertFalse(outcome['success'])
+        self.assertEqual([result['success'] for result in outcome['results']],
+                         [True, True, False, False, True])
+        self.assertEqual(self.agent.get_document('items', 'a')['m'], 5)
+        self.assertEqual(self.agent.get_document('items', 'a')['n'], 1)
+        self.assertIsNone(self.agent.get_document('items', 'b'))
+        self.assertEqual(self.agent.db.count('items'), 2)
+
+    def test_failed_chunk_retried_per_operation(self):
+        """Test that a failing commit is retried one operation at a time."""
+        commit = self.agent.db.commit
+
+        def failing_commit(reads, writes):
+            if any(document_id == 'bad' for _, _, document_id, _ in writes):
+                raise RuntimeError('rejected')
+            return commit(reads, writes)
+        self.agent.db.commit = failing_commit
+
+        results = []
+        operations = [{'type': 'set', 'path': f"items/{name}", 'data': {}} for name in ('x', 'bad', 'y')]
+        outcome = self.agent.batch_write(operations, on_result=results.append)
+
+        self.assertEqual((outcome['failed'], outcome['commits'], outcome['results']), (1, 3, []))
+        self.assertEqual(sorted((r['document_id'], r['success']) for r in results),
+                         [('bad', False), ('x', True), ('y', True)])
+        self.assertEqual(self.agent.db.count('items'), 2)
+
+    def test_chunk_failing_partway_is_not_applied_twice(self):
+        """Test that a chunk failing on its second write is reverted before the per-operation retry."""
+        self.agent.add_document('items', {'n': 0}, document_id='a')
+        self.agent.db.create_index('items', ['m'])
+        outcome = self.agent.batch_write([
+            {'type': 'update', 'path': 'items/a', 'data': {'n': Increment(1)}},
+            {'type': 'set', 'path': 'items/b', 'data': {'m': {1: 1, 'a': 2}}}  # Map keys that cannot be ordered
+        ])
+
+        self.assertEqual([result['success'] for result in outcome['results']], [True, False])
+        self.assertEqual(self.agent.get_document('items', 'a')['n'], 1)
+        self.assertIsNone(self.agent.get_document('items', 'b'))
+
+    def test_store_commit_is_all_or_nothing(self):
+        """Test that a failed commit leaves documents, indexes, versions and listeners untouched."""
+        changes = []
+        store = DocumentStore(on_change=lambda *change: changes.append(change))
+        store.create_index('items', ['m'])
+        store.set('items', 'a', {'m': 1, 'tags': ['x'], 'stats': {'count': 1}})
+        store.set('items', 'c', {'m': 3})
+        version = store.version('items', 'a')
+        del changes[:]
+
+        with self.assertRaises(TypeError):
+            store.commit({}, [
+                ('update', 'items', 'a', {'m': 5, 'tags': ArrayUnion(['y']), 'stats.count': Increment(1)}),
+                ('delete', 'items', 'c', None),
+                ('set', 'items', 'd', {'m': 4}),
+                ('set', 'items', 'b', {'m': {1: 1, 'a': 2}})
+            ])
+
+        self.assertEqual(store.get('items', 'a'), {'m': 1, 'tags': ['x'], 'stats': {'count': 1}})
+        self.assertEqual(store.version('items', 'a'), version)
+        self.assertEqual((store.count('items'), store.get('items', 'd')), (2, None))
+        ordered = Query(order_by=[('m', 'asc')])
+        self.assertEqual([document_id for document_id, _ in store.query('items', ordered)], ['a', 'c'])
+        self.assertEqual(changes, [])
+
+
+class TestFirestoreBackup(unittest.TestCase):
+    """Test streaming export and import."""
+
+    def setUp(self):
+        """Initialize an agent with small pages and checkpoint intervals."""
+        self.config = {'backup_page_size': 5, 'backup_checkpoint_interval': 10, 'batch_size': 4}
+        self.agent = FirestoreAgent(self.config)
+        for n in range(37):
+            self.agent.add_document('items', {'n': n, 'tags': ['x'] * (n % 3)}, document_id=f"i{n:02d}")
+        self.agent.add_document('other', {'n': -1})
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'items.export')
+        self.checkpoint = os.path.join(self.directory.name, 'items.checkpoint')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip_formats(self):
+        """Test every format and compression through a file and back."""
+        compressions = [None, 'gzip'] + (['zstd'] if zstandard is not None else [])
+        for format in ('ndjson', 'binary'):
+            for compression in compressions:
+                summary = self.agent.export_to_file('items', self.path, format, compression)
+                self.assertEqual(summary['documents'], 37)
+                with open(self.path, 'rb') as f:
+                    self.assertEqual(f.read(), b''.join(self.agent.iter_export('items', format, compression)))
+
+                restored = FirestoreAgent(self.config)
+                summary = restored.import_from_file('items', self.path, format, compression)
+                self.assertEqual(summary['documents'], 37)
+                self.assertEqual(restored.db.items('items'), self.agent.db.items('items'))
+
+        text = self.agent.export_collection('items', 'ndjson')
+        self.assertEqual(len(text.splitlines()), 37)
+        restored = FirestoreAgent()
+        restored.import_collection('items', text, 'ndjson')
+        self.assertEqual(restored.get_document('items', 'i07'), self.agent.get_document('items', 'i07'))
+        with self.assertRaises(ValueError):
+            self.agent.iter_export('items', 'csv')
+
+    def test_interrupted_export_resumes(self):
+        """Test that a rerun continues from the checkpoint and yields the same file."""
+        scan, calls = self.agent.db.scan, []
+
+        def failing_scan(*args):
+            calls.append(args)
+            if len(calls) == 5:
+                raise IOError('interrupted')
+            return scan(*args)
+        self.agent.db.scan = failing_scan
+        with self.assertRaises(IOError):
+            self.agent.export_to_file('items', self.path, 'binary', 'gzip', self.checkpoint)
+        self.assertTrue(os.path.exists(self.checkpoint))
+
+        summary = self.agent.export_to_file('items', self.path, 'binary', 'gzip', self.checkpoint)
+        self.assertTrue(summary['resumed'])
+        self.assertEqual(summary['documents'], 37)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b''.join(self.agent.iter_export('items', 'binary', 'gzip')))
+
+    def test_interrupted_import_resumes(self):
+        """Test that a rerun skips the records committed before the interruption."""
+        self.agent.export_to_file('items', self.path)
+        restored = FirestoreAgent(self.config)
+        commit, calls = restored.db.commit, []
+
+        def failing_commit(reads, writes):
+            calls.append(writes)
+            if len(calls) == 4:
+                raise IOError('interrupted')
+            return commit(reads, writes)
+        restored.db.commit = failing_commit
+        with self.assertRaises(IOError):
+            restored.import_from_file('items', self.path, checkpoint_path=self.checkpoint)
+
+        summary = restored.import_from_file('items', self.path, checkpoint_path=self.checkpoint)
+        self.assertEqual((summary['records'], summary['documents']), (37, 25))
+        self.assertEqual(restored.db.items('items'), self.agent.db.items('items'))
+
+    def test_corrupt_binary_record(self):
+        """Test that damaged binary records are rejected."""
+        self.agent.export_to_file('items', self.path, 'binary')
+        with open(self.path, 'r+b') as f:
+            f.seek(12)
+            f.write(b'#')
+        with self.assertRaises(ValueError):
+            FirestoreAgent().import_from_file('items', self.path, 'binary')
+
+
+class TestFirestoreSQLiteStore(unittest.TestCase):
+    """Test the SQLite storage backend."""
+
+    def setUp(self):
+        """Initialize a temporary database path."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = {'storage_mode': 'sqlite',
+                       'storage_path': os.path.join(self.directory.name, 'db', 'firestore.db')}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_data_survives_restart(self):
+        """Test that documents, indexes and versions persist across agents."""
+        agent = FirestoreAgent(self.config)
+        agent.add_document('systems', {'status': 'healthy', 'agents': 3}, document_id='a')
+        agent.add_document('systems', {'status': 'healthy', 'agents': 9}, document_id='b')
+        agent.update_document('systems', 'a', {'agents': 4})
+        agent.batch_write([{'type': 'delete', 'path': 'systems/b'}])
+        index = agent.create_index('systems', [('status', 'asc'), ('agents', 'desc')])
+        version = agent.db.version('systems', 'a')
+        agent.shutdown()
+
+        agent = FirestoreAgent(self.config)
+        self.assertEqual(agent.get_document('systems', 'a')['agents'], 4)
+        self.assertIsNone(agent.get_document('systems', 'b'))
+        self.assertEqual(agent.db.list_indexes(), [index])
+        query = Query([Filter('status', '==', 'healthy')], [('agents', 'desc')], limit=1)
+        self.assertEqual(agent.db.explain('systems', query), index)
+        self.assertEqual([document_id for document_id, _ in agent.db.query('systems', query)], ['a'])
+        agent.update_document('systems', 'a', {'agents': 5})
+        self.assertGreater(agent.db.version('systems', 'a'), version)
+        agent.shutdown()
+
+    def test_queries_match_memory_store(self):
+        """Test randomized queries against the in-memory store."""
+        rng = random.Random(11)
+        sqlite, memory = SQLiteStore(':memory:'), DocumentStore()
+        sqlite.create_index('c', [('a', 'asc'), ('b', 'desc')])
+        for i in range(300):
+            document = {'a': rng.randrange(5), 'b': rng.choice([rng.randrange(50), 'x', None, True, 2.5]),
+                        't': rng.sample(range(6), rng.randrange(3)), 'm': {'n': rng.randrange(4)}}
+            if rng.random() < 0.1:
+                del document['a']
+            sqlite.set('c', f"d{i:03d}", document)
+            memory.set('c', f"d{i:03d}", document)
+
+        queries = [
+            Query([Filter('a', '==', 2)], [('b', 'desc')], limit=10),
+            Query([Filter('a', 'in', [1, 3]), Filter('b', '>', 10)], [('b', 'desc')], limit=7),
+            Query([Filter('b', '>=', 20), Filter('b', '<', 30)], [('b', 'asc')]),
+            Query([Filter('b', '==', True)]),
+            Query([Filter('b', '<=', None)]),
+            Query([Filter('t', 'array-contains', 4)], [('b', 'asc')], limit=5),
+            Query([Filter('t', 'array-contains-any', [0, 5]), Filter('b', '==', 'x')]),
+            Query([Filter('m.n', '!=', 2), Filter('a', 'not-in', [0, 1])], [('a', 'asc')], limit=20),
+            Query([], [('b', 'asc')], limit=15)
+        ]
+        for query in queries:
+            self.assertEqual(sqlite.query('c', query), memory.query('c', query), query.filters)
+        self.assertEqual(sqlite.explain('c', queries[0]), 'index_c_a_asc_b_desc')
+        self.assertEqual(sqlite.scan('c', 'd100', 3), memory.scan('c', 'd100', 3))
+        keys = [('c', 'd007'), ('x', 'd007'), ('c', 'nope'), ('c', 'd007')]
+        self.assertEqual(sqlite.get_many(keys), memory.get_many(keys))
+
+        with self.assertRaises(TransactionConflict):
+            sqlite.commit({('c', 'd000'): 0}, [('delete', 'c', 'd000', None)])
+        self.assertEqual(sqlite.count('c'), 300)
+
+
+class TestFirestoreFieldPaths(unittest.TestCase):
+    """Test dotted field-path updates, server transforms and field masks."""
+
+    def setUp(self):
+        """Initialize an agent with one nested document."""
+        self.agent = FirestoreAgent()
+        self.agent.add_document('systems', {'name': 'alpha', 'stats': {'count': 1, 'errors': 0},
+                                            'tags': ['core']}, document_id='alpha')
+
+    def test_dotted_paths_update_nested_fields(self):
+        """Test that a field path writes one nested field and keeps its siblings."""
+        self.agent.update_document('systems', 'alpha', {'stats.count': 5, 'owner.team': 'infra'})
+        document = self.agent.get_document('systems', 'alpha')
+        self.assertEqual(document['stats'], {'count': 5, 'errors': 0})
+        self.assertEqual(document['owner'], {'team': 'infra'})
+        self.assertEqual(self.agent.get_documents('systems', [('stats.count', '==', 5)])[0]['name'], 'alpha')
+
+    def test_transforms(self):
+        """Test increment, arrayUnion, arrayRemove, serverTimestamp and field deletes."""
+        self.agent.update_document('systems', 'alpha', {'stats.count': Increment(2), 'hits': Increment(1.5),
+                                                        'tags': ArrayUnion(['gpu', 'core', 'gpu']),
+                                                        'stats.errors': DELETE_FIELD,
+                                                        'checked_at': SERVER_TIMESTAMP})
+        document = self.agent.get_document('systems', 'alpha')
+        self.assertEqual(document['stats'], {'count': 3})
+        self.assertEqual(document['hits'], 1.5)
+        self.assertEqual(document['tags'], ['core', 'gpu'])
+        self.assertEqual(document['checked_at'], document['_updated_at'])
+        self.agent.update_document('systems', 'alpha', {'tags': ArrayRemove(['core', 'edge'])})
+        self.assertEqual(self.agent.get_document('systems', 'alpha')['tags'], ['gpu'])
+        with self.assertRaises(ValueError):
+            Increment('1')
+
+    def test_transforms_on_set_and_missing_documents(self):
+        """Test that transforms on absent fields start from nothing."""
+        self.agent.update_document('systems', 'beta', {'stats.count': Increment(3), 'tags': ArrayRemove(['x'])})
+        self.assertEqual(self.agent.get_document('systems', 'beta')['stats'], {'count': 3})
+        self.assertEqual(self.agent.get_document('systems', 'beta')['tags'], [])
+        self.agent.update_document('systems', 'beta', {'count': Increment(4), 'gone': DELETE_FIELD},
+                                   merge=False)
+        document = self.agent.get_document('systems', 'beta')
+        self.assertEqual(document['count'], 4)
+        self.assertNotIn('gone', document)
+        self.assertNotIn('stats', document)
+
+    def test_updates_do_not_alias_caller_data(self):
+        """Test that in-place updates never reach objects the caller passed or read."""
+        tags = ['core']
+        self.agent.update_document('systems', 'alpha', {'tags': tags})
+        before = self.agent.db.read('systems', 'alpha')[0]
+        self.agent.update_document('systems', 'alpha', {'tags': ArrayUnion(['gpu']), 'stats.count': 9})
+        self.assertEqual(tags, ['core'])
+        self.assertEqual(before['tags'], ['core'])
+        self.assertEqual(before['stats']['count'], 1)
+
+        item = {'k': 1}
+        union = ArrayUnion([item])
+        self.agent.update_document('systems', 'alpha', {'items': union})
+        self.agent.batch_write([{'type': 'update', 'path': f"systems/{name}", 'data': {'items': union}}
+                                for name in ('beta', 'gamma')])
+        item['k'] = 999
+        stored = [self.agent.db.get('systems', name)['items'][0] for name in ('alpha', 'beta', 'gamma')]
+        self.assertEqual(stored, [{'k': 1}] * 3)
+        stored[1]['k'] = 2
+        self.assertEqual(self.agent.db.get('systems', 'gamma')['items'], [{'k': 1}])
+
+    def test_indexes_follow_nested_updates(self):
+        """Test that an index on a top-level map field is maintained by field-path updates."""
+        self.agent.create_index('systems', [('stats', 'asc')])
+        self.agent.update_document('systems', 'alpha', {'stats.count': Increment(1)})
+        self.assertEqual(self.agent.get_documents('systems', [('stats', '==', {'count': 2, 'errors': 0})])[0]['name'],
+                         'alpha')
+        self.assertEqual(self.agent.get_documents('systems', [('stats', '==', {'count': 1, 'errors': 0})]), [])
+
+    def test_field_masks(self):
+        """Test that reads return only the masked fields, keeping their nesting."""
+        mask = ['name', 'stats.count', 'missing.field']
+        expected = {'name': 'alpha', 'stats': {'count': 1}}
+        self.assertEqual(self.agent.get_document('systems', 'alpha', field_mask=mask), expected)
+        self.assertEqual(self.agent.get_documents_by_ids('systems', ['alpha', 'nope'], field_mask=mask),
+                         [expected, None])
+        self.assertEqual(self.agent.get_all(['systems/alpha'], field_mask=mask), [expected])
+        self.assertEqual(self.agent.get_documents('systems', field_mask=mask), [expected])
+        self.assertEqual(self.agent.query_documents('systems', {'select': mask}), [expected])
+        self.assertEqual(self.agent.get_document('systems', 'alpha', field_mask=[]), {})
+        self.assertIn('tags', self.agent.get_document('systems', 'alpha'))
+        masked = self.agent.get_document('systems', 'alpha', field_mask=['tags'])
+        masked['tags'].append('edge')
+        self.assertEqual(self.agent.get_document('systems', 'alpha')['tags'], ['core'])
+
+    def test_sqlite_backend_applies_field_paths(self):
+        """Test that the SQLite store applies field paths and transforms the same way."""
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteStore(os.path.join(directory, 'firestore.db'))
+            store.set('systems', 'alpha', {'stats': {'count': 1}, 'tags': ['core']})
+            store.commit({}, [('update', 'systems', 'alpha', {'stats.count': Increment(2),
+                                                               'tags': ArrayUnion(['gpu']),
+                                                               'seen': SERVER_TIMESTAMP})])
+            document = store.get('systems', 'alpha')
+            self.assertEqual(document['stats'], {'count': 3})
+            self.assertEqual(document['tags'], ['core', 'gpu'])
+            self.assertIsInstance(document['seen'], str)
+            store.close()
+
+
+class TestFirestoreCursors(unittest.TestCase):
+    """Test query cursors and streaming."""
+
+    def setUp(self):
+        """Initialize an agent with a collection that has many ties."""
+        rng = random.Random(5)
+        self.agent = FirestoreAgent()
+        for n in range(300):
+            document = {'n': n, 'status': rng.choice(['healthy', 'degraded']), 'agents': rng.randrange(10)}
+            if n % 17 == 0:
+                del document['agents']
+            self.agent.db.set('systems', f"s{rng.randrange(10 ** 6):06d}-{n}", document)
+
+    def expected(self, store, query):
+        """Every match in order_by then document ID order."""
+        matched = [(document_id, document) for document_id, document in store.items('systems')
+                   if query.matches(document)]
+        return [document_id for document_id, _ in query.sort(matched)]
+
+    def page_through(self, store, filters, order_by, page_size):
+        """Document IDs from paging a query with start_after cursors."""
+        ids, cursor = [], None
+        while True:
+            query = Query(filters, order_by, page_size, start_after=cursor)
+            page = store.query('systems', query)
+            ids += [document_id for document_id, _ in page]
+            if len(page) < page_size:
+                return ids
+            cursor = query.continuation(*page[-1])
+
+    def test_pages_match_full_order_on_every_plan(self):
+        """Test cursor paging against a sorted scan, with and without indexes."""
+        stores = [self.agent.db]
+        for fields in ([('agents', 'asc')], [('agents', 'desc')], [('status', 'asc'), ('agents', 'asc')],
+                       [('status', 'asc'), ('agents', 'desc'), ('n', 'asc')]):
+            store = DocumentStore()
+            store.create_index('systems', fields)
+            for document_id, document in self.agent.db.items('systems'):
+                store.set('systems', document_id, document)
+            stores.append(store)
+        sqlite = SQLiteStore(':memory:')
+        sqlite.create_index('systems', [('status', 'asc'), ('agents', 'desc')])
+        for document_id, document in self.agent.db.items('systems'):
+            sqlite.set('systems', document_id, document)
+        stores.append(sqlite)
+
+        queries = [
+            ([], []),
+            ([], [('agents', 'asc')]),
+            ([], [('agents', 'desc')]),
+            ([Filter('status', '==', 'healthy')], [('agents', 'desc')]),
+            ([Filter('status', '==', 'healthy')], [('status', 'asc'), ('agents', 'asc')]),
+            ([Filter('agents', '>=', 3)], [('agents', 'asc')]),
+            ([Filter('status', '==', 'degraded')], [])
+        ]
+        for store in stores:
+            for filters, order_by in queries:
+                expected = self.expected(store, Query(filters, order_by))
+                for page_size in (4, 500):
+                    self.assertEqual(self.page_through(store, filters, order_by, page_size), expected,
+                                     (store, filters, order_by, page_size))
+        sqlite.close()
+
+    def test_value_and_document_cursors(self):
+        """Test partial value cursors, end_before and document ID cursors."""
+        config = {'order_by': [{'field': 'agents', 'direction': 'desc'}], 'limit': 1000}
+        everything = self.agent.query_documents('systems', config)
+        after = self.agent.query_documents('systems', dict(config, start_after=[5], end_before=[2]))
+        self.assertEqual([d['n'] for d in after], [d['n'] for d in everything if 2 < d['agents'] < 5])
+
+        ids = [document_id for document_id, _ in self.agent.db.items('systems')]
+        page = self.agent.get_documents('systems', limit=3, start_after=ids[10])
+        self.assertEqual([d['n'] for d in page], [self.agent.db.get('systems', i)['n'] for i in ids[11:14]])
+        self.assertEqual(len(self.agent.get_documents('systems', limit=1000, end_before=[ids[10]])), 10)
+
+        with self.assertRaises(ValueError):
+            self.agent.get_documents('systems', start_after='missing')
+        with self.assertRaises(ValueError):
+            self.agent.query_documents('systems', dict(config, start_after=[1, 2, 3]))
+        with self.assertRaises(ValueError):
+            self.agent.query_documents('systems', dict(config, start_after=[]))
+
+    def test_stream_pages_lazily(self):
+        """Test that stream() reads only the pages consumed and honours the overall limit."""
+        config = {'where': [{'field': 'status', 'operator': '==', 'value': 'healthy'}],
+                  'order_by': [{'field': 'n', 'direction': 'asc'}]}
+        expected = [d['n'] for d in self.agent.query_documents('systems', dict(config, limit=1000))]
+        queries = []
+        original = self.agent.db.query
+        self.agent.db.query = lambda collection, query: queries.append(query) or original(collection, query)
+
+        stream = self.agent.stream('systems', config, page_size=10, prefetch=0)
+        self.assertEqual(next(stream)['n'], expected[0])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([d['n'] for d in stream], expected[1:])
+        self.assertEqual(max(query.limit for query in queries), 10)
+
+        self.assertEqual([d['n'] for d in self.agent.stream('systems', dict(config, limit=25), page_size=10)],
+                         expected[:25])
+        self.assertEqual(list(self.agent.stream('systems', dict(config, select=['n']), page_size=7,
+                                                prefetch=3))[:2], [{'n': n} for n in expected[:2]])
+        with self.assertRaises(ValueError):
+            self.agent.stream('systems', page_size=0)
+
+    def test_stream_prefetch_stops_with_the_consumer(self):
+        """Test that abandoning a prefetching stream ends its reader thread."""
+        stream = self.agent.stream('systems', page_size=5, prefetch=2)
+        next(stream)
+        stream.close()
+        deadline = time.monotonic() + 5
+        while any(thread.name == 'firestore-stream-prefetch' for thread in threading.enumerate()):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+
+class TestFirestoreIndexes(unittest.TestCase):
+    """Test the sorted index structures against collection scans."""
+
+    def test_sorted_key_list(self):
+        """Test inserts, removals and range scans across chunks."""
+        keys = SortedKeyList()
+        keys.LOAD = 4
+        values = list(range(100))
+        random.Random(1).shuffle(values)
+        for value in values:
+            keys.add(value)
+        for value in range(0, 100, 3):
+            self.assertTrue(keys.discard(value))
+        self.assertFalse(keys.discard(3))
+
+        expected = [v for v in range(100) if v % 3]
+        self.assertEqual(list(keys), expected)
+        self.assertEqual(list(keys.irange(10, 30)), [v for v in expected if 10 <= v < 30])
+        self.assertEqual(list(keys.irange(10, 30, reverse=True)),
+                         [v for v in reversed(expected) if 10 <= v < 30])
+        self.assertEqual(list(keys.irange(200, 300)), [])
+
+    def test_mixed_type_ordering(self):
+        """Test Firestore's cross-type ordering and numeric equality."""
+        values = ['a', 2.5, None, True, [1], {'k': 1}, b'x', 1]
+        ordered = sorted(values, key=order_key)
+        self.assertEqual(ordered, [None, True, 1, 2.5, 'a', b'x', [1], {'k': 1}])
+        self.assertEqual(order_key(1), order_key(1.0))
+
+    def test_indexed_queries_match_scans(self):
+        """Test randomized queries against a store without indexes."""
+        rng = random.Random(7)
+        indexed, plain = DocumentStore(), DocumentStore()
+        indexed.create_index('c', [('a', 'asc'), ('b', 'desc')])
+        indexed.create_index('c', [('b', 'asc')])
+        indexed.create_index('c', [('t', 'array-contains'), ('b', 'asc')])
+        for i in range(300):
+            document = {'a': rng.randrange(5), 'b': rng.choice([rng.randrange(50), 'x', None]),
+                        't': rng.sample(range(6), rng.randrange(3))}
+            if rng.random() < 0.1:
+                del document['a']
+            indexed.set('c', f"d{i:03d}", document)
+            plain.set('c', f"d{i:03d}", document)
+
+        queries = [
+            Query([Filter('a', '==', 2)], [('b', 'desc')], limit=10),
+            Query([Filter('a', 'in', [1, 3]), Filter('b', '>', 10)], [('b', 'desc')], limit=7),
+            Query([Filter('b', '>=', 20), Filter('b', '<', 30)], [('b', 'asc')]),
+            Query([Filter('b', '<=', 5)], [('b', 'desc')], limit=3),
+            Query([Filter('t', 'array-contains', 4)], [('b', 'asc')], limit=5),
+            Query([Filter('t', 'array-contains-any', [0, 5]), Filter('b', '==', 'x')]),
+            Query([], [('b', 'asc')], limit=15)
+        ]
+        for query in queries:
+            self.assertIsNotNone(indexed.explain('c', query), query.filters)
+            if query.order_by:
+                # Ties on the order field may come back in any order
+                key = lambda item: [order_key(item[1].get(f)) for f, _ in query.order_by]
+                self.assertEqual([key(item) for item in indexed.query('c', query)],
+                                 [key(item) for item in plain.query('c', query)], query.filters)
+            else:
+                self.assertEqual(sorted(indexed.query('c', query)), sorted(plain.query('c', query)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,1007 @@
+"""Tests for the Pub/Sub agent."""
+
+import asyncio
+import base64
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from .pubsub_agent import DedupWindow, FlowControlError, PubSubAgent
+from .pubsub_emulator import PubSubEmulator
+from .pubsub_filter import FilterIndex, compile_filter
+from .pubsub_message import PubSubMessage
+from .pubsub_metrics import LatencyHistogram, RateWindow
+from .pubsub_storage import SegmentLog
+
+
+class TestPubSubFanOut(unittest.TestCase):
+    """Test per-subscription cursors over the shared topic log."""
+    
+    def setUp(self):
+        """Initialize a topic with two subscriptions."""
+        self.agent = PubSubAgent()
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub-a', 'events')
+        self.agent.create_subscription('sub-b', 'events')
+    
+    def test_every_subscription_receives_every_message(self):
+        """Test that pulling on one subscription does not consume for others."""
+        ids = [self.agent.publish_message('events', {'n': i}) for i in range(5)]
+        
+        pulled_a = self.agent.pull_messages('sub-a', max_messages=10)
+        pulled_b = self.agent.pull_messages('sub-b', max_messages=10)
+        
+        self.assertEqual([m['message_id'] for m in pulled_a], ids)
+        self.assertEqual([m['message_id'] for m in pulled_b], ids)
+        self.assertEqual(self.agent.pull_messages('sub-a'), [])
+    
+    def test_messages_stored_once_per_topic(self):
+        """Test that fan-out shares one stored copy."""
+        self.agent.publish_message('events', {'n': 1})
+        
+        msg_a = self.agent.pull_messages('sub-a')[0]
+        msg_b = self.agent.pull_messages('sub-b')[0]
+        self.assertIs(msg_a, msg_b)
+    
+    def test_retention_trimmed_past_slowest_cursor(self):
+        """Test that the log keeps messages until the slowest reader passes them."""
+        for i in range(4):
+            self.agent.publish_message('events', {'n': i})
+        
+        self.agent.pull_messages('sub-a', max_messages=4)
+        self.assertEqual(self.agent.get_topic_stats('events')['queue_size'], 4)
+        
+        self.agent.pull_messages('sub-b', max_messages=3)
+        self.assertEqual(self.agent.get_topic_stats('events')['queue_size'], 1)
+        self.assertEqual(self.agent.get_subscription_stats('sub-b')['backlog'], 1)
+        
+        self.agent.delete_subscription('sub-b')
+        self.assertEqual(self.agent.get_topic_stats('events')['queue_size'], 0)
+    
+    def test_new_subscription_starts_at_log_end(self):
+        """Test that a subscription only sees messages published after creation."""
+        self.agent.publish_message('events', {'n': 1})
+        self.agent.create_subscription('sub-late', 'events')
+        self.agent.publish_message('events', {'n': 2})
+        
+        pulled = self.agent.pull_messages('sub-late')
+        self.assertEqual([m['data'] for m in pulled], ['{"n": 2}'])
+    
+    def test_recreating_topic_keeps_backlog(self):
+        """Test that create_topic on an existing topic leaves its log intact."""
+        self.agent.publish_message('events', {'n': 1})
+        self.agent.create_topic('events')
+        
+        self.assertEqual(len(self.agent.pull_messages('sub-a')), 1)
+
+
+class TestPubSubLeases(unittest.TestCase):
+    """Test ack deadlines, nacks and redelivery."""
+    
+    def setUp(self):
+        """Initialize a topic and subscription."""
+        self.agent = PubSubAgent()
+        self.agent.create_topic('events')
+    
+    def test_acked_message_is_not_redelivered(self):
+        """Test that acknowledging releases the lease."""
+        self.agent.create_subscription('sub', 'events', ack_deadline_seconds=0)
+        msg_id = self.agent.publish_message('events', {'n': 1})
+        
+        self.agent.pull_messages('sub')
+        self.agent.acknowledge_messages('sub', [msg_id])
+        
+        self.assertEqual(self.agent.pull_messages('sub'), [])
+        self.assertEqual(self.agent.get_subscription_stats('sub')['message_count'], 1)
+    
+    def test_expired_lease_is_redelivered(self):
+        """Test that a message is redelivered once its ack deadline passes."""
+        self.agent.create_subscription('sub', 'events', ack_deadline_seconds=0)
+        msg_id = self.agent.publish_message('events', {'n': 1})
+        
+        first = self.agent.pull_messages('sub')
+        second = self.agent.pull_messages('sub')
+        
+        self.assertEqual(first[0]['message_id'], msg_id)
+        self.assertEqual(second[0]['message_id'], msg_id)
+    
+    def test_unexpired_lease_is_held(self):
+        """Test that an outstanding message is not handed out twice."""
+        self.agent.create_subscription('sub', 'events', ack_deadline_seconds=60)
+        self.agent.publish_message('events', {'n': 1})
+        
+        self.assertEqual(len(self.agent.pull_messages('sub')), 1)
+        self.assertEqual(self.agent.pull_messages('sub'), [])
+        self.assertEqual(self.agent.get_subscription_stats('sub')['outstanding'], 1)
+    
+    def test_nack_requeues_before_new_messages(self):
+        """Test that nacked messages go back to the ready queue."""
+        self.agent.create_subscription('sub', 'events')
+        first_id = self.agent.publish_message('events', {'n': 1})
+        self.agent.pull_messages('sub')
+        second_id = self.agent.publish_message('events', {'n': 2})
+        
+        self.agent.nack_messages('sub', [first_id])
+        pulled = self.agent.pull_messages('sub')
+        
+        self.assertEqual([m['message_id'] for m in pulled], [first_id, second_id])
+    
+    def test_dead_letter_after_max_delivery_attempts(self):
+        """Test that repeatedly nacked messages move to the dead-letter queue."""
+        self.agent.create_subscription('sub', 'events', max_delivery_attempts=2)
+        msg_id = self.agent.publish_message('events', {'n': 1})
+        
+        for _ in range(2):
+            self.agent.pull_messages('sub')
+            self.agent.nack_messages('sub', [msg_id])
+            
+        self.assertEqual(self.agent.pull_messages('sub'), [])
+        self.assertEqual(self.agent.dead_letter_queue[-1]['message']['message_id'], msg_id)
+        self.assertEqual(self.agent.dead_letter_queue[-1]['subscription'], 'sub')
+
+
+class TestPubSubDispatch(unittest.TestCase):
+    """Test asynchronous subscriber callback dispatch."""
+    
+    def setUp(self):
+        """Initialize a topic and a push subscription."""
+        self.agent = PubSubAgent()
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events')
+    
+    def tearDown(self):
+        self.agent.shutdown()
+    
+    def test_slow_callback_does_not_block_publish(self):
+        """Test that publishing returns before a slow handler finishes."""
+        release = threading.Event()
+        self.agent.subscribe('sub', lambda message: release.wait(5))
+        
+        start = time.monotonic()
+        self.agent.publish_message('events', {'n': 1})
+        self.assertLess(time.monotonic() - start, 1)
+        
+        release.set()
+        self.assertTrue(self.agent.wait_for_subscribers(timeout=5))
+    
+    def test_callbacks_receive_messages_in_order(self):
+        """Test that a subscription's callbacks see messages in publish order."""
+        received = []
+        self.agent.subscribe('sub', lambda message: received.append(message['message_id']))
+        
+        ids = [self.agent.publish_message('events', {'n': i}) for i in range(50)]
+        self.agent.wait_for_subscribers(timeout=5)
+        
+        self.assertEqual(received, ids)
+    
+    def test_callback_error_is_dead_lettered(self):
+        """Test that a raising callback records a dead-letter entry."""
+        def failing(message):
+            raise RuntimeError('boom')
+        self.agent.subscribe('sub', failing)
+        
+        self.agent.publish_message('events', {'n': 1})
+        self.agent.wait_for_subscribers(timeout=5)
+        
+        self.assertEqual(self.agent.dead_letter_queue[-1]['error'], 'boom')
+    
+    def test_full_inbox_is_dead_lettered(self):
+        """Test that a bounded inbox rejects messages instead of blocking."""
+        agent = PubSubAgent(config={'subscriber_inbox_size': 2})
+        agent.create_topic('events')
+        agent.create_subscription('sub', 'events')
+        release = threading.Event()
+        agent.subscribe('sub', lambda message: release.wait(5))
+        
+        for i in range(10):
+            agent.publish_message('events', {'n': i})
+            
+        self.assertIn('Subscriber inbox full', [e['error'] for e in agent.dead_letter_queue])
+        release.set()
+        agent.shutdown()
+    
+    def test_asyncio_backend_awaits_coroutine_callbacks(self):
+        """Test that the asyncio backend runs async handlers."""
+        agent = PubSubAgent(config={'dispatch_backend': 'asyncio'})
+        agent.create_topic('events')
+        agent.create_subscription('sub', 'events')
+        received = []
+        
+        async def handler(message):
+            await asyncio.sleep(0)
+            received.append(message['message_id'])
+        agent.subscribe('sub', handler)
+        
+        ids = [agent.publish_message('events', {'n': i}) for i in range(5)]
+        self.assertTrue(agent.wait_for_subscribers(timeout=5))
+        self.assertEqual(received, ids)
+        agent.shutdown()
+
+
+class TestPubSubOrderingKeys(unittest.TestCase):
+    """Test per-key sequential push delivery."""
+    
+    def setUp(self):
+        """Initialize a push subscription."""
+        self.agent = PubSubAgent(config={'dispatch_workers': 4})
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events')
+    
+    def tearDown(self):
+        """Stop dispatch workers."""
+        self.agent.shutdown()
+    
+    def test_same_key_in_order_different_keys_in_parallel(self):
+        """Test per-key order while keys overlap in time."""
+        seen = {'a': [], 'b': []}
+        active = set()
+        overlaps = []
+        lock = threading.Lock()
+        
+        def callback(message):
+            key = message['ordering_key']
+            with lock:
+                self.assertNotIn(key, active)
+                active.add(key)
+                if len(active) > 1:
+                    overlaps.append(key)
+            time.sleep(0.01)
+            with lock:
+                active.discard(key)
+                seen[key].append(message['data'])
+            
+        self.agent.subscribe('sub', callback)
+        for i in range(10):
+            self.agent.publish_message('events', {'n': i}, ordering_key='a')
+            self.agent.publish_message('events', {'n': i}, ordering_key='b')
+        self.assertTrue(self.agent.wait_for_subscribers(timeout=5))
+        
+        expected = [f'{{"n": {i}}}' for i in range(10)]
+        self.assertEqual(seen['a'], expected)
+        self.assertEqual(seen['b'], expected)
+        self.assertTrue(overlaps)
+    
+    def test_failed_key_pauses_until_resumed(self):
+        """Test that a failing key holds its messages while other keys flow."""
+        seen = []
+        failures = [1]
+        
+        def callback(message):
+            if message['ordering_key'] == 'a' and failures:
+                failures.pop()
+                raise RuntimeError('boom')
+            seen.append((message['ordering_key'], message['data']))
+            
+        self.agent.subscribe('sub', callback)
+        self.agent.publish_message('events', 1, ordering_key='a')
+        self.agent.publish_message('events', 2, ordering_key='a')
+        self.agent.publish_message('events', 1, ordering_key='b')
+        self.assertTrue(self.agent.wait_for_subscribers(timeout=5))
+        
+        self.assertEqual(seen, [('b', '1')])
+        self.assertEqual(self.agent.get_subscription_stats('sub')['paused_ordering_keys'], ['a'])
+        self.assertEqual(self.agent.get_global_stats()['paused_deliveries'], 2)
+        
+        self.assertTrue(self.agent.resume_ordering_key('sub', 'a'))
+        self.assertTrue(self.agent.wait_for_subscribers(timeout=5))
+        self.assertEqual(seen[1:], [('a', '1'), ('a', '2')])
+        self.assertFalse(self.agent.resume_ordering_key('sub', 'a'))
+
+
+class TestPubSubDeduplication(unittest.TestCase):
+    """Test idempotency-key deduplication on publish."""
+    
+    def setUp(self):
+        """Initialize a topic with one subscription."""
+        self.agent = PubSubAgent()
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events')
+    
+    def test_duplicate_key_is_dropped(self):
+        """Test that a republished key returns the original ID and is not delivered."""
+        first = self.agent.publish_message('events', {'n': 1}, idempotency_key='evt-1')
+        second = self.agent.publish_message('events', {'n': 1}, idempotency_key='evt-1')
+        other = self.agent.publish_message('events', {'n': 2}, idempotency_key='evt-2')
+        
+        self.assertEqual(first, second)
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('sub')], [first, other])
+        self.assertEqual(self.agent.get_global_stats()['messages_deduplicated'], 1)
+    
+    def test_duplicates_within_one_batch(self):
+        """Test deduplication between messages of the same batch."""
+        ids = self.agent.publish_batch('events', [{'n': 1}, {'n': 1}, {'n': 2}],
+                                       idempotency_keys=['a', 'a', None])
+        
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(len(self.agent.pull_messages('sub')), 2)
+    
+    def test_duplicates_need_no_capacity(self):
+        """Test that a retried publish on a full topic returns the original ID without evicting or raising."""
+        self.agent.create_topic('full', flow_control={'max_messages': 2, 'policy': 'drop_oldest'})
+        self.agent.create_subscription('full-sub', 'full')
+        ids = [self.agent.publish_message('full', {'n': 1}, idempotency_key='k'),
+               self.agent.publish_message('full', {'n': 2})]
+        
+        self.assertEqual(self.agent.publish_message('full', {'n': 1}, idempotency_key='k'), ids[0])
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('full-sub')], ids)
+        self.assertEqual(self.agent.get_global_stats()['messages_dropped'], 0)
+        
+        self.agent.create_topic('strict')
+        self.agent.create_subscription('strict-sub', 'strict',
+                                       flow_control={'max_messages': 1, 'policy': 'raise'})
+        first = self.agent.publish_message('strict', {'n': 1}, idempotency_key='k')
+        self.assertEqual(self.agent.publish_batch('strict', [{'n': 1}], idempotency_keys=['k']), [first])
+        with self.assertRaises(FlowControlError):
+            self.agent.publish_message('strict', {'n': 2}, idempotency_key='new')
+        self.agent.pull_messages('strict-sub', auto_ack=True)
+        self.assertNotEqual(self.agent.publish_message('strict', {'n': 2}, idempotency_key='new'), first)
+    
+    def test_window_expires_and_memory_is_capped(self):
+        """Test that keys expire after the window and the oldest are evicted."""
+        window = DedupWindow(window_seconds=10, max_keys=3)
+        self.assertIsNone(window.check('a', 'id-a', now=0))
+        self.assertEqual(window.check('a', 'id-x', now=5), 'id-a')
+        self.assertIsNone(window.check('a', 'id-b', now=10))
+        
+        for i in range(100):
+            window.check(f'k{i}', f'id{i}', now=11)
+        self.assertLessEqual(len(window), 3)
+
+
+class TestPubSubMessage(unittest.TestCase):
+    """Test the slotted message record."""
+    
+    def test_payload_encoded_once_and_cached(self):
+        """Test that the encoded bytes are computed lazily and shared."""
+        message = PubSubMessage(7, 1_700_000_000_123_456_789, {'n': 1})
+        data = message.data
+        
+        self.assertEqual(data, b'{"n": 1}')
+        self.assertIs(message.data, data)
+        self.assertEqual(len(message), len(data))
+    
+    def test_envelope_item_access(self):
+        """Test dict-style access to the envelope fields."""
+        message = PubSubMessage(7, 1_700_000_000_123_456_789, 'hi', {'k': 'v'}, 'key', 'events')
+        
+        self.assertEqual(message['message_id'], '7')
+        self.assertEqual(message['data'], 'hi')
+        self.assertEqual(message['attributes'], {'k': 'v'})
+        self.assertEqual(message['publish_time'], '2023-11-14T22:13:20.123456')
+        self.assertEqual(message.get('missing', 'default'), 'default')
+    
+    def test_record_roundtrip(self):
+        """Test serialization for the durable log."""
+        message = PubSubMessage(7, 123, b'\x00raw', {'k': 'v'}, 'key', 'events')
+        restored = PubSubMessage.from_record(message.to_record(), topic='events')
+        
+        self.assertEqual(restored.to_dict(), message.to_dict())
+    
+    def test_published_ids_increase(self):
+        """Test that publish returns increasing integer message IDs."""
+        agent = PubSubAgent()
+        agent.create_topic('events')
+        ids = [agent.publish_message('events', {'n': i}) for i in range(3)]
+        
+        self.assertEqual(sorted(ids, key=int), ids)
+        self.assertEqual(len(set(ids)), 3)
+
+
+class TestPubSubFlowControl(unittest.TestCase):
+    """Test topic and subscription flow-control policies."""
+    
+    def setUp(self):
+        """Initialize an agent with a short blocking timeout."""
+        self.agent = PubSubAgent(config={'flow_control_timeout_seconds': 2})
+    
+    def tearDown(self):
+        """Stop background workers."""
+        self.agent.shutdown()
+    
+    def test_drop_oldest_is_accounted(self):
+        """Test that a full topic evicts its oldest messages and counts them."""
+        self.agent.create_topic('events', flow_control={'max_messages': 3, 'policy': 'drop_oldest'})
+        self.agent.create_subscription('sub', 'events')
+        ids = [self.agent.publish_message('events', {'n': i}) for i in range(5)]
+        
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('sub')], ids[2:])
+        self.assertEqual(self.agent.get_topic_stats('events')['messages_dropped'], 2)
+        self.assertEqual(self.agent.get_global_stats()['messages_dropped'], 2)
+    
+    def test_push_subscription_has_no_drops(self):
+        """Test that trimming a topic behind a push subscription does not count as dropping."""
+        agent = PubSubAgent(config={'max_topic_backlog': 5})
+        self.addCleanup(agent.shutdown)
+        agent.create_topic('events')
+        agent.create_subscription('sub', 'events')
+        received = []
+        agent.subscribe('sub', lambda message: received.append(message['message_id']))
+        ids = [agent.publish_message('events', {'n': i}) for i in range(20)]
+        agent.wait_for_subscribers(timeout=5)
+        
+        self.assertEqual(received, ids)
+        self.assertEqual(agent.get_topic_stats('events')['messages_dropped'], 0)
+        self.assertEqual(agent.get_global_stats()['messages_dropped'], 0)
+    
+    def test_byte_limit(self):
+        """Test that byte limits evict enough messages to fit the new one."""
+        self.agent.create_topic('events', flow_control={'max_bytes': 25})
+        self.agent.create_subscription('sub', 'events')
+        for data in ('a' * 10, 'b' * 10, 'c' * 10):
+            self.agent.publish_message('events', data)
+        
+        self.assertEqual(self.agent.get_topic_stats('events')['queue_bytes'], 20)
+        self.assertEqual([m['data'] for m in self.agent.pull_messages('sub')], ['b' * 10, 'c' * 10])
+    
+    def test_raise_policy_on_subscription(self):
+        """Test that a full 'raise' subscription rejects publishes until pulled."""
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events',
+                                       flow_control={'max_messages': 2, 'policy': 'raise'})
+        self.agent.publish_message('events', {'n': 1})
+        self.agent.publish_message('events', {'n': 2})
+        
+        with self.assertRaises(FlowControlError):
+            self.agent.publish_message('events', {'n': 3})
+        self.agent.pull_messages('sub', auto_ack=True)
+        self.agent.publish_message('events', {'n': 3})
+        self.assertEqual(self.agent.get_global_stats()['messages_rejected'], 1)
+    
+    def test_block_policy_waits_for_pull(self):
+        """Test that a blocked publisher resumes once the subscriber catches up."""
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events',
+                                       flow_control={'max_messages': 2, 'policy': 'block'})
+        self.agent.publish_message('events', {'n': 1})
+        self.agent.publish_message('events', {'n': 2})
+        publisher = threading.Thread(target=self.agent.publish_message, args=('events', {'n': 3}))
+        publisher.start()
+        
+        publisher.join(0.2)
+        self.assertTrue(publisher.is_alive())
+        self.assertEqual(len(self.agent.pull_messages('sub', auto_ack=True)), 2)
+        publisher.join(2)
+        self.assertFalse(publisher.is_alive())
+        self.assertEqual(len(self.agent.pull_messages('sub')), 1)
+        self.assertEqual(self.agent.get_global_stats()['publishes_blocked'], 1)
+    
+    def test_block_policy_times_out(self):
+        """Test that blocking gives up after flow_control_timeout_seconds."""
+        self.agent.config['flow_control_timeout_seconds'] = 0.1
+        self.agent.create_topic('events', flow_control={'max_messages': 1, 'policy': 'block'})
+        self.agent.create_subscription('sub', 'events')
+        self.agent.publish_message('events', {'n': 1})
+        
+        with self.assertRaises(FlowControlError):
+            self.agent.publish_message('events', {'n': 2})
+    
+    def test_awaitable_publish(self):
+        """Test the awaitable publish waits for capacity off the event loop."""
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events',
+                                       flow_control={'max_messages': 1, 'policy': 'block'})
+        self.agent.publish_message('events', {'n': 1})
+        
+        async def publish_and_drain():
+            pending = asyncio.ensure_future(self.agent.publish_message_async('events', {'n': 2}))
+            await asyncio.sleep(0.1)
+            self.assertFalse(pending.done())
+            self.agent.pull_messages('sub', auto_ack=True)
+            return await asyncio.wait_for(pending, 2)
+            
+        message_id = asyncio.run(publish_and_drain())
+        self.assertEqual(self.agent.pull_messages('sub')[0]['message_id'], message_id)
+    
+    def test_invalid_policy_rejected(self):
+        """Test validation of flow-control settings."""
+        with self.assertRaises(ValueError):
+            self.agent.create_topic('events', flow_control={'max_messages': 1, 'policy': 'spill'})
+
+
+class TestPubSubSeek(unittest.TestCase):
+    """Test seeking subscriptions to timestamps and snapshots."""
+    
+    def setUp(self):
+        """Initialize a topic with a subscription that retains acked messages."""
+        self.agent = PubSubAgent()
+        self.agent.create_topic('system-events')
+        self.agent.create_subscription('sub', 'system-events', retain_acked_messages=True)
+    
+    def tearDown(self):
+        """Stop background workers."""
+        self.agent.shutdown()
+    
+    def test_seek_to_timestamp_replays_later_messages(self):
+        """Test that messages published at or after the timestamp are redelivered."""
+        self.agent.publish_message('system-events', {'n': 0})
+        time.sleep(0.01)
+        since = time.time()
+        later = [self.agent.publish_message('system-events', {'n': i}) for i in (1, 2)]
+        self.agent.pull_messages('sub', auto_ack=True)
+        
+        self.assertEqual(self.agent.seek('sub', timestamp=since), 2)
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('sub')], later)
+    
+    def test_seek_to_snapshot_restores_ack_state(self):
+        """Test that a snapshot redelivers what was unacked when it was taken."""
+        ids = [self.agent.publish_message('system-events', {'n': i}) for i in range(4)]
+        pulled = self.agent.pull_messages('sub', max_messages=2)
+        self.agent.acknowledge_messages('sub', [pulled[0]['message_id']])
+        self.agent.create_snapshot('before-fix', 'sub')
+        
+        self.agent.acknowledge_messages('sub', [pulled[1]['message_id']])
+        self.agent.pull_messages('sub', auto_ack=True)
+        self.agent.seek('sub', snapshot='before-fix')
+        
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('sub')], ids[1:])
+    
+    def test_snapshot_keeps_pulled_unacked_messages(self):
+        """Test that messages pulled but not acked when the snapshot was taken survive trimming."""
+        self.agent.create_topic('jobs')
+        self.agent.create_subscription('workers', 'jobs')
+        self.agent.create_subscription('audit', 'jobs')
+        ids = [self.agent.publish_message('jobs', {'n': i}) for i in range(5)]
+        self.agent.pull_messages('audit', max_messages=3, auto_ack=True)
+        pulled = self.agent.pull_messages('workers', max_messages=5)
+        self.agent.create_snapshot('in-flight', 'workers')
+        self.agent.pull_messages('audit', auto_ack=True)
+        self.agent.acknowledge_messages('workers', [m['message_id'] for m in pulled])
+        self.assertEqual(self.agent.get_topic_stats('jobs')['queue_size'], 0)
+        
+        self.assertEqual(self.agent.seek('workers', snapshot='in-flight'), 5)
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('workers')], ids)
+        
+        self.agent.delete_subscription('audit')
+        self.agent.create_snapshot('alone', 'workers')
+        self.assertEqual(self.agent.seek('workers', snapshot='alone'), 5)
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('workers')], ids)
+    
+    def test_snapshot_retains_messages(self):
+        """Test that a snapshot keeps messages a plain subscription would trim."""
+        self.agent.create_subscription('plain', 'system-events')
+        self.agent.delete_subscription('sub')
+        self.agent.create_snapshot('snap', 'plain')
+        ids = [self.agent.publish_message('system-events', {'n': i}) for i in range(3)]
+        self.agent.pull_messages('plain', auto_ack=True)
+        
+        self.assertEqual(self.agent.get_topic_stats('system-events')['queue_size'], 3)
+        self.agent.seek('plain', snapshot='snap')
+        self.assertEqual([m['message_id'] for m in self.agent.pull_messages('plain')], ids)
+        self.assertTrue(self.agent.delete_snapshot('snap'))
+    
+    def test_seek_replays_to_push_subscribers(self):
+        """Test that push callbacks receive replayed messages."""
+        received = []
+        self.agent.subscribe('sub', lambda message: received.append(message['message_id']))
+        ids = [self.agent.publish_message('system-events', {'n': i}) for i in range(3)]
+        self.agent.wait_for_subscribers(timeout=5)
+        
+        self.agent.seek('sub', timestamp=0)
+        deadline = time.time() + 5
+        while len(received) < 6 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(received, ids + ids)
+    
+    def test_seek_requires_one_target(self):
+        """Test argument validation."""
+        with self.assertRaises(ValueError):
+            self.agent.seek('sub')
+        with self.assertRaises(ValueError):
+            self.agent.seek('sub', snapshot='missing')
+
+
+class TestPubSubTelemetry(unittest.TestCase):
+    """Test latency histograms, rates and the Prometheus export."""
+    
+    def setUp(self):
+        """Initialize a topic with a pull subscription."""
+        self.agent = PubSubAgent()
+        self.agent.create_topic('system-events')
+        self.agent.create_subscription('sub', 'system-events')
+    
+    def tearDown(self):
+        """Stop background workers."""
+        self.agent.shutdown()
+    
+    def test_histogram_percentiles_within_precision(self):
+        """Test that quantiles are reported to within the bucket precision."""
+        histogram = LatencyHistogram()
+        for value in range(1, 10001):
+            histogram.record(value * 1000)
+        
+        self.assertEqual(histogram.count(), 10000)
+        for fraction in (0.5, 0.99):
+            expected = fraction * 10000 * 1000
+            self.assertLessEqual(abs(histogram.percentile(fraction) - expected) / expected, 0.0625)
+        self.assertGreaterEqual(histogram.max(), 10000 * 1000)
+        histogram.record_many([-5, 10 ** 20])
+        self.assertEqual(histogram.percentile(1.0), histogram.max_value_ns)
+    
+    def test_rate_window_slides(self):
+        """Test that rates cover complete seconds and forget old ones."""
+        window = RateWindow(max_window_seconds=10)
+        for second in range(100, 110):
+            window.add(5, now=second + 0.5)
+        
+        self.assertEqual(window.rate(10, now=110.0), 5.0)
+        self.assertEqual(window.rate(5, now=112.0), 3.0)
+        self.assertEqual(window.rate(10, now=200.0), 0.0)
+    
+    def test_pull_records_latency_and_oldest_unacked(self):
+        """Test delivery and ack latency of a pull subscription."""
+        self.agent.publish_message('system-events', {'n': 1})
+        time.sleep(0.05)
+        self.assertGreaterEqual(self.agent.get_subscription_stats('sub')['oldest_unacked_age_seconds'], 0.05)
+        
+        messages = self.agent.pull_messages('sub')
+        self.agent.acknowledge_messages('sub', [m['message_id'] for m in messages])
+        
+        stats = self.agent.get_subscription_stats('sub')
+        self.assertEqual(stats['latency']['publish_to_deliver']['count'], 1)
+        self.assertGreaterEqual(stats['latency']['publish_to_deliver']['p50_seconds'], 0.04)
+        self.assertEqual(stats['latency']['deliver_to_ack']['count'], 1)
+        self.assertEqual(stats['oldest_unacked_age_seconds'], 0.0)
+    
+    def test_push_records_callback_time(self):
+        """Test callback execution time of a push subscription."""
+        self.agent.subscribe('sub', lambda message: time.sleep(0.02))
+        for i in range(3):
+            self.agent.publish_message('system-events', {'n': i})
+        self.agent.wait_for_subscribers(timeout=5)
+        
+        callback = self.agent.get_subscription_stats('sub')['latency']['callback']
+        self.assertEqual(callback['count'], 3)
+        self.assertGreaterEqual(callback['p50_seconds'], 0.015)
+    
+    def test_export_prometheus(self):
+        """Test the text exposition of counters, gauges and summaries."""
+        self.agent.publish_message('system-events', {'n': 1})
+        self.agent.pull_messages('sub', auto_ack=True)
+        text = self.agent.export_prometheus()
+        
+        self.assertIn('# TYPE pubsub_messages_published_total counter', text)
+        self.assertIn('pubsub_messages_published_total 1\n', text)
+        self.assertIn('pubsub_topic_queue_messages{topic="system-events"} 0\n', text)
+        self.assertIn('pubsub_subscription_ack_rate{subscription="sub",topic="system-events",window="60s"}', text)
+        self.assertIn('pubsub_publish_to_deliver_seconds_count{subscription="sub",topic="system-events"} 1', text)
+        self.assertEqual(text.count('# TYPE pubsub_publish_to_deliver_seconds summary'), 1)
+
+
+class TestPubSubFilters(unittest.TestCase):
+    """Test compiled subscription filters and filter routing."""
+    
+    def test_compile_filter_expressions(self):
+        """Test evaluation of the supported filter syntax."""
+        alert_us = compile_filter('attributes.type = "alert" AND hasPrefix(attributes.region, "us")')
+        self.assertTrue(alert_us({'type': 'alert', 'region': 'us-east1'}))
+        self.assertFalse(alert_us({'type': 'alert', 'region': 'eu-west1'}))
+        self.assertFalse(alert_us({'region': 'us-east1'}))
+        
+        either = compile_filter('(attributes.a = "1" OR attributes.b = "2") AND NOT attributes:muted')
+        self.assertTrue(either({'b': '2'}))
+        self.assertFalse(either({'b': '2', 'muted': ''}))
+        self.assertTrue(compile_filter('attributes.type != "alert"')({}))
+    
+    def test_invalid_filter_rejected(self):
+        """Test that malformed expressions raise ValueError."""
+        for expression in ['attributes.type', 'attributes.type = alert', 'attributes.a = "1" AND', 'type = "x"']:
+            with self.assertRaises(ValueError):
+                compile_filter(expression)
+    
+    def test_filter_index_routes_by_equality_terms(self):
+        """Test that indexed filters are only evaluated for matching terms."""
+        index = FilterIndex()
+        index.add('all', None)
+        index.add('alerts', compile_filter('attributes.type = "alert"'))
+        index.add('us', compile_filter('hasPrefix(attributes.region, "us")'))
+        
+        self.assertEqual(sorted(index.match({'type': 'alert'})), ['alerts', 'all'])
+        self.assertEqual(sorted(index.match({'type': 'info', 'region': 'us-1'})), ['all', 'us'])
+        
+        index.remove('alerts')
+        self.assertEqual(index.match({'type': 'alert'}), ['all'])
+    
+    def test_pull_and_push_honor_filter(self):
+        """Test that filtered subscriptions only receive matching messages."""
+        agent = PubSubAgent()
+        agent.create_topic('events')
+        agent.create_subscription('alerts', 'events', filter_expression='attributes.type = "alert"')
+        received = []
+        agent.subscribe('alerts', lambda message: received.append(message['message_id']))
+        
+        alert_id = agent.publish_message('events', {'n': 1}, attributes={'type': 'alert'})
+        agent.publish_message('events', {'n': 2}, attributes={'type': 'info'})
+        agent.wait_for_subscribers(timeout=5)
+        
+        self.assertEqual(received, [alert_id])
+        self.assertEqual([m['message_id'] for m in agent.pull_messages('alerts')], [alert_id])
+        agent.shutdown()
+    
+    def test_create_subscription_rejects_bad_filter(self):
+        """Test that filters are validated when the subscription is created."""
+        agent = PubSubAgent()
+        agent.create_topic('events')
+        with self.assertRaises(ValueError):
+            agent.create_subscription('bad', 'events', filter_expression='attributes.type ==')
+        self.assertEqual(agent.list_subscriptions('events'), [])
+
+
+class TestPubSubBatching(unittest.TestCase):
+    """Test the background publish batcher."""
+    
+    def setUp(self):
+        """Initialize a topic with a pull subscription."""
+        self.agent = PubSubAgent(config={'max_batch_size': 5, 'batch_timeout_ms': 50})
+        self.agent.create_topic('events')
+        self.agent.create_subscription('sub', 'events')
+    
+    def tearDown(self):
+        self.agent.shutdown()
+    
+    def test_flush_commits_pending_messages(self):
+        """Test that flush resolves futures in publish order."""
+        futures = [self.agent.publish_async('events', {'n': i}) for i in range(3)]
+        self.assertTrue(self.agent.flush(timeout=5))
+        
+        ids = [f.result(timeout=0) for f in futures]
+        pulled = self.agent.pull_messages('sub', max_messages=10)
+        self.assertEqual([m['message_id'] for m in pulled], ids)
+        self.assertEqual(len({m['publish_time'] for m in pulled}), 1)
+    
+    def test_full_batch_commits_without_flush(self):
+        """Test that reaching max_batch_size commits the batch."""
+        futures = [self.agent.publish_async('events', {'n': i}) for i in range(5)]
+        self.assertEqual(len({f.result(timeout=5) for f in futures}), 5)
+    
+    def test_batch_timeout_commits_partial_batch(self):
+        """Test that a partial batch is committed after batch_timeout_ms."""
+        future = self.agent.publish_async('events', {'n': 1})
+        self.assertTrue(future.result(timeout=5))
+        self.assertEqual(self.agent.batcher.pending(), 0)
+    
+    def test_oversized_message_fails_its_future_only(self):
+        """Test that a rejected message does not fail the rest of its batch."""
+        self.agent.config['max_message_size'] = 20
+        ok = self.agent.publish_async('events', {'n': 1})
+        too_big = self.agent.publish_async('events', {'payload': 'x' * 100})
+        self.agent.flush(timeout=5)
+        
+        self.assertTrue(ok.result(timeout=0))
+        with self.assertRaises(ValueError):
+            too_big.result(timeout=0)
+    
+    def test_publish_batch_returns_ids(self):
+        """Test the synchronous batch path."""
+        ids = self.agent.publish_batch('events', [{'n': i} for i in range(4)])
+        self.assertEqual(len(set(ids)), 4)
+        with self.assertRaises(ValueError):
+            self.agent.publish_batch('events', [{'n': i} for i in range(6)])
+    
+    def test_publish_batch_results_parallel_to_inputs(self):
+        """Test that a rejected message leaves None in its place rather than shifting the IDs."""
+        self.agent.config['max_message_size'] = 20
+        ids = self.agent.publish_batch('events', [{'payload': 'x' * 100}, {'n': 1}, {'payload': 'y' * 100}])
+        
+        self.assertEqual(len(ids), 3)
+        self.assertIsNone(ids[0])
+        self.assertIsNone(ids[2])
+        self.assertIsNotNone(ids[1])
+
+
+class TestPubSubDurableStorage(unittest.TestCase):
+    """Test the on-disk segment log storage mode."""
+    
+    def setUp(self):
+        """Create a scratch storage directory."""
+        self.storage_dir = tempfile.mkdtemp()
+        self.config = {'storage_mode': 'disk', 'storage_dir': self.storage_dir,
+                       'fsync_policy': 'never', 'segment_bytes': 4096}
+    
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+    
+    def test_messages_survive_restart(self):
+        """Test that unread messages are replayed after reopening."""
+        agent = PubSubAgent(config=self.config)
+        agent.create_topic('events')
+        agent.create_subscription('sub', 'events')
+        ids = [agent.publish_message('events', {'n': i}) for i in range(100)]
+        agent.pull_messages('sub', max_messages=40, auto_ack=True)
+        agent.shutdown()
+        
+        restarted = PubSubAgent(config=self.config)
+        restarted.create_topic('events')
+        restarted.create_subscription('sub', 'events')
+        pulled = restarted.pull_messages('sub', max_messages=100, auto_ack=True)
+        restarted.shutdown()
+        
+        self.assertEqual([m['message_id'] for m in pulled], ids[40:])
+    
+    def test_unacked_messages_redelivered_after_restart(self):
+        """Test that leased but unacknowledged messages are not lost."""
+        agent = PubSubAgent(config=self.config)
+        agent.create_topic('events')
+        agent.create_subscription('sub', 'events')
+        ids = [agent.publish_message('events', {'n': i}) for i in range(5)]
+        agent.pull_messages('sub', max_messages=5)
+        agent.acknowledge_messages('sub', ids[:2])
+        agent.shutdown()
+        
+        restarted = PubSubAgent(config=self.config)
+        restarted.create_topic('events')
+        restarted.create_subscription('sub', 'events')
+        pulled = restarted.pull_messages('sub', max_messages=10)
+        restarted.shutdown()
+        
+        self.assertEqual([m['message_id'] for m in pulled], ids[2:])
+    
+    def test_index_uses_publish_time(self):
+        """Test that the segment time index holds the publish time messages report."""
+        agent = PubSubAgent(config=self.config)
+        agent.create_topic('events')
+        agent.create_subscription('sub', 'events')
+        for i in range(3):
+            agent.publish_message('events', {'n': i})
+        pulled = agent.pull_messages('sub')  # Leased, so still retained
+        topic_log = agent.topic_logs['events']
+        
+        self.assertEqual(topic_log.offset_for_time(pulled[1].publish_time_ns), 1)
+        self.assertEqual(topic_log.offset_for_time(pulled[1].publish_time_ns + 1), 2)
+        agent.shutdown()
+    
+    def test_sealed_segments_are_synced(self):
+        """Test that a batch rolling segments mid-write fsyncs the segments it seals."""
+        synced = set()
+        fsync = os.fsync
+        
+        def recording_fsync(fd):
+            synced.add(os.fstat(fd).st_ino)
+            fsync(fd)
+        for policy in ('always', 'never'):
+            synced.clear()
+            log = SegmentLog(os.path.join(self.storage_dir, policy), segment_bytes=256, fsync_policy=policy)
+            with mock.patch('os.fsync', recording_fsync):
+                log.append_batch([{'n': i, 'pad': 'x' * 20} for i in range(50)])
+            sealed = [os.stat(segment.log_path).st_ino for segment in log._segments[:-1]]
+            self.assertGreater(len(sealed), 2)
+            self.assertEqual(set(sealed) <= synced, policy == 'always')
+            self.assertEqual(bool(synced), policy == 'always')
+            log.close()
+    
+    def test_torn_tail_record_is_dropped(self):
+        """Test recovery truncates a partially written final record."""
+        log = SegmentLog(os.path.join(self.storage_dir, 'events'), fsync_policy='never')
+        log.append_batch([{'n': i} for i in range(3)])
+        log.close()
+        
+        segment_path = os.path.join(self.storage_dir, 'events', f"{0:020d}.log")
+        with open(segment_path, 'ab') as f:
+            f.write(b'\x10\x00\x00')
+            
+        reopened = SegmentLog(os.path.join(self.storage_dir, 'events'), fsync_policy='never')
+        self.assertEqual(reopened.end_offset, 3)
+        self.assertEqual(reopened.append({'n': 3}), 3)
+        self.assertEqual([m['n'] for m in reopened.read(0, 10)], [0, 1, 2, 3])
+        reopened.close()
+    
+    def test_segments_deleted_whole(self):
+        """Test that trimming and retention reclaim whole sealed segments."""
+        log = SegmentLog(os.path.join(self.storage_dir, 'events'), segment_bytes=256,
+                         fsync_policy='never')
+        for i in range(50):
+            log.append({'n': i, 'pad': 'x' * 20})
+        segments = len(log._segments)
+        self.assertGreater(segments, 2)
+        
+        log.trim(25)
+        self.assertLess(len(log._segments), segments)
+        self.assertEqual(log.read(0, 1)[0]['n'], 25)
+        
+        log.expire(time.time_ns() + 1)
+        self.assertEqual(len(log._segments), 1)
+        self.assertEqual(log.end_offset, 50)
+        log.close()
+    
+    def test_offset_for_time_searches_segments(self):
+        """Test the time index across many segments."""
+        log = SegmentLog(os.path.join(self.storage_dir, 'timed'), segment_bytes=256,
+                         fsync_policy='never')
+        for i in range(50):
+            log.append_batch([{'n': i}], timestamp_ns=1000 + i * 10)
+        
+        self.assertGreater(len(log._segments), 3)
+        self.assertEqual(log.offset_for_time(0), 0)
+        self.assertEqual(log.offset_for_time(1255), 26)
+        self.assertEqual(log.offset_for_time(1260), 26)
+        self.assertEqual(log.offset_for_time(10 ** 6), 50)
+        log.trim(30)
+        self.assertEqual(log.offset_for_time(0), 30)
+        log.close()
+
+
+class TestPubSubEmulator(unittest.TestCase):
+    """Test the HTTP emulator front-end."""
+    
+    def setUp(self):
+        """Start an emulator on a free port."""
+        self.emulator = PubSubEmulator(port=0, pull_wait_seconds=0.2).start()
+        host, port = self.emulator.server.server_address[:2]
+        self.connection = http.client.HTTPConnection(host, port, timeout=10)
+    
+    def tearDown(self):
+        """Stop the emulator."""
+        self.connection.close()
+        self.emulator.stop()
+        self.emulator.agent.shutdown()
+    
+    def call(self, method, path, body=None):
+        self.connection.request(method, '/v1/projects/test' + path, json.dumps(body or {}))
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+    
+    def test_publish_pull_acknowledge(self):
+        """Test a REST round trip over one keep-alive connection."""
+        self.call('PUT', '/topics/events')
+        self.call('PUT', '/subscriptions/sub', {'topic': 'projects/test/topics/events'})
+        data = base64.b64encode(b'hello').decode()
+        status, body = self.call('POST', '/topics/events:publish',
+                                 {'messages': [{'data': data, 'attributes': {'k': 'v'}}]})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body['messageIds']), 1)
+        
+        status, body = self.call('POST', '/subscriptions/sub:pull', {'maxMessages': 10})
+        received = body['receivedMessages']
+        self.assertEqual(base64.b64decode(received[0]['message']['data']), b'hello')
+        self.assertEqual(received[0]['message']['attributes'], {'k': 'v'})
+        
+        self.call('POST', '/subscriptions/sub:acknowledge', {'ackIds': [received[0]['ackId']]})
+        self.assertEqual(self.emulator.agent.get_subscription_stats('sub')['outstanding'], 0)
+    
+    def test_missing_resource_returns_not_found(self):
+        """Test the Google error payload for unknown topics."""
+        status, body = self.call('POST', '/topics/missing:publish', {'messages': [{'data': ''}]})
+        self.assertEqual(status, 404)
+        self.assertEqual(body['error']['status'], 'NOT_FOUND')
+    
+    def test_streaming_pull_respects_flow_control(self):
+        """Test that a stream stops delivering at maxOutstandingMessages."""
+        self.call('PUT', '/topics/events')
+        self.call('PUT', '/subscriptions/sub', {'topic': 'projects/test/topics/events'})
+        self.call('POST', '/topics/events:publish',
+                  {'messages': [{'data': ''} for _ in range(5)]})
+        
+        host, port = self.emulator.server.server_address[:2]
+        stream = http.client.HTTPConnection(host, port, timeout=10)
+        stream.request('POST', '/v1/projects/test/subscriptions/sub:streamingPull',
+                       json.dumps({'maxOutstandingMessages': 2}))
+        response = stream.getresponse()
+        first = json.loads(response.readline())
+        self.assertEqual(len(first['receivedMessages']), 2)
+        
+        time.sleep(0.3)
+        self.assertEqual(self.emulator.agent.get_subscription_stats('sub')['outstanding'], 2)
+        self.call('POST', '/subscriptions/sub:acknowledge',
+                  {'ackIds': [m['ackId'] for m in first['receivedMessages']]})
+        second = json.loads(response.readline())
+        self.assertEqual(len(second['receivedMessages']), 2)
+        stream.close()
+    
+    def test_metrics_endpoint(self):
+        """Test that /metrics serves the Prometheus exposition."""
+        self.call('PUT', '/topics/events')
+        self.connection.request('GET', '/metrics')
+        response = self.connection.getresponse()
+        text = response.read().decode()
+        
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response.getheader('Content-Type').startswith('text/plain; version=0.0.4'))
+        self.assertIn('pubsub_topic_queue_messages{topic="events"} 0', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,7 @@ logging.basicConfig(filename=r'C:\AI\credentials\integration.log', level=logging
 class MasterIntegrator:
     def __init__(self):
         self.agents: Dict[str, Any] = {}
+        self.integration_cycle = 0  # Completed run_integrations passes
         self.load_agents()
 
     def load_agents(self):
@@ -55,7 +56,8 @@ class MasterIntegrator:
             logging.error(f"Firestore agent failed: {e}")
 
         try:
-            self.agents['pubsub'] = PubSubAgent()
+            # Dedup window spans a full cycle so error retries are not republished
+            self.agents['pubsub'] = PubSubAgent(config={'dedup_window_seconds': 3600})
             logging.info("Pub/Sub agent loaded")
         except Exception as e:
             logging.error(f"Pub/Sub agent failed: {e}")
@@ -119,7 +121,12 @@ class MasterIntegrator:
                 'agents': list(self.agents.keys())
             }
             
-            msg_id = pubsub.publish_message('system-events', event)
+            # Error retries rerun this within the same cycle; the key makes
+            # the republish a no-op
+            msg_id = pubsub.publish_message(
+                'system-events', event,
+                idempotency_key=f"system.initialized:{self.integration_cycle}"
+            )
             logging.info(f"Event published to Pub/Sub: {msg_id}")
 
     def subscribe_to_events(self) -> None:
@@ -151,6 +158,7 @@ class MasterIntegrator:
                 self.publish_events_to_pubsub()
                 self.subscribe_to_events()
                 self.monitor_hosting()
+                self.integration_cycle += 1
                 time.sleep(3600)  # Every hour
             except Exception as e:
                 logging.error(f"Integration error: {e}")
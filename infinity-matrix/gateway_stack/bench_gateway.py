@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Gateway Load Benchmark - Import time and requests per second of the API gateway on one uvicorn worker
+Drives /health and /agents/<name> over keep-alive connections and checks every interaction was logged
+
+Run from gateway_stack/: python bench_gateway.py [--requests N] [--concurrency C] [--import-only]
+Exits with status 1 if importing api_gateway takes longer than its IMPORT_BUDGET_SECONDS.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Any
+
+GATEWAY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _environment() -> Dict[str, str]:
+    """Environment for running the gateway from a scratch directory, without GCP credentials."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [GATEWAY_DIR, os.environ.get('PYTHONPATH')])))
+    env.pop('GOOGLE_APPLICATION_CREDENTIALS', None)
+    return env
+
+
+def measure_import(directory: str, runs: int = 3) -> Dict[str, Any]:
+    """Best of several cold imports of api_gateway in fresh interpreters, against its budget."""
+    script = ('import json, time; started = time.perf_counter(); import api_gateway; '
+              'print(json.dumps([time.perf_counter() - started, api_gateway.IMPORT_BUDGET_SECONDS]))')
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', script], cwd=directory, env=_environment(),
+                                capture_output=True, text=True, check=True).stdout
+        seconds, budget = json.loads(output.splitlines()[-1])
+        timings.append(seconds)
+    return {'import_seconds': round(min(timings), 3), 'import_budget_seconds': budget,
+            'import_within_budget': min(timings) <= budget}
+
+
+def _start_gateway(directory: str, port: int) -> subprocess.Popen:
+    """Run api_gateway:app under uvicorn with one worker, in a scratch working directory."""
+    os.makedirs(os.path.join(directory, '.prooftest'), exist_ok=True)
+    with open(os.path.join(directory, '.prooftest', 'agent_registry.json'), 'w') as f:
+        json.dump({'bench-agent': {'role': 'benchmark'}}, f)
+    return subprocess.Popen([sys.executable, '-m', 'uvicorn', 'api_gateway:app', '--host', '127.0.0.1',
+                             '--port', str(port), '--workers', '1', '--log-level', 'warning',
+                             '--no-access-log'], cwd=directory, env=_environment())
+
+
+async def _wait_ready(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError('Gateway did not start')
+            await asyncio.sleep(0.1)
+
+
+def _request(method: str, path: str, body: bytes = b'') -> bytes:
+    return (f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    """Read one response; returns its status code."""
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def _client(port: int, requests: List[bytes], latencies: List[float]) -> int:
+    """Send requests one after another on one keep-alive connection; returns the failures."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    failures = 0
+    for request in requests:
+        started = time.perf_counter()
+        writer.write(request)
+        if await _read_response(reader) != 200:
+            failures += 1
+        latencies.append(time.perf_counter() - started)
+    writer.close()
+    return failures
+
+
+async def _load(port: int, count: int, concurrency: int) -> Dict[str, Any]:
+    health = _request('GET', '/health')
+    interact = _request('POST', '/agents/bench-agent', json.dumps({'prompt': 'ping'}).encode())
+    requests = [interact if n % 2 else health for n in range(count)]
+    latencies: List[float] = []
+    started = time.perf_counter()
+    failures = await asyncio.gather(*(_client(port, requests[n::concurrency], latencies)
+                                      for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': count,
+        'concurrency': concurrency,
+        'failures': sum(failures),
+        'requests_per_second': round(count / elapsed),
+        'latency_ms_p50': round(statistics.median(latencies) * 1000, 2),
+        'latency_ms_p99': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        'interactions_sent': len(requests[1::2])
+    }
+
+
+def run(count: int, concurrency: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix='gateway-bench-') as directory:
+        imported = measure_import(directory)
+        port = _free_port()
+        server = _start_gateway(directory, port)
+        try:
+            asyncio.run(_wait_ready(port))
+            warm_up = asyncio.run(_load(port, max(concurrency, count // 10), concurrency))
+            result = asyncio.run(_load(port, count, concurrency))
+            result['interactions_sent'] += warm_up['interactions_sent']
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        # The interaction log is flushed on shutdown: every interaction should be on disk
+        with open(os.path.join(directory, '.prooftest', 'agent_llm_interactions.json')) as f:
+            logged = sum(1 for _ in f)
+        result['interactions_logged'] = logged
+        return dict(imported, **result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='API gateway load benchmark')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--import-only', action='store_true', help='Only check the import-time budget')
+    args = parser.parse_args()
+    if args.import_only:
+        with tempfile.TemporaryDirectory(prefix='gateway-bench-') as directory:
+            result = measure_import(directory)
+    else:
+        result = run(args.requests, args.concurrency)
+    print(json.dumps(result, indent=2))
+    if not result['import_within_budget']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""In-process tests for the API gateway (skipped when fastapi or httpx is not installed)."""
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import httpx
+    import api_gateway
+except ImportError:
+    httpx = api_gateway = None
+
+
+@unittest.skipIf(api_gateway is None, "fastapi and httpx are required")
+class TestGatewayApp(unittest.IsolatedAsyncioTestCase):
+    """Test the app through its lifespan, with the logger and registry in a scratch directory."""
+
+    def setUp(self):
+        """Point the gateway at a scratch registry and interaction log, without GCP credentials."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_path = os.path.join(directory.name, "agent_llm_interactions.json")
+        self.registry_path = os.path.join(directory.name, "agent_registry.json")
+        with open(self.registry_path, "w") as f:
+            json.dump({"scout": {"role": "research"}}, f)
+
+        self.logger = api_gateway.InteractionLogger(self.log_path)
+        self.registry = api_gateway.AgentRegistry(self.registry_path, poll_interval=0.05)
+        for patcher in (mock.patch.object(api_gateway, "interaction_logger", self.logger),
+                        mock.patch.object(api_gateway, "agent_registry", self.registry),
+                        mock.patch.dict(api_gateway.backends, {"agent_registry": "loading", "gcp": "starting"}),
+                        mock.patch.dict(os.environ, {"GOOGLE_APPLICATION_CREDENTIALS": ""})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=api_gateway.app), base_url="http://gateway")
+
+    async def wait_for(self, condition, timeout=5):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not condition():
+            self.assertLess(asyncio.get_running_loop().time(), deadline)
+            await asyncio.sleep(0.01)
+
+    async def test_agent_interactions_are_logged_on_shutdown(self):
+        """Test /agents and /agents/{name}, and that every interaction is on disk after shutdown."""
+        async with api_gateway.lifespan(api_gateway.app), self.client() as client:
+            await self.wait_for(lambda: self.registry.status == "ready")
+            self.assertEqual((await client.get("/agents")).json(), {"scout": {"role": "research"}})
+            for n in range(50):
+                response = await client.post("/agents/scout", json={"prompt": f"ping {n}"})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["response"], "Simulated response from scout")
+            self.assertEqual((await client.post("/agents/scout")).status_code, 200)
+
+        with open(self.log_path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 51)
+        self.assertEqual(records[0], {"agent": "scout", "prompt": "ping 0",
+                                      "response": "Simulated response from scout"})
+        self.assertEqual(self.logger.get_stats()["written"], 51)
+
+    async def test_health_is_degraded_while_backends_are_missing(self):
+        """Test that /health answers without credentials and reports each backend."""
+        os.remove(self.registry_path)
+        async with api_gateway.lifespan(api_gateway.app), self.client() as client:
+            await self.wait_for(lambda: api_gateway.backends["gcp"] != "starting")
+            await self.wait_for(lambda: self.registry.status != "loading")
+            health = (await client.get("/health")).json()
+            self.assertEqual(health["status"], "degraded")
+            self.assertTrue(health["backends"]["gcp"].startswith("unavailable"))
+            self.assertTrue(health["backends"]["agent_registry"].startswith("unavailable"))
+
+            with open(self.registry_path, "w") as f:
+                json.dump({"scout": {}}, f)
+            await self.wait_for(lambda: self.registry.status == "ready")
+            health = (await client.get("/health")).json()
+            self.assertEqual(health["backends"]["agent_registry"], "ready")
+            self.assertEqual((await client.get("/agents")).json(), {"scout": {}})
+
+
+@unittest.skipIf(api_gateway is None, "fastapi and httpx are required")
+class TestInteractionLogger(unittest.IsolatedAsyncioTestCase):
+    """Test the batched interaction log writer."""
+
+    async def test_bad_batch_does_not_stop_the_writer(self):
+        """Test that a record JSON cannot encode costs its batch only."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "interactions.json")
+            logger = api_gateway.InteractionLogger(path, max_pending=2, max_batch=1)
+            await logger.start()
+
+            async def log_all():
+                await logger.log({"agent": "scout", "payload": object()})
+                for n in range(5):
+                    await logger.log({"agent": "scout", "n": n})
+                await logger.stop()
+            await asyncio.wait_for(log_all(), 5)  # A dead writer would leave log() waiting forever
+
+            with open(path) as f:
+                self.assertEqual([json.loads(line)["n"] for line in f], list(range(5)))
+            self.assertEqual((logger.stats["errors"], logger.stats["written"]), (1, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()